@@ -1,136 +1,77 @@
+# Первым: bootstrap засекает время импорта приложения
+import bootstrap
+
 import os
+import hmac
+import json
 import logging
-from flask import Flask, request, jsonify
-import requests
-import threading
+import math
+from flask import Flask, request
 import time
 
-logging.basicConfig(level=logging.INFO)
+import broadcast
+import content
+import database
+import dedup
+import edit_cache
+import logging_setup
+import metrics
+import profiler
+import recorder
+import render_cache
+import telegram_client
+import tracing
+import webhook_monitor
+import webhook_reply
+from config import DEBUG_TOKEN, HEALTH_BACKLOG_RATIO, UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_QUEUE_PUT_TIMEOUT, WEBHOOK_REPLY
+from dispatch import Router, parse_command
+from logging_setup import CHATTY
+from render_cache import Screen
+from update_queue import UpdateQueue, QueueFull
+
+logging_setup.setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
-
-# Конфигурация
-ORG_INFO = {
-    'full_name': 'Автономная некоммерческая организация "Тольяттинская федерация фехтования"',
-    'short_name': 'АНО "Тольяттинская федерация фехтования"',
-    'inn': '6320267029',
-    'kpp': '632001001',
-    'ogrn': '1146300002793',
-    'account': '40703810212300001063',
-    'bank': 'ОАО АКБ "Авангард"',
-    'bik': '044525201',
-    'correspondent_account': '3010181000000000201'
-}
-
-DISTRICTS_INFO = {
-    'central': {
-        'name': 'Центральный район',
-        'chat_link': 'https://t.me/+ls3LxVHjH680MDdi',
-        'schedule': '''Пн - ОФП и фехтование 18:00
-Ср - ОФП и фехтование 18:00
-Сб - Фехтование 18:00''',
-        'address': 'Ленина 58, школа 91, корпус Б, малый зал',
-        'price': '2000 рублей в месяц'
-    },
-    'avtozavodsky': {
-        'name': 'Автозаводский район',
-        'chat_link': 'https://t.me/+IQpyrN7sq3c2ZjRi',
-        'bases': {
-            'volgar': {
-                'name': 'Волгарь',
-                'schedule': '''ПН: 16:00 средние и новички ОФП, 18:30 малыши и новички ОФП
-ВТ: 15:00 средние и новички фехтование, 16:30 новички (новый зал)
-СР: 17:15 новички все (новый зал)
-ЧТ: 15:00 средние и новички фехтование, 16:30 новички (новый зал)
-ПТ: 15:30 средние и новички фехтование
-СБ: 16:30-18:00 новички все (новый зал)''',
-                'address': 'ДС Волгарь, вход со стороны Веги, зал Фехтования'
-            },
-            'school69': {
-                'name': 'Школа 69',
-                'schedule': '''ПН: 15:30-16:30
-ВТ: 16:00-18:00
-СР: 15:30-16:30
-ЧТ: 16:00-18:00
-ПТ: 16:00-18:00
-СБ: Боевая в волгаре (уточнить время)
-ВСК: 12:00-14:00''',
-                'address': '13 квартал, 40 лет Победы, 120, Музыкальный зал'
-            },
-            'school66': {
-                'name': 'Школа 66',
-                'schedule': 'Уточняется в чате района',
-                'address': 'Уточняется в чате района'
-            }
-        },
-        'price': '2000 рублей в месяц'
-    },
-    'komso': {
-        'name': 'Комсомольский район',
-        'chat_link': 'https://t.me/+jO5wcwUbxq0wMjgy',
-        'schedule': '''Пн: 15:00 (ср/ст и новички), 17:00 (мл и новички)
-Вт: 9:00 (2 смена новички), 15:00 (мл), 16:00 (ср/ст)
-Ср: 16:00-18:00 ОФП
-Чт: 9:00 (2 смена), 15:00 (ср/мл), 16:00 (ст), 17:00 (мл и новички)
-Пт: 15:00 (ср/ст), 17:00 (мл)
-Сб: 14:00 ОФП (мл и новички)''',
-        'address': 'Мурысева 52а, вход со двора',
-        'price': '2000 рублей в месяц'
-    },
-    'zhig': {
-        'name': 'Жигулёвск',
-        'chat_link': 'https://t.me/+b4YyZF5QXts1NTVi',
-        'schedule': '''Ср: 16:30-18:00 ОФП
-Чт: 16:00-17:30 фехтование
-Сб: 15:30-17:00 фехтование и ОФП
-Вск: 13:00-14:00 ОФП и фехтование''',
-        'address': 'ДМО, Гидростроителей 10а',
-        'price': '2000 рублей в месяц'
-    }
-}
-
-DOCUMENTS_LIST = '''
-📋 <b>Необходимые документы:</b>
-
-• 4 фотографии 3x4
-• Копия свидетельства о рождении или паспорта с пропиской
-• Копия паспорта одного из родителей с пропиской
-• Копия СНИЛС ребенка
-• Копия ИНН ребенка
-• Справка из школы
-• Справка от педиатра, что здоров и может заниматься ФЕХТОВАНИЕМ
-• Доверенности, согласия и заявления (бланки выдаются на месте)
-
-⚠️ <b>Важно:</b> Документы можно принести после пробных тренировок!
-'''
 
-FAQ_TEXT = '''
-❓ <b>Частые вопросы:</b>
-
-<b>1. С чего начать?</b>
-Выберите район, придите на пробную тренировку. Все необходимое для первой тренировки: сменная обувь, спортивная форма, вода.
-
-<b>2. Когда нужно платить?</b>
-Оплата производится после пробных тренировок, когда вы приняли решение заниматься.
-
-<b>3. Нужно ли сразу приносить документы?</b>
-Нет, документы можно принести в течение первых недель занятий.
-
-<b>4. Сколько раз в неделю проходят тренировки?</b>
-Новички обычно занимаются 3 раза в неделю, затем количество тренировок может увеличиваться.
+# Функции для работы с Telegram API
+def _post_message(chat_id, payload):
+    if webhook_reply.defer('sendMessage', payload):
+        return True
+    
+    try:
+        response = telegram_client.call('sendMessage', payload)
+        if response.status_code == 200:
+            logger.info(f"✅ Message sent to {chat_id}", extra=CHATTY)
+            return True
+        else:
+            logger.error(f"❌ Failed to send message: {response.status_code} - {response.text}")
+            return False
+    except Exception as e:
+        logger.error(f"❌ Error sending message: {e}")
+        return False
 
-<b>5. Можно ли поменять район/базу?</b>
-Да, в течение пробного периода можно выбрать наиболее удобный вариант.
-'''
+def _post_edit(chat_id, message_id, payload):
+    if webhook_reply.defer('editMessageText', payload):
+        return True
+    
+    try:
+        response = telegram_client.call('editMessageText', payload)
+        if response.status_code == 200:
+            return True
+        if edit_cache.is_not_modified(response.text):
+            # Экран уже показан, например до перезапуска процесса
+            edit_cache.edits.not_modified()
+            return True
+    except Exception as e:
+        logger.error(f"❌ Error editing message: {e}")
+    edit_cache.edits.forget(chat_id, message_id)
+    return False
 
-# Функции для работы с Telegram API
 def send_message(chat_id, text, reply_markup=None, parse_mode='HTML'):
     """Отправка сообщения через Telegram API"""
-    url = f"{TELEGRAM_API_URL}/sendMessage"
     payload = {
         'chat_id': chat_id,
         'text': text,
@@ -139,21 +80,10 @@ def send_message(chat_id, text, reply_markup=None, parse_mode='HTML'):
     if reply_markup:
         payload['reply_markup'] = reply_markup
     
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code == 200:
-            logger.info(f"✅ Message sent to {chat_id}")
-            return True
-        else:
-            logger.error(f"❌ Failed to send message: {response.status_code} - {response.text}")
-            return False
-    except Exception as e:
-        logger.error(f"❌ Error sending message: {e}")
-        return False
+    return _post_message(chat_id, payload)
 
 def edit_message(chat_id, message_id, text, reply_markup=None, parse_mode='HTML'):
     """Редактирование сообщения через Telegram API"""
-    url = f"{TELEGRAM_API_URL}/editMessageText"
     payload = {
         'chat_id': chat_id,
         'message_id': message_id,
@@ -163,81 +93,43 @@ def edit_message(chat_id, message_id, text, reply_markup=None, parse_mode='HTML'
     if reply_markup:
         payload['reply_markup'] = reply_markup
     
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"❌ Error editing message: {e}")
-        return False
+    if edit_cache.edits.check(chat_id, message_id, text, reply_markup, parse_mode):
+        return True
+    return _post_edit(chat_id, message_id, payload)
+
+def show_screen(chat_id, message_id, screen, text=None):
+    """Показ готового экрана из кэша: редактирование, если есть message_id, иначе отправка.
+
+    Если в сообщении уже этот экран, редактирование пропускается: на callback-запрос
+    к этому времени ответил dispatch_update.
+    """
+    if message_id:
+        shown = screen.text if text is None else text
+        if edit_cache.edits.check(chat_id, message_id, shown, screen.markup_json, screen.parse_mode):
+            return True
+        return _post_edit(chat_id, message_id, screen.payload(chat_id, message_id, text))
+    return _post_message(chat_id, screen.payload(chat_id, text=text))
 
 def answer_callback_query(callback_query_id, text=None):
     """Ответ на callback запрос"""
-    url = f"{TELEGRAM_API_URL}/answerCallbackQuery"
     payload = {
         'callback_query_id': callback_query_id
     }
     if text:
         payload['text'] = text
     
+    if webhook_reply.defer('answerCallbackQuery', payload):
+        return True
+    
     try:
-        response = requests.post(url, json=payload, timeout=5)
+        response = telegram_client.call('answerCallbackQuery', payload)
         return response.status_code == 200
     except Exception as e:
         logger.error(f"❌ Error answering callback: {e}")
         return False
 
-# Клавиатуры
-def get_main_menu_keyboard(is_admin=False):
-    """Клавиатура главного меню"""
-    keyboard = {
-        'inline_keyboard': [
-            [{'text': '🏃 Выбрать район', 'callback_data': 'main_districts'}],
-            [{'text': '💳 Реквизиты оплаты', 'callback_data': 'main_payment'}],
-            [{'text': '📋 Список документов', 'callback_data': 'main_documents'}],
-            [{'text': '❓ Частые вопросы', 'callback_data': 'main_faq'}]
-        ]
-    }
-    if is_admin:
-        keyboard['inline_keyboard'].append([{'text': '🛠 Админ-панель', 'callback_data': 'admin_back'}])
-    return keyboard
-
-def get_districts_keyboard():
-    """Клавиатура выбора района"""
-    return {
-        'inline_keyboard': [
-            [{'text': 'Центральный район', 'callback_data': 'district_central'}],
-            [{'text': 'Автозаводский район', 'callback_data': 'district_avtozavodsky'}],
-            [{'text': 'Комсомольский район', 'callback_data': 'district_komso'}],
-            [{'text': 'Жигулёвск', 'callback_data': 'district_zhig'}],
-            [{'text': '◀️ Назад', 'callback_data': 'back_to_main'}]
-        ]
-    }
-
-def get_back_to_main_keyboard():
-    """Клавиатура с кнопкой назад"""
-    return {
-        'inline_keyboard': [
-            [{'text': '🏠 В главное меню', 'callback_data': 'back_to_main'}]
-        ]
-    }
-
-def get_admin_menu_keyboard():
-    """Клавиатура админ-панели"""
-    return {
-        'inline_keyboard': [
-            [{'text': '📊 Статистика', 'callback_data': 'admin_stats'}],
-            [{'text': '📢 Рассылка', 'callback_data': 'admin_broadcast'}],
-            [{'text': '👥 Поиск пользователя', 'callback_data': 'admin_search'}],
-            [{'text': '🏠 Пользовательское меню', 'callback_data': 'back_to_main'}]
-        ]
-    }
-
-# Обработчики команд
-def handle_start_command(chat_id, user_id, username, first_name):
-    """Обработчик команды /start"""
-    logger.info(f"👤 User {user_id} started the bot")
-    
-    welcome_text = f"""
+# Экраны, которые есть только во Flask-версии бота
+WELCOME_TEXT = """
 🤺 Добро пожаловать в <b>Тольяттинскую федерацию фехтования</b>, {first_name}!
 
 Здесь вы можете:
@@ -248,430 +140,541 @@ def handle_start_command(chat_id, user_id, username, first_name):
 
 Выберите нужный раздел:
     """
+
+@render_cache.register
+def build_app_screens(content):
+    return {
+        'app_welcome': Screen(WELCOME_TEXT.format(first_name=''), render_cache.main_menu_keyboard()),
+        'app_welcome_admin': Screen(WELCOME_TEXT.format(first_name=''), render_cache.main_menu_keyboard(True)),
+        'app_admin_stats': Screen("""
+📊 <b>Статистика бота</b>
+
+👥 <b>Пользователи:</b>
+• Всего: информация в разработке
+• Активных: информация в разработке
+
+🛠 <b>Админ-функции:</b>
+• Поиск пользователя: в разработке
+    """, render_cache.back_to_admin_keyboard()),
+        'app_admin_search': Screen("""
+👥 <b>Поиск пользователя</b>
+
+Функция поиска пользователя находится в разработке.
+
+В будущем здесь можно будет:
+• Искать пользователей по ID, имени или username
+• Просматривать статистику конкретного пользователя
+• Отправлять сообщения конкретным пользователям
+    """, render_cache.back_to_admin_keyboard()),
+    }
+
+# Обработчики команд
+def is_admin_user(user_id):
+    """Проверка прав администратора"""
+    return content.is_admin(user_id)
+
+def handle_start_command(chat_id, user_id, username, first_name):
+    """Обработчик команды /start"""
+    logger.info(f"👤 User {user_id} started the bot", extra=CHATTY)
     
     # Проверяем, является ли пользователь администратором
-    admins_str = os.getenv('ADMINS', '')
-    admins = [int(admin_id.strip()) for admin_id in admins_str.split(',') if admin_id.strip().isdigit()]
-    is_admin = user_id in admins
+    is_admin = is_admin_user(user_id)
     
-    keyboard = get_main_menu_keyboard(is_admin)
-    return send_message(chat_id, welcome_text, keyboard)
+    screen = render_cache.get('app_welcome_admin' if is_admin else 'app_welcome')
+    text = WELCOME_TEXT.format(first_name=first_name) if first_name else None
+    return show_screen(chat_id, None, screen, text)
 
 def handle_districts_selection(chat_id, message_id, district_key):
     """Обработчик выбора района"""
-    district_info = DISTRICTS_INFO.get(district_key)
-    if not district_info:
+    screen = render_cache.get(f'district_{district_key}')
+    if not screen:
         return False
     
-    if district_key == 'avtozavodsky':
-        return handle_avtozavodsky_district(chat_id, message_id, district_info)
-    
-    message = format_district_info(district_info)
-    keyboard = {
-        'inline_keyboard': [
-            [{'text': '💳 Реквизиты оплаты', 'callback_data': 'main_payment'}],
-            [{'text': '📋 Документы', 'callback_data': 'main_documents'}],
-            [{'text': '◀️ Выбрать другой район', 'callback_data': 'main_districts'}],
-            [{'text': '🏠 В главное меню', 'callback_data': 'back_to_main'}]
-        ]
-    }
-    
-    if message_id:
-        return edit_message(chat_id, message_id, message, keyboard)
-    else:
-        return send_message(chat_id, message, keyboard)
-
-def handle_avtozavodsky_district(chat_id, message_id, district_info):
-    """Обработчик Автозаводского района (выбор базы)"""
-    keyboard = {
-        'inline_keyboard': []
-    }
-    
-    for base_key, base_info in district_info['bases'].items():
-        keyboard['inline_keyboard'].append([{'text': base_info['name'], 'callback_data': f'base_{base_key}'}])
-    
-    keyboard['inline_keyboard'].append([{'text': '◀️ Назад к районам', 'callback_data': 'main_districts'}])
-    
-    message = "🏢 <b>Автозаводский район</b>\n\nВыберите удобную вам базу:"
-    
-    if message_id:
-        return edit_message(chat_id, message_id, message, keyboard)
-    else:
-        return send_message(chat_id, message, keyboard)
+    return show_screen(chat_id, message_id, screen)
 
 def handle_base_selection(chat_id, message_id, base_key):
     """Обработчик выбора базы"""
-    district_info = DISTRICTS_INFO['avtozavodsky']
-    base_info = district_info['bases'].get(base_key)
-    
-    if not base_info:
+    screen = render_cache.get(f'base_{base_key}')
+    if not screen:
         return False
     
-    message = format_base_info(district_info, base_info)
-    keyboard = {
-        'inline_keyboard': [
-            [{'text': '💳 Реквизиты оплаты', 'callback_data': 'main_payment'}],
-            [{'text': '📋 Документы', 'callback_data': 'main_documents'}],
-            [{'text': '◀️ Выбрать другую базу', 'callback_data': 'district_avtozavodsky'}],
-            [{'text': '🏠 В главное меню', 'callback_data': 'back_to_main'}]
-        ]
-    }
-    
-    return edit_message(chat_id, message_id, message, keyboard)
+    return show_screen(chat_id, message_id, screen)
 
 def handle_payment_info(chat_id, message_id=None):
     """Обработчик информации об оплате"""
-    message = format_payment_info()
-    keyboard = get_back_to_main_keyboard()
-    
-    if message_id:
-        return edit_message(chat_id, message_id, message, keyboard)
-    else:
-        return send_message(chat_id, message, keyboard)
+    return show_screen(chat_id, message_id, render_cache.get('payment'))
 
 def handle_documents_info(chat_id, message_id=None):
     """Обработчик информации о документах"""
-    keyboard = get_back_to_main_keyboard()
-    
-    if message_id:
-        return edit_message(chat_id, message_id, DOCUMENTS_LIST, keyboard)
-    else:
-        return send_message(chat_id, DOCUMENTS_LIST, keyboard)
+    return show_screen(chat_id, message_id, render_cache.get('documents'))
 
 def handle_faq_info(chat_id, message_id=None):
     """Обработчик FAQ"""
-    keyboard = get_back_to_main_keyboard()
-    
-    if message_id:
-        return edit_message(chat_id, message_id, FAQ_TEXT, keyboard)
-    else:
-        return send_message(chat_id, FAQ_TEXT, keyboard)
+    return show_screen(chat_id, message_id, render_cache.get('faq'))
 
 def handle_admin_panel(chat_id, message_id=None):
     """Обработчик админ-панели"""
-    admins_str = os.getenv('ADMINS', '')
-    admins = [int(admin_id.strip()) for admin_id in admins_str.split(',') if admin_id.strip().isdigit()]
-    
-    admin_text = f"""
-🛠 <b>Панель администратора</b>
-
-👑 Администраторов: {len(admins)}
-Выберите действие:
-    """
-    
-    keyboard = get_admin_menu_keyboard()
-    
-    if message_id:
-        return edit_message(chat_id, message_id, admin_text, keyboard)
-    else:
-        return send_message(chat_id, admin_text, keyboard)
+    return show_screen(chat_id, message_id, render_cache.get('admin_panel'))
 
 def handle_admin_stats(chat_id, message_id):
     """Обработчик статистики"""
-    stats_text = """
-📊 <b>Статистика бота</b>
-
-👥 <b>Пользователи:</b>
-• Всего: информация в разработке
-• Активных: информация в разработке
-
-🛠 <b>Админ-функции:</b>
-• Рассылка: в разработке
-• Поиск пользователя: в разработке
-    """
-    
-    keyboard = {
-        'inline_keyboard': [
-            [{'text': '◀️ Назад в админку', 'callback_data': 'admin_back'}]
-        ]
-    }
-    
-    return edit_message(chat_id, message_id, stats_text, keyboard)
+    return show_screen(chat_id, message_id, render_cache.get('app_admin_stats'))
 
 def handle_admin_broadcast(chat_id, message_id):
     """Обработчик рассылки"""
-    broadcast_text = """
-📢 <b>Рассылка сообщений</b>
-
-Функция рассылки находится в разработке.
-
-В будущем здесь можно будет:
-• Отправлять сообщения всем пользователям
-• Отправлять сообщения только пользователям (без админов)
-• Просматривать историю рассылок
-    """
-    
-    keyboard = {
-        'inline_keyboard': [
-            [{'text': '◀️ Назад в админку', 'callback_data': 'admin_back'}]
-        ]
-    }
-    
-    return edit_message(chat_id, message_id, broadcast_text, keyboard)
+    return show_screen(chat_id, message_id, render_cache.get('broadcast_menu'))
+
+def handle_broadcast_request(chat_id, message_id, admin_id, segment):
+    """Выбор сегмента рассылки: следующее сообщение администратора станет ее текстом"""
+    broadcast.create_draft(admin_id, segment)
+    return show_screen(chat_id, message_id, render_cache.get('broadcast_prompt'))
+
+def handle_broadcast_progress(chat_id, message_id, broadcast_id):
+    """Экран прогресса рассылки"""
+    progress = broadcast.engine.progress(broadcast_id) if broadcast_id else None
+    if progress is None:
+        return show_screen(chat_id, message_id, render_cache.get('broadcast_menu'), text="📭 Рассылок еще не было.")
+    return show_screen(chat_id, message_id, Screen(
+        broadcast.format_progress(progress),
+        render_cache.broadcast_progress_keyboard(broadcast_id, progress['status'] == 'running')
+    ))
+
+def handle_broadcast_text(chat_id, admin_id, text):
+    """Текст от администратора с открытым черновиком: запуск рассылки"""
+    broadcast_id = broadcast.start_from_draft(admin_id, text)
+    if broadcast_id is None:
+        return False
+    logger.info(f"📢 Admin {admin_id} started broadcast {broadcast_id}")
+    handle_broadcast_progress(chat_id, None, broadcast_id)
+    return True
 
 def handle_admin_search(chat_id, message_id):
     """Обработчик поиска пользователя"""
-    search_text = """
-👥 <b>Поиск пользователя</b>
+    return show_screen(chat_id, message_id, render_cache.get('app_admin_search'))
 
-Функция поиска пользователя находится в разработке.
+# Flask маршруты
+@app.route('/')
+def home():
+    return "🤺 Fencing Bot is running!"
 
-В будущем здесь можно будет:
-• Искать пользователей по ID, имени или username
-• Просматривать статистику конкретного пользователя
-• Отправлять сообщения конкретным пользователям
-    """
+@app.route('/health')
+def health():
+    """Проверка готовности: база доступна, очереди не переполнены"""
+    checks = {}
+    ready = True
+    try:
+        database.get_db_connection().execute('SELECT 1').fetchone()
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = f'error: {e}'
+        ready = False
     
-    keyboard = {
-        'inline_keyboard': [
-            [{'text': '◀️ Назад в админку', 'callback_data': 'admin_back'}]
-        ]
-    }
+    for name, depth, capacity in (
+        ('update_queue', update_queue.depth(), update_queue.maxsize),
+        ('db_write_queue', database.event_writer.depth(), database.event_writer.maxsize),
+    ):
+        checks[name] = {'depth': depth, 'capacity': capacity}
+        if depth >= capacity * HEALTH_BACKLOG_RATIO:
+            ready = False
     
-    return edit_message(chat_id, message_id, search_text, keyboard)
+    checks['status'] = 'ok' if ready else 'unavailable'
+    return checks, 200 if ready else 503
 
-# Функции форматирования
-def format_district_info(district_info):
-    return f"""
-<b>{district_info['name']}</b>
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики процесса в формате Prometheus"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug')
+def debug():
+    """Страница диагностики"""
+    try:
+        return {
+            "bot_token_set": bool(BOT_TOKEN),
+            # Ответ getWebhookInfo из фонового опроса: страница не ждет Telegram
+            "webhook": webhook_monitor.monitor.get_info(),
+            "startup": bootstrap.get_stats(),
+            "telegram_client": telegram_client.get_stats(),
+            "update_queue": update_queue.get_stats(),
+            "dedup": dedup.updates.get_stats(),
+            "edit_cache": edit_cache.edits.get_stats(),
+            "sessions": database.get_session_cache_stats(),
+            "logging": logging_setup.get_stats(),
+            "broadcast": broadcast.engine.get_stats(),
+            "content_version": content.get_version(),
+            "render_cache_version": render_cache.get_version(),
+            "tracing": tracing.get_stats(),
+            "recorder": recorder.recorder.get_stats() if recorder.ENABLED else None,
+            "hot_routes": {
+                "commands": command_routes.hot_routes(),
+                "callbacks": callback_routes.hot_routes(),
+            },
+            "status": "running"
+        }
+    except Exception as e:
+        return {"error": str(e)}
 
-📍 <b>Адрес:</b> {district_info['address']}
+def _debug_token_ok():
+    token = request.headers.get('X-Debug-Token', '')
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
 
-📅 <b>Расписание:</b>
-{district_info['schedule']}
+@app.route('/debug/profile')
+def debug_profile():
+    """Запуск профиля всех потоков процесса на ?seconds=N секунд в фоновом потоке"""
+    if not _debug_token_ok():
+        return 'Forbidden', 403
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return 'seconds must be a number', 400
+    if not math.isfinite(seconds):
+        return 'seconds must be a finite number', 400
+    
+    try:
+        seconds = profiler.start(seconds)
+    except profiler.ProfileBusy:
+        return 'Profile is already running', 409
+    logger.info(f"🔬 Profile started for {seconds} s")
+    return {"status": "running", "seconds": seconds, "result": "/debug/profile/result"}, 202
+
+@app.route('/debug/profile/result')
+def debug_profile_result():
+    """Свернутые стеки последнего профиля; 202, пока он снимается"""
+    if not _debug_token_ok():
+        return 'Forbidden', 403
+    last = profiler.result()
+    if last['status'] is None:
+        return 'No profile has been taken', 404
+    if last['status'] == 'running':
+        return {"status": "running", "remaining": last['remaining']}, 202
+    if last['status'] == 'failed':
+        return {"status": "failed", "error": last['error']}, 500
+    logger.info(f"🔬 Profile taken: {last['stats']}")
+    headers = {f'X-Profile-{key.title()}': str(value) for key, value in last['stats'].items()}
+    return app.response_class(profiler.collapsed(last['stacks']), mimetype='text/plain', headers=headers)
+
+def get_update_chat_id(data):
+    """Возвращает chat_id обновления или None, если обновление не поддерживается"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        if 'message' in data:
+            return data['message']['chat']['id']
+        if 'callback_query' in data:
+            return data['callback_query']['message']['chat']['id']
+    except (KeyError, TypeError):
+        return None
+    return None
+
+# Маршруты. Все обработчики получают (chat_id, message_id, sender),
+# где sender - поле 'from' обновления; для команд message_id = None
+def deny_admin_panel(chat_id, message_id, sender):
+    send_message(chat_id, "⛔ У вас нет прав доступа к админ-панели.")
+
+def deny_admin_function(chat_id, message_id, sender):
+    send_message(chat_id, "⛔ У вас нет прав доступа к этой функции.")
+
+def reply_unknown_command(chat_id, message_id, sender):
+    send_message(chat_id, "Используйте команду /start для начала работы")
+
+command_routes = Router('app_commands', is_admin=is_admin_user, fallback=reply_unknown_command)
+callback_routes = Router('app_callbacks', is_admin=is_admin_user, denied=deny_admin_function)
+
+@command_routes.exact('start')
+def route_start(chat_id, message_id, sender):
+    handle_start_command(chat_id, sender['id'], sender.get('username', ''), sender.get('first_name', ''))
+
+@command_routes.exact('payment')
+@callback_routes.exact('main_payment')
+def route_payment(chat_id, message_id, sender):
+    handle_payment_info(chat_id, message_id)
+
+@command_routes.exact('documents')
+@callback_routes.exact('main_documents')
+def route_documents(chat_id, message_id, sender):
+    handle_documents_info(chat_id, message_id)
+
+@command_routes.exact('faq')
+@callback_routes.exact('main_faq')
+def route_faq(chat_id, message_id, sender):
+    handle_faq_info(chat_id, message_id)
+
+@command_routes.exact('admin', admin=True)
+@callback_routes.exact('admin_back', admin=True, denied=deny_admin_panel)
+def route_admin_panel(chat_id, message_id, sender):
+    handle_admin_panel(chat_id, message_id)
+
+@command_routes.exact('broadcast', admin=True)
+def route_broadcast_command(chat_id, message_id, sender):
+    handle_admin_broadcast(chat_id, None)
+
+@command_routes.exact('cancel', admin=True)
+def route_cancel_command(chat_id, message_id, sender):
+    if broadcast.discard_draft(sender['id']):
+        send_message(chat_id, "❎ Рассылка отменена.")
+    else:
+        send_message(chat_id, "Нечего отменять.")
 
-💬 <b>Чат для родителей:</b> {district_info['chat_link']}
+@command_routes.exact('stats', admin=True)
+def route_stats_command(chat_id, message_id, sender):
+    # Временная реализация команды /stats
+    send_message(chat_id, "📊 Статистика бота:\n\nФункция в разработке. Используйте админ-панель для просмотра статистики.")
 
-💰 <b>Стоимость:</b> {district_info['price']}
+@callback_routes.exact('back_to_main')
+def route_back_to_main(chat_id, message_id, sender):
+    handle_start_command(chat_id, sender['id'], '', '')
 
-👕 <b>С собой на тренировку:</b> сменные кроссовки для зала, белые носки, спортивная форма, бутылочка с водой
+@callback_routes.exact('main_districts')
+def route_districts(chat_id, message_id, sender):
+    show_screen(chat_id, message_id, render_cache.get('districts'))
 
-⚠️ <b>Важно:</b> пока не нужно платить и приносить документы! Все в процессе!
-    """
+@callback_routes.prefix('district_')
+def route_district(chat_id, message_id, sender, district_key):
+    handle_districts_selection(chat_id, message_id, district_key)
 
-def format_base_info(district_info, base_info):
-    return f"""
-<b>{district_info['name']} - {base_info['name']}</b>
+@callback_routes.prefix('base_')
+def route_base(chat_id, message_id, sender, base_key):
+    handle_base_selection(chat_id, message_id, base_key)
 
-📍 <b>Адрес:</b> {base_info['address']}
+@callback_routes.exact('admin_stats', admin=True)
+def route_admin_stats(chat_id, message_id, sender):
+    handle_admin_stats(chat_id, message_id)
 
-📅 <b>Расписание:</b>
-{base_info['schedule']}
+@callback_routes.exact('admin_broadcast', admin=True)
+def route_admin_broadcast(chat_id, message_id, sender):
+    handle_admin_broadcast(chat_id, message_id)
 
-💬 <b>Чат для родителей:</b> {district_info['chat_link']}
+@callback_routes.exact('admin_broadcast_all', admin=True)
+def route_admin_broadcast_all(chat_id, message_id, sender):
+    handle_broadcast_request(chat_id, message_id, sender['id'], broadcast.SEGMENT_ALL)
 
-💰 <b>Стоимость:</b> {district_info['price']}
+@callback_routes.exact('admin_broadcast_users', admin=True)
+def route_admin_broadcast_users(chat_id, message_id, sender):
+    handle_broadcast_request(chat_id, message_id, sender['id'], broadcast.SEGMENT_USERS)
 
-👕 <b>С собой на тренировку:</b> сменные кроссовки для зала, белые носки, спортивная форма, бутылочка с водой
+@callback_routes.exact('admin_broadcast_status', admin=True)
+def route_admin_broadcast_status(chat_id, message_id, sender):
+    handle_broadcast_progress(chat_id, message_id, broadcast.engine.latest())
 
-⚠️ <b>Важно:</b> пока не нужно платить и приносить документов! Все в процессе!
-    """
+@callback_routes.prefix('broadcast_refresh_', admin=True)
+def route_broadcast_refresh(chat_id, message_id, sender, broadcast_id):
+    if broadcast_id.isdigit():
+        handle_broadcast_progress(chat_id, message_id, int(broadcast_id))
 
-def format_payment_info():
-    return f"""
-💳 <b>Реквизиты для оплаты</b>
-
-🏛 <b>Полное наименование:</b> 
-{ORG_INFO['full_name']}
-
-📋 <b>Сокращенное:</b> 
-{ORG_INFO['short_name']}
-
-📊 <b>Реквизиты:</b>
-ИНН: {ORG_INFO['inn']}
-КПП: {ORG_INFO['kpp']}
-ОГРН: {ORG_INFO['ogrn']}
-Расчетный счет: {ORG_INFO['account']}
-Банк: {ORG_INFO['bank']}
-БИК: {ORG_INFO['bik']}
-Корр. счет: {ORG_INFO['correspondent_account']}
-
-💸 <b>Сумма:</b> 2000 рублей в месяц
-📝 <b>Назначение платежа:</b> "Добровольное пожертвование от [ФИО ребенка]"
-
-⚠️ <b>Важно:</b>
-• Оплата производится после пробных тренировок
-• В назначении платежа укажите ФИО ребенка
-• Сохраните чек об оплате
-• Квитанцию можно показать тренеру или отправить в чат группы
-    """
+@callback_routes.prefix('broadcast_cancel_', admin=True)
+def route_broadcast_cancel(chat_id, message_id, sender, broadcast_id):
+    if broadcast_id.isdigit():
+        broadcast.engine.cancel(int(broadcast_id))
+        handle_broadcast_progress(chat_id, message_id, int(broadcast_id))
 
-# Flask маршруты
-@app.route('/')
-def home():
-    return "🤺 Fencing Bot is running!"
+@callback_routes.exact('admin_search', admin=True)
+def route_admin_search(chat_id, message_id, sender):
+    handle_admin_search(chat_id, message_id)
 
-@app.route('/health')
-def health():
-    return "OK"
+command_routes.compile()
+callback_routes.compile()
 
-@app.route('/debug')
-def debug():
-    """Страница диагностики"""
-    try:
-        webhook_info = requests.get(f"{TELEGRAM_API_URL}/getWebhookInfo").json()
-        return {
-            "bot_token_set": bool(BOT_TOKEN),
-            "webhook_info": webhook_info,
-            "status": "running"
-        }
-    except Exception as e:
-        return {"error": str(e)}
+def process_update(data, trace=None):
+    """Обработка одного обновления Telegram; записи лога помечаются его update_id.
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Основной обработчик вебхуков от Telegram"""
-    try:
-        data = request.get_json()
-        logger.info(f"📨 Received update: {data}")
+    trace - трасса обновления, пришедшего через очередь; обработка в запросе
+    пишет этапы в трассу webhook().
+    """
+    with logging_setup.correlation(data.get('update_id')):
+        if trace is None:
+            dispatch_update(data)
+            return
+        trace.resume()
+        try:
+            with tracing.activate(trace):
+                dispatch_update(data)
+        finally:
+            trace.finish()
+
+def dispatch_update(data):
+    # Обрабатываем сообщения
+    if 'message' in data:
+        message = data['message']
         
-        # Обрабатываем сообщения
-        if 'message' in data:
-            message = data['message']
-            chat_id = message['chat']['id']
-            user_id = message['from']['id']
-            username = message['from'].get('username', '')
-            first_name = message['from'].get('first_name', '')
-            
-            # Проверяем права администратора
-            admins_str = os.getenv('ADMINS', '')
-            admins = [int(admin_id.strip()) for admin_id in admins_str.split(',') if admin_id.strip().isdigit()]
-            is_admin = user_id in admins
-            
-            if 'text' in message:
-                text = message['text']
-                
-                if text.startswith('/start'):
-                    handle_start_command(chat_id, user_id, username, first_name)
-                elif text.startswith('/payment'):
-                    handle_payment_info(chat_id)
-                elif text.startswith('/documents'):
-                    handle_documents_info(chat_id)
-                elif text.startswith('/faq'):
-                    handle_faq_info(chat_id)
-                elif text.startswith('/admin') and is_admin:
-                    handle_admin_panel(chat_id)
-                elif text.startswith('/stats') and is_admin:
-                    # Временная реализация команды /stats
-                    send_message(chat_id, "📊 Статистика бота:\n\nФункция в разработке. Используйте админ-панель для просмотра статистики.")
-                else:
-                    send_message(chat_id, "Используйте команду /start для начала работы")
+        if 'text' in message:
+            command = parse_command(message['text'])
+            sender = message['from']
+            # Обычный текст администратора после выбора сегмента - это текст рассылки
+            if command is None and is_admin_user(sender['id']) and broadcast.has_draft(sender['id']):
+                if handle_broadcast_text(message['chat']['id'], sender['id'], message['text']):
+                    return
+            command_routes.dispatch(command, message['from']['id'], message['chat']['id'], None, message['from'])
+    
+    # Обрабатываем callback запросы
+    elif 'callback_query' in data:
+        callback_query = data['callback_query']
+        sender = callback_query['from']
         
-        # Обрабатываем callback запросы
-        elif 'callback_query' in data:
-            callback_query = data['callback_query']
-            callback_data = callback_query['data']
-            chat_id = callback_query['message']['chat']['id']
-            message_id = callback_query['message']['message_id']
-            user_id = callback_query['from']['id']
-            
-            # Проверяем права администратора для админ-функций
-            admins_str = os.getenv('ADMINS', '')
-            admins = [int(admin_id.strip()) for admin_id in admins_str.split(',') if admin_id.strip().isdigit()]
-            is_admin = user_id in admins
-            
-            # Отвечаем на callback запрос
-            answer_callback_query(callback_query['id'])
-            
-            # Обрабатываем различные callback данные
-            if callback_data == 'back_to_main':
-                handle_start_command(chat_id, user_id, '', '')
-            
-            elif callback_data == 'main_districts':
-                keyboard = get_districts_keyboard()
-                edit_message(chat_id, message_id, "🏃 <b>Выберите район:</b>\n\nПосле выбора района вы получите:\n• Адрес и расписание\n• Ссылку на чат родителей\n• Всю необходимую информацию", keyboard)
-            
-            elif callback_data.startswith('district_'):
-                district_key = callback_data.replace('district_', '')
-                handle_districts_selection(chat_id, message_id, district_key)
-            
-            elif callback_data.startswith('base_'):
-                base_key = callback_data.replace('base_', '')
-                handle_base_selection(chat_id, message_id, base_key)
-            
-            elif callback_data == 'main_payment':
-                handle_payment_info(chat_id, message_id)
-            
-            elif callback_data == 'main_documents':
-                handle_documents_info(chat_id, message_id)
-            
-            elif callback_data == 'main_faq':
-                handle_faq_info(chat_id, message_id)
-            
-            # Обработка админ-панели
-            elif callback_data == 'admin_back':
-                if is_admin:
-                    handle_admin_panel(chat_id, message_id)
-                else:
-                    send_message(chat_id, "⛔ У вас нет прав доступа к админ-панели.")
-            
-            elif callback_data == 'admin_stats':
-                if is_admin:
-                    handle_admin_stats(chat_id, message_id)
-                else:
-                    send_message(chat_id, "⛔ У вас нет прав доступа к этой функции.")
-            
-            elif callback_data == 'admin_broadcast':
-                if is_admin:
-                    handle_admin_broadcast(chat_id, message_id)
-                else:
-                    send_message(chat_id, "⛔ У вас нет прав доступа к этой функции.")
-            
-            elif callback_data == 'admin_search':
-                if is_admin:
-                    handle_admin_search(chat_id, message_id)
-                else:
-                    send_message(chat_id, "⛔ У вас нет прав доступа к этой функции.")
+        # Отвечаем на callback запрос
+        answer_callback_query(callback_query['id'])
         
+        callback_routes.dispatch(
+            callback_query['data'], sender['id'],
+            callback_query['message']['chat']['id'], callback_query['message']['message_id'], sender
+        )
+
+def _edit_target(payload):
+    """(chat_id, message_id) вызова editMessageText; payload - dict или JSON-тело"""
+    if isinstance(payload, bytes):
+        payload = json.loads(payload)
+    return payload.get('chat_id'), payload.get('message_id')
+
+def send_deferred_calls(calls):
+    """Отправка отложенных вызовов Bot API, не поместившихся в ответ вебхука"""
+    for method, payload in calls:
+        try:
+            response = telegram_client.call(method, payload)
+            if response.status_code == 200:
+                continue
+            if method == 'editMessageText' and edit_cache.is_not_modified(response.text):
+                edit_cache.edits.not_modified()
+                continue
+            logger.error(f"❌ Failed to call {method}: {response.status_code} - {response.text}")
+        except Exception as e:
+            logger.error(f"❌ Error calling {method}: {e}")
+        if method == 'editMessageText':
+            # Содержимое сообщения неизвестно: следующее такое же редактирование нужно отправить
+            edit_cache.edits.forget(*_edit_target(payload))
+
+# Вызовы, которые не меняют сообщения чата: им все равно, выполнятся они до или после остальных
+_UNORDERED_METHODS = frozenset(('answerCallbackQuery',))
+
+def reply_inline(chat_id, data):
+    """Обработка обновления в запросе с ответом последним действием в теле вебхука.
+
+    Предыдущие вызовы уходят через очередь и могут выполниться после ответа вебхука,
+    поэтому последний вызов возвращается в ответе, только если остальные не зависят
+    от порядка (ответ на callback-запрос). Иначе все вызовы по порядку идут через очередь.
+    """
+    with webhook_reply.capture() as calls:
+        process_update(data)
+    if not calls:
         return 'OK'
     
-    except Exception as e:
-        logger.error(f"❌ Webhook error: {e}", exc_info=True)
-        return 'Error', 500
-
-def self_ping():
-    """Самопинг для поддержания активности"""
-    def ping_loop():
-        while True:
-            try:
-                response = requests.get("https://tolyatti-fencing-bot.onrender.com/health", timeout=10)
-                logger.info(f"✅ Self-ping successful: {response.status_code}")
-            except Exception as e:
-                logger.error(f"❌ Self-ping failed: {e}")
-            time.sleep(300)  # 5 минут
+    *earlier, (method, payload) = calls
+    if any(earlier_method not in _UNORDERED_METHODS for earlier_method, _ in earlier):
+        earlier.append((method, payload))
+        method = None
+    elif not telegram_client.limiter.try_acquire(method, chat_id):
+        # Лимит чата исчерпан: последний вызов тоже уходит через клиент, который дождется очереди
+        earlier.append((method, payload))
+        method = None
+    if earlier:
+        try:
+            update_queue.submit(chat_id, send_deferred_calls, earlier)
+        except QueueFull:
+            send_deferred_calls(earlier)
+    if method is None:
+        return 'OK'
+    if method == 'editMessageText':
+        # Результат вызова из ответа вебхука не виден: экран не запоминаем
+        edit_cache.edits.forget(*_edit_target(payload))
+    return app.response_class(webhook_reply.build_response(method, payload), mimetype='application/json')
+
+update_queue = UpdateQueue(
+    workers=UPDATE_WORKERS or 1,
+    maxsize=UPDATE_QUEUE_SIZE,
+    put_timeout=UPDATE_QUEUE_PUT_TIMEOUT
+)
+
+# Метрики вебхука и очередей
+WEBHOOK_SECONDS = metrics.Histogram(
+    'bot_webhook_seconds', 'Webhook request handling latency by outcome.', ('outcome',)
+)
+metrics.Gauge('bot_queue_depth', 'Items waiting in internal queues.', lambda: {
+    'updates': update_queue.depth(),
+    'db_writes': database.event_writer.depth(),
+    'logs': logging_setup.get_stats()['depth'],
+}, ('queue',))
+metrics.Gauge('bot_queue_capacity', 'Capacity of internal queues.', lambda: {
+    'updates': update_queue.maxsize,
+    'db_writes': database.event_writer.maxsize,
+}, ('queue',))
+metrics.Gauge('bot_broadcasts_running', 'Broadcasts sent by this process right now.',
+              lambda: len(broadcast.engine.get_stats()['running']))
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    """Прием вебхуков от Telegram: проверка и постановка в очередь"""
+    started = time.perf_counter()
+    trace = tracing.start('webhook')
+    with tracing.activate(trace):
+        with tracing.span('parse'):
+            data = request.get_json(silent=True)
+        recorder.record(data)
+        outcome, response = receive_update(data, trace)
+    WEBHOOK_SECONDS.observe(time.perf_counter() - started, (outcome,))
+    # Трассу обновления из очереди завершает рабочий поток
+    if trace is not None and outcome != 'queued':
+        trace.finish()
+    return response
+
+def receive_update(data, trace=None):
+    """Возвращает (исход, ответ вебхука); исход - метка для метрик"""
+    chat_id = get_update_chat_id(data)
+    if chat_id is None:
+        # Неподдерживаемые обновления подтверждаем, чтобы Telegram их не повторял
+        logger.info(f"⏭ Skipping unsupported update: {data}", extra=CHATTY)
+        return 'unsupported', 'OK'
     
-    thread = threading.Thread(target=ping_loop, daemon=True)
-    thread.start()
-    logger.info("🔄 Self-ping thread started")
+    # Повторную доставку отсеиваем до обработчиков и записи в базу
+    update_id = data.get('update_id')
+    if trace is not None:
+        trace.update_id = update_id
+    with tracing.span('dedup'):
+        is_new = dedup.updates.check(update_id)
+    if not is_new:
+        logger.info(f"🔁 Skipping duplicate update {update_id}")
+        return 'duplicate', 'OK'
+    
+    with logging_setup.correlation(update_id):
+        return accept_update(chat_id, update_id, data, trace)
 
-# Установка вебхука при старте
-if BOT_TOKEN and BOT_TOKEN != 'YOUR_BOT_TOKEN_HERE':
+def accept_update(chat_id, update_id, data, trace=None):
+    """Обработка в запросе или постановка обновления в очередь"""
+    logger.info(f"📨 Received update {update_id} ({'message' if 'message' in data else 'callback_query'})", extra=CHATTY)
+    logger.debug(f"📨 Update payload: {data}")
+    
+    # Ответ в теле вебхука возможен, только если у чата нет обновлений в очереди,
+    # иначе нарушится порядок обработки
+    if WEBHOOK_REPLY and update_queue.is_idle(chat_id):
+        try:
+            response = reply_inline(chat_id, data)
+        except Exception as e:
+            logger.error(f"❌ Webhook error: {e}", exc_info=True)
+            dedup.updates.forget(update_id)
+            return 'error', ('Error', 500)
+        dedup.updates.confirm(update_id)
+        return 'inline', response
+    
+    if not UPDATE_WORKERS:
+        try:
+            process_update(data)
+        except Exception as e:
+            logger.error(f"❌ Webhook error: {e}", exc_info=True)
+            dedup.updates.forget(update_id)
+            return 'error', ('Error', 500)
+        dedup.updates.confirm(update_id)
+        return 'sync', 'OK'
+    
     try:
-        webhook_url = f"https://tolyatti-fencing-bot.onrender.com/webhook"
-        logger.info(f"🔧 Setting webhook to: {webhook_url}")
-        
-        # Даем время на запуск сервера
-        time.sleep(2)
-        
-        # Устанавливаем вебхук
-        response = requests.post(
-            f"{TELEGRAM_API_URL}/setWebhook",
-            json={'url': webhook_url},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            logger.info(f"✅ Webhook set successfully: {response.json()}")
-        else:
-            logger.error(f"❌ Failed to set webhook: {response.status_code} - {response.text}")
-        
-        # Запускаем самопинг
-        self_ping()
-        
-    except Exception as e:
-        logger.error(f"❌ Failed to set webhook: {e}")
-else:
-    logger.error("❌ BOT_TOKEN not configured!")
+        if trace is not None:
+            trace.handoff()
+        update_queue.submit(chat_id, process_update, data, trace)
+    except QueueFull:
+        logger.warning(f"⚠️ Update queue is full, asking Telegram to retry update {update_id}")
+        dedup.updates.forget(update_id)
+        return 'busy', ('Busy', 503, {'Retry-After': '1'})
+    dedup.updates.confirm(update_id)
+    return 'queued', 'OK'
+
+# Кэш экранов, рассылки, регистрация вебхука и самопинг
+bootstrap.run()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
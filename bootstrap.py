@@ -0,0 +1,146 @@
+import time
+
+# Отсчет времени импорта: app.py импортирует этот модуль первым, до Flask и
+# модулей бота, поэтому в import входят и они, и их зависимости
+IMPORT_STARTED = time.perf_counter()
+
+import os  # noqa: E402
+import logging  # noqa: E402
+import threading  # noqa: E402
+
+import requests  # noqa: E402
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировок нет, каждый процесс считается единственным
+    fcntl = None
+
+import broadcast  # noqa: E402
+import render_cache  # noqa: E402
+import telegram_client  # noqa: E402
+import webhook_monitor  # noqa: E402
+from config import BOT_TOKEN, BOOTSTRAP_LOCK_PATH, PUBLIC_URL, SELF_PING_INTERVAL  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# Запуск процесса. Общие для хоста задачи (регистрация вебхука, самопинг)
+# выполняет только процесс, захвативший файловую блокировку: при N воркерах
+# gunicorn - один setWebhook и один пингер. Блокировка держится до выхода
+# процесса; после его падения ее захватит воркер, которого gunicorn запустит взамен.
+
+_lock_file = None
+_stats = {'leader': False, 'webhook': None, 'timings_ms': {}}
+
+
+def _reset_after_fork():
+    global _lock_file
+    # Блокировка принадлежит родителю; потоки главного процесса в дочерний не переходят
+    if _lock_file is not None:
+        _lock_file.close()
+    _lock_file = None
+    _stats['leader'] = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _acquire_host_lock(path):
+    """Неблокирующий flock: True, если этот процесс выполняет общие задачи хоста"""
+    global _lock_file
+    if fcntl is None:
+        return True
+    try:
+        handle = open(path, 'a+')
+    except OSError as e:
+        logger.error(f"❌ Cannot open bootstrap lock {path}: {e}")
+        return False
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    handle.seek(0)
+    handle.truncate()
+    handle.write(str(os.getpid()))
+    handle.flush()
+    _lock_file = handle
+    return True
+
+
+def ensure_webhook(url):
+    """setWebhook, только если Telegram доставляет обновления на другой адрес"""
+    info = telegram_client.get('getWebhookInfo').json().get('result') or {}
+    if info.get('url') == url:
+        logger.info(f"✅ Webhook already set to {url}")
+        return 'unchanged'
+
+    logger.info(f"🔧 Setting webhook to: {url} (was: {info.get('url') or 'none'})")
+    response = telegram_client.call('setWebhook', {'url': url})
+    if response.status_code != 200:
+        logger.error(f"❌ Failed to set webhook: {response.status_code} - {response.text}")
+        return 'failed'
+    logger.info(f"✅ Webhook set successfully: {response.json()}")
+    return 'set'
+
+
+def _ping_loop(url, interval):
+    """Самопинг для поддержания активности"""
+    while True:
+        time.sleep(interval)
+        try:
+            response = requests.get(url, timeout=10)
+            logger.info(f"✅ Self-ping successful: {response.status_code}")
+        except Exception as e:
+            logger.error(f"❌ Self-ping failed: {e}")
+
+
+def _host_tasks():
+    started = time.perf_counter()
+    try:
+        _stats['webhook'] = ensure_webhook(f"{PUBLIC_URL}/webhook")
+    except Exception as e:
+        _stats['webhook'] = 'failed'
+        logger.error(f"❌ Failed to set webhook: {e}")
+    _stats['timings_ms']['webhook'] = round((time.perf_counter() - started) * 1000, 1)
+
+    logger.info("🔄 Self-ping thread started")
+    _ping_loop(f"{PUBLIC_URL}/health", SELF_PING_INTERVAL)
+
+
+def _timed(name, func):
+    started = time.perf_counter()
+    func()
+    _stats['timings_ms'][name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def run():
+    """Запуск после импорта app.py: ничего не ждет от сети, фоновые задачи - в потоках"""
+    timings = _stats['timings_ms']
+    timings['import'] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+
+    # Строим кэш экранов до первого запроса
+    _timed('render_cache', render_cache.build)
+
+    if not BOT_TOKEN or BOT_TOKEN == 'YOUR_BOT_TOKEN_HERE':
+        logger.error("❌ BOT_TOKEN not configured!")
+        return
+
+    # Продолжаем рассылки, прерванные перезапуском (процессы делят их через аренду)
+    broadcast.engine.resume()
+    # Состояние вебхука для /debug опрашивается в фоне
+    webhook_monitor.monitor.start()
+
+    if _acquire_host_lock(BOOTSTRAP_LOCK_PATH):
+        _stats['leader'] = True
+        threading.Thread(target=_host_tasks, name='bootstrap', daemon=True).start()
+        logger.info(f"👑 Process {os.getpid()} owns webhook registration and self-ping")
+    else:
+        logger.info(f"👥 Process {os.getpid()}: webhook registration and self-ping run in another process")
+
+    timings['startup'] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+    logger.info(f"🚀 Started in {timings['startup']} ms (import {timings['import']} ms)")
+
+
+def get_stats():
+    return {**_stats, 'timings_ms': dict(_stats['timings_ms']), 'pid': os.getpid()}
@@ -1,13 +1,84 @@
 import logging
 import telebot
-from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
-from config import DISTRICTS_INFO, ORG_INFO, DOCUMENTS_LIST, FAQ_TEXT, is_admin, ADMINS
+import broadcast
+import dedup
+import edit_cache
+import render_cache
+import telegram_client
+import tracing
+from render_cache import Screen
+import content
+from content import is_admin
+from dispatch import Router
+import logging_setup
+from logging_setup import CHATTY
 from database import save_user_session, log_user_action, init_db, get_statistics
 
 logger = logging.getLogger(__name__)
 
+WELCOME_TEXT = """
+🤺 Добро пожаловать в <b>Тольяттинскую федерацию фехтования</b>!
+
+Здесь вы можете:
+• Выбрать удобный район для тренировок
+• Узнать реквизиты для оплаты
+• Получить список необходимых документов
+• Найти ответы на частые вопросы
+
+Выберите нужный раздел:
+        """
+
+STATS_TEXT = """
+📊 <b>Статистика бота</b>
+
+👥 <b>Пользователи:</b>
+• Всего: {total_users}
+• Активных: {active_users}
+    """
+
+MAIN_MENU_TEXT = "🤺 Добро пожаловать в <b>Тольяттинскую федерацию фехтования</b>!\n\nВыберите нужный раздел:"
+
+@render_cache.register
+def build_bot_screens(content):
+    """Экраны, которые есть только в версии бота на pyTelegramBotAPI"""
+    return {
+        'bot_welcome': Screen(WELCOME_TEXT, render_cache.main_menu_keyboard()),
+        'bot_main_menu': Screen(MAIN_MENU_TEXT, render_cache.main_menu_keyboard()),
+        'bot_main_menu_admin': Screen(MAIN_MENU_TEXT, render_cache.main_menu_keyboard(True)),
+        'bot_search': Screen("👥 <b>Поиск пользователя</b>\n\nФункция в разработке..."),
+        # Текст статистики подставляется при показе, из кэша берется клавиатура
+        'bot_stats': Screen(STATS_TEXT, render_cache.back_to_admin_keyboard()),
+    }
+
+def send_screen(bot, chat_id, screen):
+    """Отправка готового экрана; клавиатура передается уже сериализованной"""
+    bot.send_message(chat_id, screen.text, reply_markup=screen.markup_json, parse_mode=screen.parse_mode)
+
+def edit_screen(bot, call, screen, text=None):
+    """Замена сообщения callback-запроса готовым экраном"""
+    edit_text(bot, call, screen.text if text is None else text, screen.markup_json, screen.parse_mode)
+
+def edit_text(bot, call, text, reply_markup=None, parse_mode=None):
+    """Редактирование сообщения callback-запроса; если оно уже такое - только ответ на запрос"""
+    chat_id, message_id = call.message.chat.id, call.message.message_id
+    if edit_cache.edits.check(chat_id, message_id, text, reply_markup, parse_mode):
+        bot.answer_callback_query(call.id)
+        return
+    try:
+        bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup, parse_mode=parse_mode)
+    except telebot.apihelper.ApiTelegramException as e:
+        if not edit_cache.is_not_modified(e.description):
+            edit_cache.edits.forget(chat_id, message_id)
+            raise
+        edit_cache.edits.not_modified()
+        bot.answer_callback_query(call.id)
+    except Exception:
+        edit_cache.edits.forget(chat_id, message_id)
+        raise
+
 def setup_bot_handlers(bot):
     """Настройка всех обработчиков для pyTelegramBotAPI"""
+    logging_setup.setup_logging()
     
     # Инициализация БД
     try:
@@ -16,52 +87,52 @@ def setup_bot_handlers(bot):
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации БД в обработчиках: {e}")
     
+    # Вызовы Bot API из pyTelegramBotAPI идут через общий пул соединений и лимиты
+    telebot.apihelper.CUSTOM_REQUEST_SENDER = telegram_client.telebot_request_sender
+    
+    # Повторно доставленные обновления отсеиваем до обработчиков
+    process_new_updates = bot.process_new_updates
+    def process_new_updates_once(updates):
+        fresh = [update for update in updates if dedup.updates.check(update.update_id)]
+        if len(fresh) < len(updates):
+            logger.info(f"🔁 Skipped {len(updates) - len(fresh)} duplicate updates")
+        # По одному, чтобы записи лога каждого обновления были помечены его update_id
+        for update in fresh:
+            with logging_setup.correlation(update.update_id):
+                process_new_updates([update])
+            dedup.updates.confirm(update.update_id)
+    bot.process_new_updates = process_new_updates_once
+    
+    # Продолжаем рассылки, прерванные перезапуском
+    broadcast.engine.resume()
+    
     # Команда /start
     @bot.message_handler(commands=['start'])
+    @tracing.traced('bot.start')
     def start_command(message):
         user = message.from_user
-        logger.info(f"👤 User {user.id} started the bot - HANDLER TRIGGERED")
+        logger.info(f"👤 User {user.id} started the bot - HANDLER TRIGGERED", extra=CHATTY)
         save_user_session(user.id, user.username, user.first_name, user.last_name)
         log_user_action(user.id, 'start')
         
         # Проверяем, является ли пользователь администратором
         if is_admin(user.id):
-            logger.info(f"🛠 User {user.id} is admin, showing admin menu")
+            logger.info(f"🛠 User {user.id} is admin, showing admin menu", extra=CHATTY)
             show_admin_menu(bot, message)
             return
         
-        keyboard = [
-            [InlineKeyboardButton("🏃 Выбрать район", callback_data='main_districts')],
-            [InlineKeyboardButton("💳 Реквизиты оплаты", callback_data='main_payment')],
-            [InlineKeyboardButton("📋 Список документов", callback_data='main_documents')],
-            [InlineKeyboardButton("❓ Частые вопросы", callback_data='main_faq')]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_text = f"""
-🤺 Добро пожаловать в <b>Тольяттинскую федерацию фехтования</b>!
-
-Здесь вы можете:
-• Выбрать удобный район для тренировок
-• Узнать реквизиты для оплаты
-• Получить список необходимых документов
-• Найти ответы на частые вопросы
-
-Выберите нужный раздел:
-        """
-        
         try:
-            bot.send_message(message.chat.id, welcome_text, reply_markup=reply_markup, parse_mode='HTML')
-            logger.info(f"✅ Start message sent to user {user.id}")
+            send_screen(bot, message.chat.id, render_cache.get('bot_welcome'))
+            logger.info(f"✅ Start message sent to user {user.id}", extra=CHATTY)
         except Exception as e:
             logger.error(f"❌ Failed to send start message: {e}")
 
     # Команда /help
     @bot.message_handler(commands=['help'])
+    @tracing.traced('bot.help')
     def help_command(message):
         user = message.from_user
-        logger.info(f"❓ Help command from user {user.id}")
+        logger.info(f"❓ Help command from user {user.id}", extra=CHATTY)
         
         help_text = """
 🤖 <b>Доступные команды:</b>
@@ -87,21 +158,25 @@ def setup_bot_handlers(bot):
         bot.send_message(message.chat.id, help_text, parse_mode='HTML')
 
     @bot.message_handler(commands=['payment'])
+    @tracing.traced('bot.payment')
     def payment_command(message):
-        logger.info(f"💳 Payment command from user {message.from_user.id}")
+        logger.info(f"💳 Payment command from user {message.from_user.id}", extra=CHATTY)
         send_payment_info(bot, message)
 
     @bot.message_handler(commands=['documents'])
+    @tracing.traced('bot.documents')
     def documents_command(message):
-        logger.info(f"📋 Documents command from user {message.from_user.id}")
+        logger.info(f"📋 Documents command from user {message.from_user.id}", extra=CHATTY)
         send_documents_info(bot, message)
 
     @bot.message_handler(commands=['faq'])
+    @tracing.traced('bot.faq')
     def faq_command(message):
-        logger.info(f"❓ FAQ command from user {message.from_user.id}")
+        logger.info(f"❓ FAQ command from user {message.from_user.id}", extra=CHATTY)
         send_faq_info(bot, message)
 
     @bot.message_handler(commands=['admin'])
+    @tracing.traced('bot.admin')
     def admin_command(message):
         user = message.from_user
         logger.info(f"🛠 Admin command from user {user.id}")
@@ -113,6 +188,7 @@ def setup_bot_handlers(bot):
         show_admin_menu(bot, message)
 
     @bot.message_handler(commands=['stats'])
+    @tracing.traced('bot.stats')
     def stats_command(message):
         user = message.from_user
         logger.info(f"📊 Stats command from user {user.id}")
@@ -133,13 +209,47 @@ def setup_bot_handlers(bot):
         
         for action_type, count in stats['actions_count'].items():
             stats_text += f"• {action_type}: {count}\n"
+
+        if stats['districts_count']:
+            districts = content.get().districts
+            stats_text += "\n🏃 <b>Выбор районов:</b>\n"
+            for district_key, count in stats['districts_count'].items():
+                name = districts[district_key]['name'] if district_key in districts else district_key
+                stats_text += f"• {name}: {count}\n"
         
         bot.send_message(message.chat.id, stats_text, parse_mode='HTML')
 
+    @bot.message_handler(commands=['broadcast'])
+    @tracing.traced('bot.broadcast')
+    def broadcast_command(message):
+        if not is_admin(message.from_user.id):
+            bot.send_message(message.chat.id, "⛔ У вас нет прав доступа к этой команде.")
+            return
+        send_screen(bot, message.chat.id, render_cache.get('broadcast_menu'))
+
+    @bot.message_handler(commands=['cancel'])
+    @tracing.traced('bot.cancel')
+    def cancel_command(message):
+        user = message.from_user
+        if is_admin(user.id) and broadcast.discard_draft(user.id):
+            bot.send_message(message.chat.id, "❎ Рассылка отменена.")
+        else:
+            bot.send_message(message.chat.id, "Нечего отменять.")
+
     # Обработчик для неизвестных команд
     @bot.message_handler(func=lambda message: True)
+    @tracing.traced('bot.text')
     def handle_unknown(message):
-        logger.info(f"❓ Unknown message from user {message.from_user.id}: {message.text}")
+        user = message.from_user
+        # Обычный текст администратора после выбора сегмента - это текст рассылки
+        if message.text and not message.text.startswith('/') and is_admin(user.id) and broadcast.has_draft(user.id):
+            broadcast_id = broadcast.start_from_draft(user.id, message.text)
+            if broadcast_id is not None:
+                logger.info(f"📢 Admin {user.id} started broadcast {broadcast_id}")
+                send_broadcast_progress(bot, message.chat.id, broadcast_id)
+                return
+        
+        logger.info(f"❓ Unknown message from user {message.from_user.id}: {message.text}", extra=CHATTY)
         bot.send_message(
             message.chat.id, 
             "Неизвестная команда. Используйте /start для начала работы."
@@ -147,328 +257,144 @@ def setup_bot_handlers(bot):
 
     # Обработчики callback-запросов
     @bot.callback_query_handler(func=lambda call: True)
+    @tracing.traced('bot.callback')
     def handle_callback(call):
-        logger.info(f"🔘 Callback received: {call.data} from user {call.from_user.id}")
-        
-        if call.data.startswith('main_'):
-            handle_main_menu(bot, call)
-        elif call.data.startswith('district_'):
-            handle_district_selection(bot, call)
-        elif call.data.startswith('base_'):
-            handle_base_selection(bot, call)
-        elif call.data.startswith('admin_'):
-            handle_admin_actions(bot, call)
-        elif call.data.startswith('back_'):
-            handle_back(bot, call)
+        logger.info(f"🔘 Callback received: {call.data} from user {call.from_user.id}", extra=CHATTY)
+        callback_routes.dispatch(call.data, call.from_user.id, bot, call)
 
     logger.info("✅ All bot handlers registered successfully")
 
-# Функции обработки callback (вынесены для ясности)
-def handle_main_menu(bot, call):
-    action = call.data.replace('main_', '')
-    
-    if action == 'districts':
-        show_districts_menu(bot, call)
-    elif action == 'payment':
-        send_payment_info_callback(bot, call)
-    elif action == 'documents':
-        send_documents_info_callback(bot, call)
-    elif action == 'faq':
-        send_faq_info_callback(bot, call)
-
-def handle_district_selection(bot, call):
-    district_key = call.data.replace('district_', '')
-    district_info = DISTRICTS_INFO.get(district_key)
-    
-    if not district_info:
-        bot.edit_message_text("Район не найден", call.message.chat.id, call.message.message_id)
-        return
-    
-    # Для Автозаводского района показываем выбор базы
-    if district_key == 'avtozavodsky':
-        show_bases_menu(bot, call, district_info)
-        return
-    
-    message = format_district_info(district_info)
-    keyboard = [
-        [InlineKeyboardButton("💳 Реквизиты оплаты", callback_data='main_payment')],
-        [InlineKeyboardButton("📋 Документы", callback_data='main_documents')],
-        [InlineKeyboardButton("◀️ Выбрать другой район", callback_data='main_districts')],
-        [InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    bot.edit_message_text(message, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+# Маршруты callback-запросов: обработчики получают (bot, call),
+# префиксные - еще и остаток callback_data
+def deny_access(bot, call):
+    bot.answer_callback_query(call.id, "⛔ У вас нет прав доступа.")
 
-def handle_base_selection(bot, call):
-    base_key = call.data.replace('base_', '')
-    district_info = DISTRICTS_INFO['avtozavodsky']
-    base_info = district_info['bases'].get(base_key)
+callback_routes = Router('bot_callbacks', is_admin=is_admin, denied=deny_access)
+
+@callback_routes.prefix('district_')
+def handle_district_selection(bot, call, district_key):
+    screen = render_cache.get(f'district_{district_key}')
     
-    if not base_info:
-        bot.edit_message_text("База не найдена", call.message.chat.id, call.message.message_id)
+    if not screen:
+        edit_text(bot, call, "Район не найден")
         return
     
-    message = format_base_info(district_info, base_info)
-    keyboard = [
-        [InlineKeyboardButton("💳 Реквизиты оплаты", callback_data='main_payment')],
-        [InlineKeyboardButton("📋 Документы", callback_data='main_documents')],
-        [InlineKeyboardButton("◀️ Выбрать другую базу", callback_data='district_avtozavodsky')],
-        [InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    bot.edit_message_text(message, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+    log_user_action(call.from_user.id, 'district_select', district=district_key)
+    edit_screen(bot, call, screen)
 
-def handle_admin_actions(bot, call):
-    user = call.from_user
+@callback_routes.prefix('base_')
+def handle_base_selection(bot, call, base_key):
+    screen = render_cache.get(f'base_{base_key}')
     
-    if not is_admin(user.id):
-        bot.answer_callback_query(call.id, "⛔ У вас нет прав доступа.")
+    if not screen:
+        edit_text(bot, call, "База не найдена")
         return
     
-    action = call.data.replace('admin_', '')
-    
-    if action == 'stats':
-        show_stats_menu(bot, call)
-    elif action == 'broadcast':
-        show_broadcast_menu(bot, call)
-    elif action == 'search':
-        show_search_menu(bot, call)
-    elif action == 'back':
-        show_admin_menu_from_callback(bot, call)
-
-def handle_back(bot, call):
-    action = call.data.replace('back_', '')
-    
-    if action == 'to_main':
-        start_command_callback(bot, call)
+    district_key, _ = content.get().bases.get(base_key, (None, None))
+    log_user_action(call.from_user.id, 'base_select', district=district_key)
+    edit_screen(bot, call, screen)
+
+@callback_routes.prefix('admin_', admin=True)
+def handle_unknown_admin_action(bot, call, action):
+    logger.info(f"🛠 Unknown admin action: {action}")
 
 # Вспомогательные функции меню
 def show_admin_menu(bot, message):
-    keyboard = [
-        [InlineKeyboardButton("📊 Статистика", callback_data='admin_stats')],
-        [InlineKeyboardButton("📢 Рассылка", callback_data='admin_broadcast')],
-        [InlineKeyboardButton("👥 Поиск пользователя", callback_data='admin_search')],
-        [InlineKeyboardButton("🏠 Пользовательское меню", callback_data='back_to_main')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    admin_text = f"""
-🛠 <b>Панель администратора</b>
-
-👑 Администраторов: {len(ADMINS)}
-Выберите действие:
-    """
-    
-    bot.send_message(message.chat.id, admin_text, reply_markup=reply_markup, parse_mode='HTML')
+    send_screen(bot, message.chat.id, render_cache.get('admin_panel'))
 
+@callback_routes.exact('admin_back', admin=True)
 def show_admin_menu_from_callback(bot, call):
-    keyboard = [
-        [InlineKeyboardButton("📊 Статистика", callback_data='admin_stats')],
-        [InlineKeyboardButton("📢 Рассылка", callback_data='admin_broadcast')],
-        [InlineKeyboardButton("👥 Поиск пользователя", callback_data='admin_search')],
-        [InlineKeyboardButton("🏠 Пользовательское меню", callback_data='back_to_main')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    admin_text = f"""
-🛠 <b>Панель администратора</b>
-
-👑 Администраторов: {len(ADMINS)}
-Выберите действие:
-    """
-    
-    bot.edit_message_text(admin_text, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+    edit_screen(bot, call, render_cache.get('admin_panel'))
 
+@callback_routes.exact('main_districts')
 def show_districts_menu(bot, call):
-    keyboard = [
-        [InlineKeyboardButton("Центральный район", callback_data='district_central')],
-        [InlineKeyboardButton("Автозаводский район", callback_data='district_avtozavodsky')],
-        [InlineKeyboardButton("Комсомольский район", callback_data='district_komso')],
-        [InlineKeyboardButton("Жигулёвск", callback_data='district_zhig')],
-        [InlineKeyboardButton("◀️ Назад", callback_data='back_to_main')]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    text = "🏃 <b>Выберите район:</b>\n\nПосле выбора района вы получите:\n• Адрес и расписание\n• Ссылку на чат родителей\n• Всю необходимую информацию"
-    
-    bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
-
-def show_bases_menu(bot, call, district_info):
-    keyboard = []
-    
-    for base_key, base_info in district_info['bases'].items():
-        keyboard.append([InlineKeyboardButton(base_info['name'], callback_data=f'base_{base_key}')])
-    
-    keyboard.append([InlineKeyboardButton("◀️ Назад к районам", callback_data='main_districts')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.edit_message_text("🏢 <b>Автозаводский район</b>\n\nВыберите удобную вам базу:", 
-                         call.message.chat.id, call.message.message_id, 
-                         reply_markup=reply_markup, parse_mode='HTML')
+    edit_screen(bot, call, render_cache.get('districts'))
 
 def send_payment_info(bot, message):
-    text = format_payment_info()
-    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.send_message(message.chat.id, text, reply_markup=reply_markup, parse_mode='HTML')
+    send_screen(bot, message.chat.id, render_cache.get('payment'))
 
 def send_documents_info(bot, message):
-    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.send_message(message.chat.id, DOCUMENTS_LIST, reply_markup=reply_markup, parse_mode='HTML')
+    send_screen(bot, message.chat.id, render_cache.get('documents'))
 
 def send_faq_info(bot, message):
-    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.send_message(message.chat.id, FAQ_TEXT, reply_markup=reply_markup, parse_mode='HTML')
+    send_screen(bot, message.chat.id, render_cache.get('faq'))
 
+@callback_routes.exact('main_payment')
 def send_payment_info_callback(bot, call):
-    text = format_payment_info()
-    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+    edit_screen(bot, call, render_cache.get('payment'))
 
+@callback_routes.exact('main_documents')
 def send_documents_info_callback(bot, call):
-    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.edit_message_text(DOCUMENTS_LIST, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+    edit_screen(bot, call, render_cache.get('documents'))
 
+@callback_routes.exact('main_faq')
 def send_faq_info_callback(bot, call):
-    keyboard = [[InlineKeyboardButton("🏠 В главное меню", callback_data='back_to_main')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.edit_message_text(FAQ_TEXT, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+    edit_screen(bot, call, render_cache.get('faq'))
 
+@callback_routes.exact('admin_stats', admin=True)
 def show_stats_menu(bot, call):
     stats = get_statistics()
+    screen = render_cache.get('bot_stats')
+    stats_text = STATS_TEXT.format(total_users=stats['total_users'], active_users=stats['active_users'])
     
-    stats_text = f"""
-📊 <b>Статистика бота</b>
-
-👥 <b>Пользователи:</b>
-• Всего: {stats['total_users']}
-• Активных: {stats['active_users']}
-    """
-    
-    keyboard = [[InlineKeyboardButton("◀️ Назад в админку", callback_data='admin_back')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.edit_message_text(stats_text, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
+    edit_screen(bot, call, screen, text=stats_text)
 
+@callback_routes.exact('admin_broadcast', admin=True)
 def show_broadcast_menu(bot, call):
-    keyboard = [
-        [InlineKeyboardButton("📢 Всем пользователям", callback_data='admin_broadcast_all')],
-        [InlineKeyboardButton("👥 Только пользователям (без админов)", callback_data='admin_broadcast_users')],
-        [InlineKeyboardButton("◀️ Назад", callback_data='admin_back')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    bot.edit_message_text("📢 <b>Рассылка сообщений</b>\n\nВыберите тип рассылки:", 
-                         call.message.chat.id, call.message.message_id, 
-                         reply_markup=reply_markup, parse_mode='HTML')
-
+    edit_screen(bot, call, render_cache.get('broadcast_menu'))
+
+def broadcast_progress_screen(broadcast_id):
+    progress = broadcast.engine.progress(broadcast_id) if broadcast_id else None
+    if progress is None:
+        return None
+    return Screen(
+        broadcast.format_progress(progress),
+        render_cache.broadcast_progress_keyboard(broadcast_id, progress['status'] == 'running')
+    )
+
+def send_broadcast_progress(bot, chat_id, broadcast_id):
+    send_screen(bot, chat_id, broadcast_progress_screen(broadcast_id))
+
+def edit_broadcast_progress(bot, call, broadcast_id):
+    screen = broadcast_progress_screen(broadcast_id)
+    if screen is None:
+        bot.answer_callback_query(call.id, "📭 Рассылок еще не было.")
+        return
+    edit_screen(bot, call, screen)
+
+@callback_routes.exact('admin_broadcast_all', admin=True)
+def request_broadcast_all(bot, call):
+    broadcast.create_draft(call.from_user.id, broadcast.SEGMENT_ALL)
+    edit_screen(bot, call, render_cache.get('broadcast_prompt'))
+
+@callback_routes.exact('admin_broadcast_users', admin=True)
+def request_broadcast_users(bot, call):
+    broadcast.create_draft(call.from_user.id, broadcast.SEGMENT_USERS)
+    edit_screen(bot, call, render_cache.get('broadcast_prompt'))
+
+@callback_routes.exact('admin_broadcast_status', admin=True)
+def show_broadcast_status(bot, call):
+    edit_broadcast_progress(bot, call, broadcast.engine.latest())
+
+@callback_routes.prefix('broadcast_refresh_', admin=True)
+def refresh_broadcast_progress(bot, call, broadcast_id):
+    if broadcast_id.isdigit():
+        edit_broadcast_progress(bot, call, int(broadcast_id))
+
+@callback_routes.prefix('broadcast_cancel_', admin=True)
+def cancel_broadcast(bot, call, broadcast_id):
+    if broadcast_id.isdigit():
+        broadcast.engine.cancel(int(broadcast_id))
+        edit_broadcast_progress(bot, call, int(broadcast_id))
+
+@callback_routes.exact('admin_search', admin=True)
 def show_search_menu(bot, call):
-    bot.edit_message_text("👥 <b>Поиск пользователя</b>\n\nФункция в разработке...", 
-                         call.message.chat.id, call.message.message_id, parse_mode='HTML')
+    edit_screen(bot, call, render_cache.get('bot_search'))
 
+@callback_routes.exact('back_to_main')
 def start_command_callback(bot, call):
     user = call.from_user
-    
-    if is_admin(user.id):
-        keyboard = [
-            [InlineKeyboardButton("🏃 Выбрать район", callback_data='main_districts')],
-            [InlineKeyboardButton("💳 Реквизиты оплаты", callback_data='main_payment')],
-            [InlineKeyboardButton("📋 Список документов", callback_data='main_documents')],
-            [InlineKeyboardButton("❓ Частые вопросы", callback_data='main_faq')],
-            [InlineKeyboardButton("🛠 Админ-панель", callback_data='admin_back')]
-        ]
-    else:
-        keyboard = [
-            [InlineKeyboardButton("🏃 Выбрать район", callback_data='main_districts')],
-            [InlineKeyboardButton("💳 Реквизиты оплаты", callback_data='main_payment')],
-            [InlineKeyboardButton("📋 Список документов", callback_data='main_documents')],
-            [InlineKeyboardButton("❓ Частые вопросы", callback_data='main_faq')]
-        ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    welcome_text = "🤺 Добро пожаловать в <b>Тольяттинскую федерацию фехтования</b>!\n\nВыберите нужный раздел:"
-    
-    bot.edit_message_text(welcome_text, call.message.chat.id, call.message.message_id, reply_markup=reply_markup, parse_mode='HTML')
-
-# Функции форматирования
-def format_district_info(district_info):
-    return f"""
-<b>{district_info['name']}</b>
-
-📍 <b>Адрес:</b> {district_info['address']}
-
-📅 <b>Расписание:</b>
-{district_info['schedule']}
-
-💬 <b>Чат для родителей:</b> {district_info['chat_link']}
+    screen_key = 'bot_main_menu_admin' if is_admin(user.id) else 'bot_main_menu'
+    edit_screen(bot, call, render_cache.get(screen_key))
 
-💰 <b>Стоимость:</b> {district_info['price']}
-
-👕 <b>С собой на тренировку:</b> сменные кроссовки для зала, белые носки, спортивная форма, бутылочка с водой
-
-⚠️ <b>Важно:</b> пока не нужно платить и приносить документы! Все в процессе!
-    """
-
-def format_base_info(district_info, base_info):
-    return f"""
-<b>{district_info['name']} - {base_info['name']}</b>
-
-📍 <b>Адрес:</b> {base_info['address']}
-
-📅 <b>Расписание:</b>
-{base_info['schedule']}
-
-💬 <b>Чат для родителей:</b> {district_info['chat_link']}
-
-💰 <b>Стоимость:</b> {district_info['price']}
-
-👕 <b>С собой на тренировку:</b> сменные кроссовки для зала, белые носки, спортивная форма, бутылочка с водой
-
-⚠️ <b>Важно:</b> пока не нужно платить и приносить документы! Все в процессе!
-    """
-
-def format_payment_info():
-    return f"""
-💳 <b>Реквизиты для оплаты</b>
-
-🏛 <b>Полное наименование:</b> 
-{ORG_INFO['full_name']}
-
-📋 <b>Сокращенное:</b> 
-{ORG_INFO['short_name']}
-
-📊 <b>Реквизиты:</b>
-ИНН: {ORG_INFO['inn']}
-КПП: {ORG_INFO['kpp']}
-ОГРН: {ORG_INFO['ogrn']}
-Расчетный счет: {ORG_INFO['account']}
-Банк: {ORG_INFO['bank']}
-БИК: {ORG_INFO['bik']}
-Корр. счет: {ORG_INFO['correspondent_account']}
-
-💸 <b>Сумма:</b> 2000 рублей в месяц
-📝 <b>Назначение платежа:</b> "Добровольное пожертвование от [ФИО ребенка]"
-
-⚠️ <b>Важно:</b>
-• Оплата производится после пробных тренировок
-• В назначении платежа укажите ФИО ребенка
-• Сохраните чек об оплате
-• Квитанцию можно показать тренеру или отправить в чат группы
-    """
+callback_routes.compile()
@@ -0,0 +1,416 @@
+import os
+import time
+import socket
+import logging
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import database
+import telegram_client
+from rate_limiter import TokenBucket, retry_after
+from config import (
+    BROADCAST_RATE,
+    BROADCAST_WORKERS,
+    BROADCAST_BATCH_SIZE,
+    BROADCAST_LEASE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_ALL = 'all'
+SEGMENT_USERS = 'users'
+# Сегмент -> фильтры database.iter_recipients
+SEGMENTS = {
+    SEGMENT_ALL: {},
+    SEGMENT_USERS: {'exclude_admins': True},
+}
+
+# Черновик ждет текст рассылки от администратора не дольше этого времени
+DRAFT_TTL_MINUTES = 15
+
+_DRAFT_SQL = f'''
+    SELECT id, segment FROM broadcasts
+    WHERE admin_id = ? AND status = 'draft'
+      AND created_at > datetime('now', '-{DRAFT_TTL_MINUTES} minutes')
+    ORDER BY id DESC LIMIT 1
+'''
+_PENDING_PAGE_SQL = '''
+    SELECT user_id FROM broadcast_deliveries
+    WHERE broadcast_id = ? AND status = 'pending' AND user_id > ?
+    ORDER BY user_id LIMIT ?
+'''
+_RUNNING_SQL = "SELECT id FROM broadcasts WHERE status = 'running'"
+_CLAIM_SQL = '''
+    UPDATE broadcasts SET owner = ?, lease_until = datetime('now', ?)
+    WHERE id = ? AND status = 'running'
+      AND (owner IS NULL OR owner = ? OR lease_until < datetime('now'))
+'''
+_DELIVERY_SQL = '''
+    UPDATE broadcast_deliveries SET status = ?, attempts = ?, error = ?, updated_at = ?
+    WHERE broadcast_id = ? AND user_id = ?
+'''
+_COUNT_SENT_SQL = 'UPDATE broadcasts SET sent = sent + 1 WHERE id = ?'
+_COUNT_FAILED_SQL = 'UPDATE broadcasts SET failed = failed + 1 WHERE id = ?'
+_FINISH_SQL = '''
+    UPDATE broadcasts SET status = 'done', finished_at = ?, owner = NULL
+    WHERE id = ? AND status = 'running'
+'''
+
+# Горячие запросы рассылок для tools/check_query_plans.py
+HOT_QUERIES = {
+    'broadcast_draft': (_DRAFT_SQL, (1,)),
+    'broadcast_pending_page': (_PENDING_PAGE_SQL, (1, 0, 100)),
+    'broadcast_running': (_RUNNING_SQL, ()),
+    'broadcast_delivery': (_DELIVERY_SQL, ('sent', 1, None, '2024-01-01 00:00:00', 1, 1)),
+}
+
+
+class _Run:
+    """Состояние рассылки, которую отправляет этот процесс"""
+
+    def __init__(self, broadcast_id, text):
+        self.broadcast_id = broadcast_id
+        self.text = text
+        self.cancelled = False
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._done = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._done.append(time.monotonic())
+
+    def rate(self, window=10.0):
+        """Доставок в секунду за последние window секунд"""
+        with self._lock:
+            now = time.monotonic()
+            recent = [moment for moment in self._done if now - moment <= window]
+        if not recent:
+            return 0.0
+        span = min(window, now - self.started)
+        return len(recent) / span if span > 0 else 0.0
+
+
+def _send_via_bot_api(chat_id, text):
+    return telegram_client.call('sendMessage', {'chat_id': chat_id, 'text': text})
+
+
+def _now():
+    return database._utc_now()
+
+
+class BroadcastEngine:
+    """Отправка рассылок с общим лимитом, пулом воркеров и сохранением прогресса.
+
+    Каждый получатель - строка broadcast_deliveries; статусы пишутся через
+    фоновый writer базы. Рассылку отправляет один процесс, арендовавший ее
+    (owner/lease_until); если он пропал, аренду перехватывает любой другой
+    процесс и продолжает с недоставленных. Доставка "хотя бы один раз":
+    при падении сообщения, отправленные в последние сотни миллисекунд,
+    могут уйти повторно.
+    """
+
+    def __init__(self, send=_send_via_bot_api, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS,
+                 batch_size=BROADCAST_BATCH_SIZE, lease_seconds=BROADCAST_LEASE_SECONDS):
+        self.send = send
+        self.rate = rate
+        self.workers = max(int(workers), 1)
+        self.batch_size = max(int(batch_size), 1)
+        self.lease_seconds = lease_seconds
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Потоки отправки родителя не переживают fork
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.bucket = TokenBucket(self.rate)
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._supervisor = None
+
+    # Управление рассылками
+
+    def start(self, broadcast_id):
+        """Арендует рассылку и запускает ее отправку; False, если ее ведет другой процесс"""
+        with self._lock:
+            if broadcast_id in self._runs:
+                return True
+            if not self._claim(broadcast_id):
+                return False
+            row = database.get_db_connection().execute(
+                'SELECT text FROM broadcasts WHERE id = ?', (broadcast_id,)
+            ).fetchone()
+            run = _Run(broadcast_id, row['text'])
+            self._runs[broadcast_id] = run
+        threading.Thread(
+            target=self._run, args=(run,), name=f'broadcast-{broadcast_id}', daemon=True
+        ).start()
+        logger.info(f"📢 Broadcast {broadcast_id} started by {self.owner}")
+        return True
+
+    def cancel(self, broadcast_id):
+        conn = database.get_db_connection()
+        with conn:
+            cancelled = conn.execute('''
+                UPDATE broadcasts SET status = 'cancelled', finished_at = ?, owner = NULL
+                WHERE id = ? AND status IN ('draft', 'running')
+            ''', (_now(), broadcast_id)).rowcount
+        with self._lock:
+            run = self._runs.get(broadcast_id)
+        if run:
+            run.cancelled = True
+        if cancelled:
+            logger.info(f"⛔ Broadcast {broadcast_id} cancelled")
+        return bool(cancelled)
+
+    def resume(self):
+        """Запускает наблюдателя, который подхватывает незавершенные рассылки"""
+        with self._lock:
+            if self._supervisor is not None:
+                return
+            self._supervisor = threading.Thread(target=self._supervise, name='broadcast-supervisor', daemon=True)
+            self._supervisor.start()
+
+    def _supervise(self):
+        while True:
+            try:
+                rows = database.get_db_connection().execute(_RUNNING_SQL).fetchall()
+                for row in rows:
+                    if row['id'] not in self._runs and self.start(row['id']):
+                        logger.info(f"🔁 Broadcast {row['id']} resumed")
+            except Exception as e:
+                logger.error(f"❌ Broadcast supervisor error: {e}")
+            time.sleep(self.lease_seconds / 2)
+
+    def _claim(self, broadcast_id):
+        conn = database.get_db_connection()
+        with conn:
+            return conn.execute(
+                _CLAIM_SQL, (self.owner, f'+{self.lease_seconds} seconds', broadcast_id, self.owner)
+            ).rowcount == 1
+
+    # Отправка
+
+    def _run(self, run):
+        last_user_id = 0
+        inflight = threading.BoundedSemaphore(self.workers * 2)
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix=f'broadcast-{run.broadcast_id}-worker')
+        conn = database.get_db_connection()
+        try:
+            while not run.cancelled:
+                if not self._claim(run.broadcast_id):
+                    # Рассылку отменили или аренду перехватил другой процесс
+                    run.cancelled = True
+                    break
+                rows = conn.execute(
+                    _PENDING_PAGE_SQL, (run.broadcast_id, last_user_id, self.batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    if run.cancelled:
+                        break
+                    inflight.acquire()
+                    future = pool.submit(self._deliver, run, row['user_id'])
+                    future.add_done_callback(lambda _: inflight.release())
+                last_user_id = rows[-1]['user_id']
+        except Exception as e:
+            logger.error(f"❌ Broadcast {run.broadcast_id} failed: {e}", exc_info=True)
+            run.cancelled = True
+        finally:
+            pool.shutdown(wait=True)
+            with self._lock:
+                self._runs.pop(run.broadcast_id, None)
+
+        if not run.cancelled:
+            # Через ту же очередь, что и статусы доставок: завершение пишется после них
+            database.event_writer.submit(_FINISH_SQL, (_now(), run.broadcast_id))
+            logger.info(f"✅ Broadcast {run.broadcast_id} finished: sent {run.sent}, failed {run.failed}")
+
+    def _deliver(self, run, user_id):
+        """Одна отправка получателю и ее итог.
+
+        429, 5xx и обрывы соединения повторяет telegram_client; таймаут sendMessage
+        не повторяется ни там, ни здесь - сообщение могло уже дойти.
+        """
+        if run.cancelled:
+            return
+        self.bucket.acquire()
+        try:
+            response = self.send(user_id, run.text)
+        except requests.RequestException as e:
+            self._record(run, user_id, 'failed', 1, str(e))
+            return
+
+        if response.status_code == 200:
+            self._record(run, user_id, 'sent', 1, None)
+            return
+        if response.status_code == 429:
+            # Клиент не дождался конца flood control: приостанавливаем всю рассылку
+            self.bucket.pause(retry_after(response))
+        # 400/403: чат не найден, бот заблокирован; 429/5xx - повторы клиента исчерпаны
+        self._record(run, user_id, 'failed', 1, _describe_error(response))
+
+    def _record(self, run, user_id, status, attempts, error):
+        run.record(status == 'sent')
+        database.event_writer.submit_many((
+            (_DELIVERY_SQL, (status, attempts, error, _now(), run.broadcast_id, user_id)),
+            (_COUNT_SENT_SQL if status == 'sent' else _COUNT_FAILED_SQL, (run.broadcast_id,)),
+        ))
+
+    # Прогресс
+
+    def progress(self, broadcast_id):
+        """Прогресс рассылки: счетчики из базы и скорость, если ее отправляет этот процесс"""
+        row = database.get_db_connection().execute(
+            'SELECT id, segment, status, total, sent, failed, owner FROM broadcasts WHERE id = ?',
+            (broadcast_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        progress = dict(row)
+        with self._lock:
+            run = self._runs.get(broadcast_id)
+        # Счетчики базы отстают на время пачки writer'а, локальные - нет
+        if run:
+            progress['sent'] = max(progress['sent'], run.sent)
+            progress['failed'] = max(progress['failed'], run.failed)
+        remaining = max(progress['total'] - progress['sent'] - progress['failed'], 0)
+        rate = run.rate() if run else 0.0
+        progress.update({
+            'remaining': remaining,
+            'rate': round(rate, 1),
+            'eta_seconds': round(remaining / rate) if rate > 0 else None,
+            'local': run is not None,
+        })
+        return progress
+
+    def latest(self, admin_id=None):
+        """id последней рассылки (кроме черновиков)"""
+        query = "SELECT id FROM broadcasts WHERE status != 'draft'"
+        params = ()
+        if admin_id is not None:
+            query += ' AND admin_id = ?'
+            params = (admin_id,)
+        row = database.get_db_connection().execute(query + ' ORDER BY id DESC LIMIT 1', params).fetchone()
+        return row['id'] if row else None
+
+    def get_stats(self):
+        with self._lock:
+            runs = {broadcast_id: {'sent': run.sent, 'failed': run.failed, 'rate': round(run.rate(), 1)}
+                    for broadcast_id, run in self._runs.items()}
+        return {
+            'owner': self.owner,
+            'rate_limit': self.rate,
+            'bucket_level': self.bucket.level(),
+            'throttled': self.bucket.throttled,
+            'running': runs,
+        }
+
+
+def _describe_error(response):
+    try:
+        return response.json().get('description') or f'HTTP {response.status_code}'
+    except ValueError:
+        return f'HTTP {response.status_code}'
+
+
+engine = BroadcastEngine()
+
+
+# Сценарий администратора: выбор сегмента -> текст следующим сообщением -> запуск
+
+def create_draft(admin_id, segment):
+    """Запоминает, что следующее сообщение администратора - текст рассылки"""
+    if segment not in SEGMENTS:
+        raise ValueError(f"Unknown broadcast segment {segment!r}")
+    conn = database.get_db_connection()
+    with conn:
+        conn.execute("DELETE FROM broadcasts WHERE admin_id = ? AND status = 'draft'", (admin_id,))
+        return conn.execute(
+            'INSERT INTO broadcasts (admin_id, segment) VALUES (?, ?)', (admin_id, segment)
+        ).lastrowid
+
+
+def has_draft(admin_id):
+    return database.get_db_connection().execute(_DRAFT_SQL, (admin_id,)).fetchone() is not None
+
+
+def discard_draft(admin_id):
+    conn = database.get_db_connection()
+    with conn:
+        return conn.execute(
+            "DELETE FROM broadcasts WHERE admin_id = ? AND status = 'draft'", (admin_id,)
+        ).rowcount > 0
+
+
+def start_from_draft(admin_id, text):
+    """Создает список получателей по черновику и запускает рассылку; возвращает id или None.
+
+    Получатели читаются потоком страницами и сразу пишутся в broadcast_deliveries
+    в той же транзакции, поэтому список в памяти не собирается.
+    """
+    conn = database.get_db_connection()
+    row = conn.execute(_DRAFT_SQL, (admin_id,)).fetchone()
+    if row is None:
+        return None
+    broadcast_id = row['id']
+    recipients = database.iter_recipients(**SEGMENTS.get(row['segment'], {}))
+    with conn:
+        total = conn.executemany(
+            'INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id) VALUES (?, ?)',
+            ((broadcast_id, user_id) for user_id in recipients)
+        ).rowcount
+        conn.execute('''
+            UPDATE broadcasts SET text = ?, status = 'running', total = ?, started_at = ?
+            WHERE id = ?
+        ''', (text, total, _now(), broadcast_id))
+    database.log_admin_action(admin_id, 'broadcast', details=f'#{broadcast_id}: {total} recipients')
+    engine.start(broadcast_id)
+    engine.resume()
+    return broadcast_id
+
+
+SEGMENT_TITLES = {
+    SEGMENT_ALL: 'всем пользователям',
+    SEGMENT_USERS: 'пользователям без админов',
+}
+
+STATUS_TITLES = {
+    'draft': '✍️ ожидает текст',
+    'running': '🔄 отправляется',
+    'done': '✅ завершена',
+    'cancelled': '⛔ остановлена',
+}
+
+
+def format_progress(progress):
+    """Текст экрана прогресса рассылки"""
+    done = progress['sent'] + progress['failed']
+    percent = done * 100 // progress['total'] if progress['total'] else 100
+    text = (
+        f"📢 <b>Рассылка #{progress['id']}</b> ({SEGMENT_TITLES.get(progress['segment'], progress['segment'])})\n\n"
+        f"Статус: {STATUS_TITLES.get(progress['status'], progress['status'])}\n"
+        f"Получателей: {progress['total']}\n"
+        f"✅ Доставлено: {progress['sent']}\n"
+        f"❌ Ошибок: {progress['failed']}\n"
+        f"⏳ Осталось: {progress['remaining']} ({percent}% готово)\n"
+    )
+    if progress['status'] == 'running':
+        if progress['rate']:
+            text += f"⚡ Скорость: {progress['rate']} сообщ./с\n"
+        if progress['eta_seconds'] is not None:
+            minutes, seconds = divmod(progress['eta_seconds'], 60)
+            text += f"🕐 Осталось времени: ~{minutes} мин {seconds} с\n"
+    return text
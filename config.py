@@ -6,7 +6,13 @@ load_dotenv()
 # Конфигурация бота
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 
-# Список администраторов
+# Внешний адрес приложения: на него регистрируется вебхук и идет самопинг
+PUBLIC_URL = os.getenv('PUBLIC_URL', 'https://tolyatti-fencing-bot.onrender.com').rstrip('/')
+SELF_PING_INTERVAL = float(os.getenv('SELF_PING_INTERVAL', 300))
+# Файловая блокировка: регистрацию вебхука и самопинг выполняет один процесс на хосте
+BOOTSTRAP_LOCK_PATH = os.getenv('BOOTSTRAP_LOCK_PATH', os.path.join(os.getenv('TMPDIR', '/tmp'), 'tolyatti-fencing-bot.lock'))
+
+# Администраторы из окружения (дополняются списком admins в файле контента)
 ADMINS_STR = os.getenv('ADMINS', '')
 ADMINS = []
 if ADMINS_STR:
@@ -14,123 +20,113 @@ if ADMINS_STR:
 
 PORT = int(os.getenv('PORT', 5000))
 
-# Данные организации
-ORG_INFO = {
-    'full_name': 'Автономная некоммерческая организация "Тольяттинская федерация фехтования"',
-    'short_name': 'АНО "Тольяттинская федерация фехтования"',
-    'inn': '6320267029',
-    'kpp': '632001001',
-    'ogrn': '1146300002793',
-    'account': '40703810212300001063',
-    'bank': 'ОАО АКБ "Авангард"',
-    'bik': '044525201',
-    'correspondent_account': '3010181000000000201'
-}
-
-# Информация о районах
-DISTRICTS_INFO = {
-    'central': {
-        'name': 'Центральный район',
-        'chat_link': 'https://t.me/+ls3LxVHjH680MDdi',
-        'schedule': '''Пн - ОФП и фехтование 18:00
-Ср - ОФП и фехтование 18:00
-Сб - Фехтование 18:00''',
-        'address': 'Ленина 58, школа 91, корпус Б, малый зал',
-        'price': '2000 рублей в месяц'
-    },
-    'avtozavodsky': {
-        'name': 'Автозаводский район',
-        'chat_link': 'https://t.me/+IQpyrN7sq3c2ZjRi',
-        'bases': {
-            'volgar': {
-                'name': 'Волгарь',
-                'schedule': '''ПН: 16:00 средние и новички ОФП, 18:30 малыши и новички ОФП
-ВТ: 15:00 средние и новички фехтование, 16:30 новички (новый зал)
-СР: 17:15 новички все (новый зал)
-ЧТ: 15:00 средние и новички фехтование, 16:30 новички (новый зал)
-ПТ: 15:30 средние и новички фехтование
-СБ: 16:30-18:00 новички все (новый зал)''',
-                'address': 'ДС Волгарь, вход со стороны Веги, зал Фехтования'
-            },
-            'school69': {
-                'name': 'Школа 69',
-                'schedule': '''ПН: 15:30-16:30
-ВТ: 16:00-18:00
-СР: 15:30-16:30
-ЧТ: 16:00-18:00
-ПТ: 16:00-18:00
-СБ: Боевая в волгаре (уточнить время)
-ВСК: 12:00-14:00''',
-                'address': '13 квартал, 40 лет Победы, 120, Музыкальный зал'
-            },
-            'school66': {
-                'name': 'Школа 66',
-                'schedule': 'Уточняется в чате района',
-                'address': 'Уточняется в чате района'
-            }
-        },
-        'price': '2000 рублей в месяц'
-    },
-    'komso': {
-        'name': 'Комсомольский район',
-        'chat_link': 'https://t.me/+jO5wcwUbxq0wMjgy',
-        'schedule': '''Пн: 15:00 (ср/ст и новички), 17:00 (мл и новички)
-Вт: 9:00 (2 смена новички), 15:00 (мл), 16:00 (ср/ст)
-Ср: 16:00-18:00 ОФП
-Чт: 9:00 (2 смена), 15:00 (ср/мл), 16:00 (ст), 17:00 (мл и новички)
-Пт: 15:00 (ср/ст), 17:00 (мл)
-Сб: 14:00 ОФП (мл и новички)''',
-        'address': 'Мурысева 52а, вход со двора',
-        'price': '2000 рублей в месяц'
-    },
-    'zhig': {
-        'name': 'Жигулёвск',
-        'chat_link': 'https://t.me/+b4YyZF5QXts1NTVi',
-        'schedule': '''Ср: 16:30-18:00 ОФП
-Чт: 16:00-17:30 фехтование
-Сб: 15:30-17:00 фехтование и ОФП
-Вск: 13:00-14:00 ОФП и фехтование''',
-        'address': 'ДМО, Гидростроителей 10а',
-        'price': '2000 рублей в месяц'
-    }
+# Логи: JSON-строки (LOG_FORMAT=text - обычный текст) в stderr и, если задан LOG_FILE,
+# в файл с ротацией по размеру. Частые события пишутся с долей LOG_SAMPLE_RATE
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_FILE = os.getenv('LOG_FILE', '')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
+
+# Исходящий HTTP-клиент Telegram Bot API
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org')
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', 10))
+TELEGRAM_DEFAULT_TIMEOUT = float(os.getenv('TELEGRAM_DEFAULT_TIMEOUT', 10))
+
+# Таймауты по методам, переопределяются строкой вида "sendMessage=5,answerCallbackQuery=3"
+TELEGRAM_TIMEOUTS = {
+    'answerCallbackQuery': 5.0,
+    'sendMessage': 10.0,
+    'editMessageText': 10.0,
+    'setWebhook': 10.0,
+    'getWebhookInfo': 10.0,
 }
-
-# Список документов
-DOCUMENTS_LIST = '''
-📋 <b>Необходимые документы:</b>
-
-• 4 фотографии 3x4
-• Копия свидетельства о рождении или паспорта с пропиской
-• Копия паспорта одного из родителей с пропиской
-• Копия СНИЛС ребенка
-• Копия ИНН ребенка
-• Справка из школы
-• Справка от педиатра, что здоров и может заниматься ФЕХТОВАНИЕМ
-• Доверенности, согласия и заявления (бланки выдаются на месте)
-
-⚠️ <b>Важно:</b> Документы можно принести после пробных тренировок!
-'''
-
-# Частые вопросы
-FAQ_TEXT = '''
-❓ <b>Частые вопросы:</b>
-
-<b>1. С чего начать?</b>
-Выберите район, придите на пробную тренировку. Все необходимое для первой тренировки: сменная обувь, спортивная форма, вода.
-
-<b>2. Когда нужно платить?</b>
-Оплата производится после пробных тренировок, когда вы приняли решение заниматься.
-
-<b>3. Нужно ли сразу приносить документы?</b>
-Нет, документы можно принести в течение первых недель занятий.
-
-<b>4. Сколько раз в неделю проходят тренировки?</b>
-Новички обычно занимаются 3 раза в неделю, затем количество тренировок может увеличиваться.
-
-<b>5. Можно ли поменять район/базу?</b>
-Да, в течение пробного периода можно выбрать наиболее удобный вариант.
-'''
-
-def is_admin(user_id):
-    """Проверяет, является ли пользователь администратором"""
-    return user_id in ADMINS
+for _item in os.getenv('TELEGRAM_TIMEOUTS', '').split(','):
+    _method, _, _value = _item.partition('=')
+    if _method.strip() and _value.strip():
+        TELEGRAM_TIMEOUTS[_method.strip()] = float(_value)
+
+# Лимиты исходящих сообщений: ~30/с на бота, ~1/с в личный чат, 20 в минуту в группу
+TELEGRAM_RATE_GLOBAL = float(os.getenv('TELEGRAM_RATE_GLOBAL', 30))
+TELEGRAM_RATE_CHAT = float(os.getenv('TELEGRAM_RATE_CHAT', 1))
+TELEGRAM_BURST_CHAT = int(os.getenv('TELEGRAM_BURST_CHAT', 3))
+TELEGRAM_RATE_GROUP = float(os.getenv('TELEGRAM_RATE_GROUP_PER_MINUTE', 20)) / 60
+TELEGRAM_BURST_GROUP = int(os.getenv('TELEGRAM_BURST_GROUP', 3))
+# Повторы при сетевых ошибках и 5xx (с нарастающей задержкой) и при 429;
+# если Telegram просит ждать дольше TELEGRAM_MAX_RETRY_AFTER секунд, ответ 429 возвращается вызывающему
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', 3))
+TELEGRAM_RETRY_BACKOFF = float(os.getenv('TELEGRAM_RETRY_BACKOFF', 0.5))
+TELEGRAM_MAX_RETRY_AFTER = float(os.getenv('TELEGRAM_MAX_RETRY_AFTER', 30))
+
+# Очередь входящих обновлений (0 воркеров - обработка прямо в запросе)
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 4))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))
+UPDATE_QUEUE_PUT_TIMEOUT = float(os.getenv('UPDATE_QUEUE_PUT_TIMEOUT', 2))
+# Окно повторов: сколько последних update_id помнить, чтобы не обработать повторную доставку
+UPDATE_DEDUP_WINDOW = int(os.getenv('UPDATE_DEDUP_WINDOW', 10000))
+
+# Трассировка обновлений: обновления дольше TRACE_SLOW_MS сохраняются с разбивкой по этапам
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 500))
+TRACE_SLOW_BUFFER = int(os.getenv('TRACE_SLOW_BUFFER', 50))
+# Сколько последних длительностей каждого этапа хранить для перцентилей
+TRACE_STAGE_SAMPLES = int(os.getenv('TRACE_STAGE_SAMPLES', 1000))
+
+# Токен для /debug/profile (заголовок X-Debug-Token); без токена профилирование недоступно
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN', '')
+# Частота снятия стеков (не меньше 1 Гц) и наибольшая длительность профилирования
+PROFILE_HZ = max(int(os.getenv('PROFILE_HZ', 100)), 1)
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 25))
+
+# Фоновый опрос getWebhookInfo: период (с), сколько замеров хранить и сколько
+# замеров подряд очередь Telegram должна расти, чтобы считаться растущей
+WEBHOOK_MONITOR_INTERVAL = float(os.getenv('WEBHOOK_MONITOR_INTERVAL', 30))
+WEBHOOK_MONITOR_HISTORY = int(os.getenv('WEBHOOK_MONITOR_HISTORY', 120))
+WEBHOOK_BACKLOG_SAMPLES = int(os.getenv('WEBHOOK_BACKLOG_SAMPLES', 3))
+
+# Запись входящих обновлений для tools/replay.py (пусто - выключена); {pid} заменяется номером процесса.
+# Соль задает псевдонимы id пользователей: с одной солью записи разных дней совместимы
+WEBHOOK_RECORD_PATH = os.getenv('WEBHOOK_RECORD_PATH', '')
+WEBHOOK_RECORD_SALT = os.getenv('WEBHOOK_RECORD_SALT', '')
+WEBHOOK_RECORD_MAX_MB = float(os.getenv('WEBHOOK_RECORD_MAX_MB', 100))
+
+# /health отвечает 503, если очередь заполнена на эту долю
+HEALTH_BACKLOG_RATIO = float(os.getenv('HEALTH_BACKLOG_RATIO', 0.9))
+
+# Сколько последних отредактированных сообщений помнить, чтобы не повторять одинаковое
+# editMessageText (0 - выключено; кэш у каждого процесса свой, см. edit_cache.py)
+EDIT_CACHE_SIZE = int(os.getenv('EDIT_CACHE_SIZE', 10000))
+
+# Возвращать последнее действие обработчика в теле ответа на вебхук
+WEBHOOK_REPLY = os.getenv('WEBHOOK_REPLY', '').lower() in ('1', 'true', 'yes')
+
+# База данных SQLite
+DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_data.db'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', 64))
+# Фоновая запись событий: пачка пишется раз в DB_WRITE_FLUSH_MS или по набору DB_WRITE_BATCH_SIZE
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 200))
+DB_WRITE_FLUSH_MS = int(os.getenv('DB_WRITE_FLUSH_MS', 200))
+DB_WRITE_QUEUE_SIZE = int(os.getenv('DB_WRITE_QUEUE_SIZE', 10000))
+# Повторы пачки при ошибке записи (пауза удваивается от DB_WRITE_RETRY_BACKOFF_MS),
+# после них события пишутся по одному и теряются только сбойные
+DB_WRITE_RETRIES = int(os.getenv('DB_WRITE_RETRIES', 3))
+DB_WRITE_RETRY_BACKOFF_MS = int(os.getenv('DB_WRITE_RETRY_BACKOFF_MS', 100))
+# Кэш сессий: сколько пользователей помнить и с какой точностью (в секундах) хранить
+# last_activity - повторный /start без изменений профиля пишется в базу не чаще этого
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+SESSION_ACTIVITY_GRANULARITY = int(os.getenv('SESSION_ACTIVITY_GRANULARITY', 3600))
+
+# Рассылки: лимит Telegram ~30 сообщений/с на бота, берем с запасом
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 4))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 100))
+# Аренда рассылки процессом: после падения владельца ее подхватит другой процесс
+BROADCAST_LEASE_SECONDS = int(os.getenv('BROADCAST_LEASE_SECONDS', 60))
+
+# Файл контента (реквизиты, районы, документы, FAQ, администраторы)
+CONTENT_PATH = os.getenv('CONTENT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content.toml'))
+# Как часто (в секундах) проверять mtime файла контента
+CONTENT_CHECK_INTERVAL = float(os.getenv('CONTENT_CHECK_INTERVAL', 2))
@@ -0,0 +1,145 @@
+import os
+import signal
+import hashlib
+import logging
+import threading
+import time
+import tomllib
+from types import MappingProxyType
+
+from config import ADMINS, CONTENT_PATH, CONTENT_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class Content:
+    """Неизменяемый снимок контента бота.
+
+    districts - районы в порядке файла, bases - индекс base_key -> (district_key, base),
+    admins - frozenset из переменной ADMINS и списка admins в файле.
+    """
+
+    __slots__ = ('org', 'districts', 'bases', 'documents', 'faq', 'admins', 'version', 'mtime')
+
+    def __init__(self, org, districts, bases, documents, faq, admins, version, mtime):
+        self.org = org
+        self.districts = districts
+        self.bases = bases
+        self.documents = documents
+        self.faq = faq
+        self.admins = admins
+        self.version = version
+        self.mtime = mtime
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def compile_content(raw, data, mtime=None):
+    """Собирает Content из разобранного TOML; raw - исходные байты файла для версии"""
+    districts = _freeze(data.get('districts', {}))
+    bases = {}
+    for district_key, district_info in districts.items():
+        for base_key, base_info in district_info.get('bases', {}).items():
+            if base_key in bases:
+                raise ValueError(f"Duplicate base key {base_key!r}")
+            bases[base_key] = (district_key, base_info)
+
+    admins = frozenset(ADMINS) | frozenset(int(admin_id) for admin_id in data.get('admins', []))
+
+    return Content(
+        org=_freeze(data.get('org', {})),
+        districts=districts,
+        bases=MappingProxyType(bases),
+        documents=data.get('documents', ''),
+        faq=data.get('faq', ''),
+        admins=admins,
+        # ADMINS из окружения тоже влияют на экраны (число администраторов)
+        version=hashlib.sha1(raw + repr(sorted(admins)).encode('ascii')).hexdigest()[:12],
+        mtime=mtime,
+    )
+
+
+def load(path=CONTENT_PATH):
+    with open(path, 'rb') as f:
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+        raw = f.read()
+    return compile_content(raw, tomllib.loads(raw.decode('utf-8')), mtime)
+
+
+_lock = threading.Lock()
+_current = load()
+_checked_at = time.monotonic()
+# mtime последней попытки загрузки: битый файл не перечитывается повторно до следующего изменения
+_seen_mtime = _current.mtime
+_reload_requested = False
+
+logger.info(f"📚 Content loaded from {CONTENT_PATH} (version {_current.version})")
+
+
+def reload():
+    """Перечитывает файл; при ошибке остается прежний снимок"""
+    global _current
+    try:
+        content = load()
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Content reload failed, keeping version {_current.version}: {e}")
+        return _current
+    if content.version != _current.version:
+        logger.info(f"🔄 Content reloaded: {_current.version} -> {content.version}")
+    # Замена ссылки атомарна: читатели видят либо старый, либо новый снимок целиком
+    _current = content
+    return content
+
+
+def _maybe_reload():
+    global _checked_at, _seen_mtime, _reload_requested
+    with _lock:
+        now = time.monotonic()
+        if not _reload_requested and now - _checked_at < CONTENT_CHECK_INTERVAL:
+            return
+        forced = _reload_requested
+        _checked_at = now
+        _reload_requested = False
+        try:
+            mtime = os.stat(CONTENT_PATH).st_mtime_ns
+        except OSError as e:
+            logger.error(f"❌ Content file unavailable: {e}")
+            return
+        if forced or mtime != _seen_mtime:
+            _seen_mtime = mtime
+            reload()
+
+
+def get():
+    """Текущий снимок контента; файл проверяется не чаще CONTENT_CHECK_INTERVAL секунд"""
+    if _reload_requested or time.monotonic() - _checked_at >= CONTENT_CHECK_INTERVAL:
+        _maybe_reload()
+    return _current
+
+
+def get_version():
+    return _current.version
+
+
+def is_admin(user_id):
+    """Проверяет, является ли пользователь администратором"""
+    return user_id in get().admins
+
+
+def _on_sighup(signum, frame):
+    # Только выставляем флаг: перечитывание выполнит следующий get() вне обработчика сигнала
+    global _reload_requested
+    _reload_requested = True
+
+
+try:
+    signal.signal(signal.SIGHUP, _on_sighup)
+except (AttributeError, ValueError):
+    # Нет SIGHUP (Windows) или модуль импортирован не из главного потока
+    pass
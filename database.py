@@ -1,177 +1,431 @@
 import sqlite3
-from datetime import datetime
+import json
+from collections import OrderedDict
+from datetime import datetime, timezone
+import atexit
 import logging
 import os
+import threading
+import weakref
+
+import content
+import metrics
+import migrations
+import tracing
+from config import (
+    DB_PATH,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHED_STATEMENTS,
+    DB_WRITE_BATCH_SIZE,
+    DB_WRITE_FLUSH_MS,
+    DB_WRITE_QUEUE_SIZE,
+    DB_WRITE_RETRIES,
+    DB_WRITE_RETRY_BACKOFF_MS,
+    SESSION_CACHE_SIZE,
+    SESSION_ACTIVITY_GRANULARITY,
+    BROADCAST_BATCH_SIZE,
+)
+from db_writer import EventWriter
 
 logger = logging.getLogger(__name__)
 
-# Импортируем ADMINS с обработкой ошибок
-try:
-    from config import ADMINS
-except ImportError:
-    ADMINS = []
-    logger.warning("ADMINS not found in config, using empty list")
+DB_SECONDS = metrics.Histogram('bot_db_seconds', 'Latency of database.py functions.', ('function',))
+SESSION_WRITES = metrics.Counter(
+    'bot_session_writes_total', 'save_user_session calls: written, skipped as unchanged, or lost by the event writer.', ('result',)
+)
 
-def get_db_connection():
-    """Создает соединение с базой данных"""
-    # На Render.com используем абсолютный путь
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_data.db')
-    conn = sqlite3.connect(db_path)
+def _timed(func):
+    return tracing.spanned('db.' + func.__name__)(metrics.timed(DB_SECONDS)(func))
+
+class _Connection(sqlite3.Connection):
+    """Соединение с поддержкой weakref для реестра открытых соединений"""
+
+# Одно долгоживущее соединение на поток: без повторного открытия файла,
+# чтения схемы и подготовки запросов на каждый вызов. Реестр хранит слабые
+# ссылки, поэтому соединение завершившегося потока закрывается вместе с ним.
+_local = threading.local()
+_connections = weakref.WeakSet()
+_connections_lock = threading.Lock()
+# Схема проверяется первым соединением процесса; после fork остается актуальной
+_schema_lock = threading.Lock()
+_schema_ready = False
+# Соединения, унаследованные от родителя после fork: их нельзя ни использовать,
+# ни закрывать в дочернем процессе (закрытие может выполнить checkpoint WAL)
+_inherited = []
+
+def _connect():
+    # check_same_thread=False только ради close_all_connections из другого потока;
+    # само соединение используется лишь создавшим его потоком
+    conn = sqlite3.connect(
+        DB_PATH,
+        factory=_Connection,
+        cached_statements=DB_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
     return conn
 
+def get_db_connection():
+    """Возвращает соединение с базой данных текущего потока.
+
+    Соединение не нужно закрывать; записи выполняются в блоке `with conn:`,
+    который делает commit или rollback.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        if not _schema_ready:
+            try:
+                _ensure_schema(conn)
+            except Exception:
+                conn.close()
+                raise
+        _local.conn = conn
+        with _connections_lock:
+            _connections.add(conn)
+    return conn
+
+def _ensure_schema(conn):
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            migrations.migrate(conn)
+            _schema_ready = True
+
+def close_all_connections():
+    """Закрывает все соединения процесса (при завершении)"""
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка закрытия соединения с БД: {e}")
+    _local.__dict__.pop('conn', None)
+
+def _reset_after_fork():
+    global _local, _connections_lock, _sessions_lock
+    _inherited.extend(_connections)
+    _connections.clear()
+    _local = threading.local()
+    _connections_lock = threading.Lock()
+    _sessions_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+atexit.register(close_all_connections)
+
+# Регистрируется в atexit после close_all_connections, поэтому дописывает
+# очередь раньше, чем закрываются соединения
+event_writer = EventWriter(
+    get_db_connection,
+    batch_size=DB_WRITE_BATCH_SIZE,
+    flush_interval=DB_WRITE_FLUSH_MS / 1000,
+    maxsize=DB_WRITE_QUEUE_SIZE,
+    retries=DB_WRITE_RETRIES,
+    retry_backoff=DB_WRITE_RETRY_BACKOFF_MS / 1000,
+    # _forget_lost_session определена ниже, вместе с кэшем сессий
+    on_lost=lambda statements: _forget_lost_session(statements),
+)
+
+def _utc_now():
+    """Время события в формате CURRENT_TIMESTAMP: в базу оно попадает позже"""
+    return _format_time(datetime.now(timezone.utc))
+
+def _format_time(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+# Известные пользователи: user_id -> (записанный профиль, время записи last_activity).
+# Повторная сессия пишется в базу, только если изменился профиль, прошло
+# SESSION_ACTIVITY_GRANULARITY секунд или сменились сутки: по суткам считаются
+# активные пользователи в сводках. У каждого процесса свой кэш; промах означает
+# лишь лишнюю запись
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+_session_stats = {'written': 0, 'skipped': 0, 'lost': 0}
+
 def init_db():
-    """Инициализация базы данных"""
+    """Проверка схемы базы данных (миграции применяются один раз за процесс)"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Таблица пользовательских сессий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                district TEXT,
-                base TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица запросов на тренировки
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS training_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                district TEXT,
-                base TEXT,
-                child_info TEXT,
-                contact TEXT,
-                status TEXT DEFAULT 'new',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица статистики
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bot_statistics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                action_type TEXT,
-                user_id INTEGER,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица административных действий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admin_actions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id INTEGER,
-                action TEXT,
-                target_user_id INTEGER,
-                details TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        logger.info("✅ База данных инициализирована")
+        logger.info(f"✅ База данных инициализирована (схема v{migrations.get_version(conn)})")
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации БД: {e}")
 
+# Запросы событий вместе с обновлением сводных таблиц; выполняются одной пачкой
+# в потоке записи, поэтому счетчики всегда согласованы с таблицами событий
+_SESSION_UNSEE_DAY_SQL = '''
+    UPDATE stats_daily SET last_seen_users = last_seen_users - 1
+    WHERE day = (SELECT date(last_activity) FROM user_sessions WHERE user_id = ?)
+'''
+_SESSION_COUNT_USER_SQL = '''
+    INSERT INTO stats_totals (name, value)
+    SELECT 'users', 1 WHERE NOT EXISTS (SELECT 1 FROM user_sessions WHERE user_id = ?)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1
+'''
+_SESSION_SEE_DAY_SQL = '''
+    INSERT INTO stats_daily (day, new_users, last_seen_users)
+    VALUES (date(?), NOT EXISTS (SELECT 1 FROM user_sessions WHERE user_id = ?), 1)
+    ON CONFLICT(day) DO UPDATE SET
+        new_users = new_users + excluded.new_users,
+        last_seen_users = last_seen_users + 1
+'''
+# Обновление на месте: created_at сохраняется, район и база без значения не затираются
+_SESSION_SAVE_SQL = '''
+    INSERT INTO user_sessions
+    (user_id, username, first_name, last_name, district, base, created_at, last_activity)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        district = COALESCE(excluded.district, district),
+        base = COALESCE(excluded.base, base),
+        last_activity = excluded.last_activity
+'''
+_ACTION_INSERT_SQL = '''
+    INSERT INTO bot_statistics (action_type, user_id, district, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+_ACTION_COUNT_SQL = '''
+    INSERT INTO stats_actions (action_type, count) VALUES (?, 1)
+    ON CONFLICT(action_type) DO UPDATE SET count = count + 1
+'''
+_ACTION_DAY_SQL = '''
+    INSERT INTO stats_daily (day, actions) VALUES (date(?), 1)
+    ON CONFLICT(day) DO UPDATE SET actions = actions + 1
+'''
+_ACTION_DISTRICT_SQL = '''
+    INSERT INTO stats_districts (district, count) VALUES (?, 1)
+    ON CONFLICT(district) DO UPDATE SET count = count + 1
+'''
+
+# Запросы чтения, которые выполняются на каждом экране статистики и карточке пользователя
+_USER_SESSION_SQL = 'SELECT * FROM user_sessions WHERE user_id = ?'
+_USER_ACTIONS_SQL = '''
+    SELECT action_type, COUNT(*) FROM bot_statistics
+    WHERE user_id = ? GROUP BY action_type
+'''
+_RECENT_ACTIONS_SQL = '''
+    SELECT action_type, timestamp FROM bot_statistics
+    ORDER BY timestamp DESC LIMIT 10
+'''
+_TOTAL_USERS_SQL = "SELECT value FROM stats_totals WHERE name = 'users'"
+# Каждый пользователь учтен ровно в одном дне - дне последней активности
+_RECENT_USERS_SQL = '''
+    SELECT COALESCE(SUM(last_seen_users), 0) FROM stats_daily
+    WHERE day > date('now', ?)
+'''
+_TRAINING_REQUESTS_BY_STATUS_SQL = '''
+    SELECT * FROM training_requests
+    WHERE status = ?
+    ORDER BY created_at DESC
+'''
+# Страница получателей рассылки: keyset по первичному ключу, исключения -
+# JSON-массивом в одном параметре, фильтры сегмента не заданы, если параметр NULL
+_RECIPIENTS_PAGE_SQL = '''
+    SELECT user_id FROM user_sessions
+    WHERE user_id > ?
+      AND user_id NOT IN (SELECT value FROM json_each(?))
+      AND (? IS NULL OR district = ?)
+      AND (? IS NULL OR last_activity >= datetime('now', ?))
+    ORDER BY user_id LIMIT ?
+'''
+
+# Горячие запросы с примерами параметров: tools/check_query_plans.py проверяет,
+# что ни один из них не читает таблицу целиком
+HOT_QUERIES = {
+    'session_unsee_day': (_SESSION_UNSEE_DAY_SQL, (1,)),
+    'session_count_user': (_SESSION_COUNT_USER_SQL, (1,)),
+    'session_see_day': (_SESSION_SEE_DAY_SQL, ('2024-01-01 00:00:00', 1)),
+    'session_save': (_SESSION_SAVE_SQL, (1, 'user', 'Имя', None, None, None,
+                                         '2024-01-01 00:00:00', '2024-01-01 00:00:00')),
+    'action_count': (_ACTION_COUNT_SQL, ('start',)),
+    'action_day': (_ACTION_DAY_SQL, ('2024-01-01 00:00:00',)),
+    'action_district': (_ACTION_DISTRICT_SQL, ('central',)),
+    'user_session': (_USER_SESSION_SQL, (1,)),
+    'user_actions': (_USER_ACTIONS_SQL, (1,)),
+    'recent_actions': (_RECENT_ACTIONS_SQL, ()),
+    'total_users': (_TOTAL_USERS_SQL, ()),
+    'recent_users': (_RECENT_USERS_SQL, ('-30 days',)),
+    'training_requests_by_status': (_TRAINING_REQUESTS_BY_STATUS_SQL, ('new',)),
+    'recipients_page': (_RECIPIENTS_PAGE_SQL, (0, '[1, 2]', None, None, '-30 days', '-30 days', 100)),
+}
+
+@_timed
 def save_user_session(user_id, username, first_name, last_name, district=None, base=None):
-    """Сохранение сессии пользователя"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_sessions 
-            (user_id, username, first_name, last_name, district, base, last_activity)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (user_id, username, first_name, last_name, district, base))
-        
-        conn.commit()
-        conn.close()
-        logger.debug(f"💾 Сохранена сессия пользователя {user_id}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения сессии пользователя {user_id}: {e}")
+    """Сохранение сессии пользователя (в фоне, без ожидания записи).
 
-def log_user_action(user_id, action_type):
-    """Логирование действий пользователя"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO bot_statistics (action_type, user_id)
-            VALUES (?, ?)
-        ''', (action_type, user_id))
-        
-        conn.commit()
-        conn.close()
-        logger.debug(f"📊 Залогировано действие {action_type} для пользователя {user_id}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка логирования действия пользователя {user_id}: {e}")
+    Сессия без изменений профиля, записанная недавно, в базу не пишется
+    (см. _sessions); район и база None сохраненные значения не затирают.
+    """
+    moment = datetime.now(timezone.utc)
+    with _sessions_lock:
+        cached = _sessions.get(user_id)
+        if cached is not None:
+            _sessions.move_to_end(user_id)
+    if cached is not None:
+        known, written_at = cached
+        district = known[3] if district is None else district
+        base = known[4] if base is None else base
+    profile = (username, first_name, last_name, district, base)
+    if (cached is not None and profile == known and moment.date() == written_at.date()
+            and (moment - written_at).total_seconds() < SESSION_ACTIVITY_GRANULARITY):
+        with _sessions_lock:
+            _session_stats['skipped'] += 1
+        SESSION_WRITES.inc(('skipped',))
+        return
+
+    # Кэш обновляется до постановки в очередь: если писатель потеряет событие,
+    # _forget_lost_session найдет и удалит уже эту запись
+    with _sessions_lock:
+        if SESSION_CACHE_SIZE > 0:
+            _sessions[user_id] = (profile, moment)
+            _sessions.move_to_end(user_id)
+            if len(_sessions) > SESSION_CACHE_SIZE:
+                _sessions.popitem(last=False)
+    now = _format_time(moment)
+    if not event_writer.submit_many((
+        (_SESSION_UNSEE_DAY_SQL, (user_id,)),
+        (_SESSION_COUNT_USER_SQL, (user_id,)),
+        (_SESSION_SEE_DAY_SQL, (now, user_id)),
+        (_SESSION_SAVE_SQL, (user_id, username, first_name, last_name, district, base, now, now)),
+    )):
+        _forget_session(user_id, moment)
+        logger.warning(f"⚠️ Очередь записи переполнена, сессия пользователя {user_id} не сохранена")
+        return
+    logger.debug(f"💾 Сессия пользователя {user_id} поставлена в очередь записи")
+    SESSION_WRITES.inc(('written',))
+    with _sessions_lock:
+        _session_stats['written'] += 1
+
+def _forget_session(user_id, moment=None):
+    """Удаляет сессию из кэша (только запись от moment, если он задан)"""
+    with _sessions_lock:
+        cached = _sessions.get(user_id)
+        if cached is not None and (moment is None or cached[1] == moment):
+            del _sessions[user_id]
+
+def _forget_lost_session(statements):
+    """Писатель отбросил событие: сессия из него не записана, следующий вызов запишет ее снова"""
+    for sql, params in statements:
+        if sql == _SESSION_SAVE_SQL:
+            _forget_session(params[0])
+            with _sessions_lock:
+                _session_stats['lost'] += 1
+            SESSION_WRITES.inc(('lost',))
+
+def get_session_cache_stats():
+    """Записанные и пропущенные сессии и заполнение кэша сессий"""
+    with _sessions_lock:
+        stats = dict(_session_stats)
+        stats['size'] = len(_sessions)
+    total = stats['written'] + stats['skipped']
+    stats.update({
+        'capacity': SESSION_CACHE_SIZE,
+        'granularity_seconds': SESSION_ACTIVITY_GRANULARITY,
+        'skip_rate': round(stats['skipped'] / total, 4) if total else 0.0,
+    })
+    return stats
 
+@_timed
+def log_user_action(user_id, action_type, district=None):
+    """Логирование действий пользователя (в фоне, без ожидания записи)"""
+    now = _utc_now()
+    statements = [
+        (_ACTION_INSERT_SQL, (action_type, user_id, district, now)),
+        (_ACTION_COUNT_SQL, (action_type,)),
+        (_ACTION_DAY_SQL, (now,)),
+    ]
+    if district:
+        statements.append((_ACTION_DISTRICT_SQL, (district,)))
+    if event_writer.submit_many(statements):
+        logger.debug(f"📊 Действие {action_type} пользователя {user_id} поставлено в очередь записи")
+    else:
+        logger.warning(f"⚠️ Очередь записи переполнена, действие {action_type} пользователя {user_id} потеряно")
+
+@_timed
 def log_admin_action(admin_id, action, target_user_id=None, details=None):
     """Логирование действий администратора"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO admin_actions (admin_id, action, target_user_id, details)
-            VALUES (?, ?, ?, ?)
-        ''', (admin_id, action, target_user_id, details))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO admin_actions (admin_id, action, target_user_id, details)
+                VALUES (?, ?, ?, ?)
+            ''', (admin_id, action, target_user_id, details))
         logger.debug(f"🛠 Залогировано действие администратора {admin_id}: {action}")
     except Exception as e:
         logger.error(f"❌ Ошибка логирования действия администратора {admin_id}: {e}")
 
+_STATE_MAX_SQL = '''
+    INSERT INTO bot_state (key, value, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value), updated_at = excluded.updated_at
+'''
+_STATE_MIN_SQL = '''
+    INSERT INTO bot_state (key, value, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = MIN(value, excluded.value), updated_at = excluded.updated_at
+'''
+
+@_timed
+def get_state(key, max_age_days=None):
+    """Служебное значение из bot_state или None (также если оно старше max_age_days)"""
+    query = 'SELECT value FROM bot_state WHERE key = ?'
+    params = (key,)
+    if max_age_days is not None:
+        query += " AND updated_at > datetime('now', ?)"
+        params = (key, f'-{int(max_age_days)} days')
+    row = get_db_connection().execute(query, params).fetchone()
+    return row[0] if row else None
+
+@_timed
+def save_state_max(key, value):
+    """Фоновая запись значения в bot_state, только если оно больше сохраненного"""
+    if not event_writer.submit(_STATE_MAX_SQL, (key, value, _utc_now())):
+        logger.warning(f"⚠️ Очередь записи переполнена, значение {key}={value} не сохранено")
+
+@_timed
+def save_state_min(key, value):
+    """Фоновая запись значения в bot_state, только если оно меньше сохраненного (откат отметки)"""
+    if not event_writer.submit(_STATE_MIN_SQL, (key, value, _utc_now())):
+        logger.warning(f"⚠️ Очередь записи переполнена, значение {key}={value} не сохранено")
+
+@_timed
 def get_statistics():
-    """Получение статистики бота"""
+    """Получение статистики бота из сводных таблиц (время не зависит от объема истории)"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
+
         # Общее количество пользователей
-        cursor.execute('SELECT COUNT(*) FROM user_sessions')
-        total_users = cursor.fetchone()[0]
-        
+        total_users = _count_users(cursor)
+
         # Активные пользователи (за последние 30 дней)
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_sessions 
-            WHERE last_activity > datetime('now', '-30 days')
-        ''')
-        active_users = cursor.fetchone()[0]
-        
+        active_users = _count_recent_users(cursor, 30)
+
         # Количество действий по типам
-        cursor.execute('''
-            SELECT action_type, COUNT(*) FROM bot_statistics 
-            GROUP BY action_type
-        ''')
-        actions_result = cursor.fetchall()
-        actions_count = dict(actions_result) if actions_result else {}
-        
+        cursor.execute('SELECT action_type, count FROM stats_actions')
+        actions_count = dict(cursor.fetchall())
+
+        # Выборы районов и баз
+        cursor.execute('SELECT district, count FROM stats_districts')
+        districts_count = dict(cursor.fetchall())
+
         # Последние действия
-        cursor.execute('''
-            SELECT action_type, timestamp FROM bot_statistics 
-            ORDER BY timestamp DESC LIMIT 10
-        ''')
+        cursor.execute(_RECENT_ACTIONS_SQL)
         recent_actions = cursor.fetchall()
-        
-        conn.close()
-        
+
         return {
             'total_users': total_users,
             'active_users': active_users,
             'actions_count': actions_count,
+            'districts_count': districts_count,
             'recent_actions': recent_actions
         }
     except Exception as e:
@@ -180,27 +434,41 @@ def get_statistics():
             'total_users': 0,
             'active_users': 0,
             'actions_count': {},
+            'districts_count': {},
             'recent_actions': []
         }
 
+def _count_users(cursor):
+    row = cursor.execute(_TOTAL_USERS_SQL).fetchone()
+    return row[0] if row else 0
+
+def _count_recent_users(cursor, days):
+    cursor.execute(_RECENT_USERS_SQL, (f'-{days} days',))
+    return cursor.fetchone()[0]
+
+@_timed
+def rebuild_stats_rollups():
+    """Пересчитывает сводные таблицы статистики по всей истории (разовая операция)"""
+    conn = get_db_connection()
+    with conn:
+        days = migrations.rebuild_stats_rollups(conn)
+    logger.info(f"📊 Сводная статистика пересчитана: {days} дней")
+    return days
+
+@_timed
 def get_user_info(user_id):
     """Получение информации о пользователе"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM user_sessions WHERE user_id = ?', (user_id,))
+        cursor.execute(_USER_SESSION_SQL, (user_id,))
         user_data = cursor.fetchone()
         
-        cursor.execute('''
-            SELECT action_type, COUNT(*) FROM bot_statistics 
-            WHERE user_id = ? GROUP BY action_type
-        ''', (user_id,))
+        cursor.execute(_USER_ACTIONS_SQL, (user_id,))
         user_actions_result = cursor.fetchall()
         user_actions = dict(user_actions_result) if user_actions_result else {}
         
-        conn.close()
-        
         return {
             'user_data': user_data,
             'user_actions': user_actions
@@ -212,52 +480,55 @@ def get_user_info(user_id):
             'user_actions': {}
         }
 
+def iter_recipients(exclude_admins=False, exclude=(), district=None, active_days=None,
+                    page_size=BROADCAST_BATCH_SIZE):
+    """Поток user_id получателей рассылки по возрастанию.
+
+    Читает user_sessions страницами по page_size строк (keyset по user_id),
+    поэтому память не зависит от числа пользователей. Исключения и фильтры
+    сегмента (район, активность за active_days дней) применяются в SQL.
+    """
+    excluded = set(exclude)
+    if exclude_admins:
+        excluded |= content.get().admins
+    excluded = json.dumps(sorted(excluded))
+    active = f'-{int(active_days)} days' if active_days else None
+
+    conn = get_db_connection()
+    last_user_id = -2 ** 63
+    while True:
+        rows = conn.execute(
+            _RECIPIENTS_PAGE_SQL,
+            (last_user_id, excluded, district, district, active, active, page_size)
+        ).fetchall()
+        for row in rows:
+            yield row[0]
+        if len(rows) < page_size:
+            return
+        last_user_id = rows[-1][0]
+
 def broadcast_message(message, exclude_admins=False):
-    """Получение списка пользователей для рассылки"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if exclude_admins and ADMINS:
-            # Исключаем администраторов из рассылки
-            placeholders = ','.join('?' * len(ADMINS))
-            query = f'''
-                SELECT user_id FROM user_sessions 
-                WHERE user_id NOT IN ({placeholders})
-            '''
-            cursor.execute(query, ADMINS)
-        else:
-            # Все пользователи
-            cursor.execute('SELECT user_id FROM user_sessions')
-        
-        users = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        logger.debug(f"📢 Получен список пользователей для рассылки: {len(users)} пользователей")
-        return users
-    except Exception as e:
-        logger.error(f"❌ Ошибка получения списка для рассылки: {e}")
-        return []
+    """Получатели рассылки: поток user_id (см. iter_recipients)"""
+    return iter_recipients(exclude_admins=exclude_admins)
 
+@_timed
 def add_training_request(user_id, district, base, child_info, contact):
     """Добавление заявки на тренировку"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO training_requests (user_id, district, base, child_info, contact)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, district, base, child_info, contact))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO training_requests (user_id, district, base, child_info, contact)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, district, base, child_info, contact))
         logger.info(f"✅ Добавлена заявка на тренировку от пользователя {user_id}")
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка добавления заявки на тренировку: {e}")
         return False
 
+@_timed
 def get_training_requests(status=None):
     """Получение заявок на тренировки"""
     try:
@@ -265,11 +536,7 @@ def get_training_requests(status=None):
         cursor = conn.cursor()
         
         if status:
-            cursor.execute('''
-                SELECT * FROM training_requests 
-                WHERE status = ? 
-                ORDER BY created_at DESC
-            ''', (status,))
+            cursor.execute(_TRAINING_REQUESTS_BY_STATUS_SQL, (status,))
         else:
             cursor.execute('''
                 SELECT * FROM training_requests 
@@ -277,65 +544,46 @@ def get_training_requests(status=None):
             ''')
         
         requests = cursor.fetchall()
-        conn.close()
-        
         return requests
     except Exception as e:
         logger.error(f"❌ Ошибка получения заявок на тренировки: {e}")
         return []
 
+@_timed
 def update_training_request_status(request_id, status):
     """Обновление статуса заявки на тренировку"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE training_requests 
-            SET status = ? 
-            WHERE id = ?
-        ''', (status, request_id))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE training_requests 
+                SET status = ? 
+                WHERE id = ?
+            ''', (status, request_id))
         logger.info(f"✅ Обновлен статус заявки {request_id} на '{status}'")
         return True
     except Exception as e:
         logger.error(f"❌ Ошибка обновления статуса заявки {request_id}: {e}")
         return False
 
+@_timed
 def get_user_count():
     """Получение общего количества пользователей"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM user_sessions')
-        count = cursor.fetchone()[0]
-        
-        conn.close()
-        return count
+        return _count_users(conn.cursor())
     except Exception as e:
         logger.error(f"❌ Ошибка получения количества пользователей: {e}")
         return 0
 
+@_timed
 def get_recent_users(days=7):
     """Получение пользователей, активных за последние N дней"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_sessions 
-            WHERE last_activity > datetime('now', ?)
-        ''', (f'-{days} days',))
-        
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
+        return _count_recent_users(conn.cursor(), days)
     except Exception as e:
         logger.error(f"❌ Ошибка получения недавних пользователей: {e}")
         return 0
 
-# Автоматически инициализируем базу данных при импорте модуля
-init_db()
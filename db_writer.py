@@ -0,0 +1,258 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.Histogram('bot_db_write_flush_seconds', 'Time to write one batch of events to SQLite.')
+WRITE_LATENCY_SECONDS = metrics.Histogram(
+    'bot_db_write_latency_seconds', 'Time from enqueueing an event to its commit.'
+)
+LOST_EVENTS = metrics.Counter(
+    'bot_db_write_lost_total', 'Queued events dropped because they could not be written even one by one.'
+)
+
+_STOP = object()
+
+
+class EventWriter:
+    """Фоновая запись событий в SQLite пачками.
+
+    Обработчики только кладут событие - один или несколько запросов (sql, params) -
+    в очередь без ожидания; поток-писатель
+    записывает накопленное одной транзакцией раз в flush_interval секунд или
+    как только набралось batch_size событий. При переполнении очереди событие
+    отбрасывается и учитывается в счетчике dropped.
+
+    Неудачная пачка (например, database is locked дольше busy_timeout) повторяется
+    до retries раз с удвоением паузы от retry_backoff секунд, затем записывается
+    по одному событию в отдельных транзакциях: теряются только события, которые
+    не записываются сами по себе (счетчик failed). Их запросы передаются в
+    on_lost, чтобы вызывающий код мог забыть то, что считал записанным.
+    """
+
+    def __init__(self, connect, batch_size=200, flush_interval=0.2, maxsize=10000,
+                 retries=3, retry_backoff=0.1, on_lost=None):
+        self.connect = connect
+        self.on_lost = on_lost
+        self.retries = max(int(retries), 0)
+        self.retry_backoff = retry_backoff
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = flush_interval
+        self.maxsize = max(int(maxsize), 1)
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Поток-писатель родителя не переживает fork
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.close)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'retries': 0,
+            'replayed_batches': 0,
+            'flushes': 0,
+            'last_flush_size': 0,
+            'max_flush_size': 0,
+            'flush_time_total': 0.0,
+            'flush_time_max': 0.0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+            logger.info(f"✍️ DB event writer started (pid {os.getpid()})")
+
+    def submit(self, sql, params):
+        """Ставит запись в очередь; возвращает False, если событие отброшено"""
+        return self.submit_many(((sql, params),))
+
+    def submit_many(self, statements):
+        """Ставит в очередь событие из нескольких запросов: они попадут в одну пачку"""
+        if self._closed:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.monotonic(), tuple(statements)))
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _execute(self, batch):
+        conn = self.connect()
+        with conn:
+            # Подряд идущие одинаковые запросы выполняются одним executemany,
+            # порядок событий сохраняется
+            run_sql, run_params = None, []
+            for _, statements in batch:
+                for sql, params in statements:
+                    if sql != run_sql and run_params:
+                        conn.executemany(run_sql, run_params)
+                        run_params = []
+                    run_sql = sql
+                    run_params.append(params)
+            if run_params:
+                conn.executemany(run_sql, run_params)
+
+    def _write_slowly(self, batch):
+        """Пачка не записалась и после повторов: события по одному, теряются только сбойные"""
+        written = []
+        for event in batch:
+            try:
+                self._execute((event,))
+            except Exception as e:
+                logger.error(f"❌ Событие из {len(event[1])} запросов не записано и отброшено: {e}")
+                self._lost(event[1])
+                continue
+            written.append(event)
+        with self._lock:
+            self._stats['replayed_batches'] += 1
+            self._stats['failed'] += len(batch) - len(written)
+        if len(written) < len(batch):
+            LOST_EVENTS.inc(amount=len(batch) - len(written))
+        return written
+
+    def _lost(self, statements):
+        if self.on_lost is None:
+            return
+        try:
+            self.on_lost(statements)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработчика потерянного события: {e}")
+
+    def _write(self, batch):
+        started = time.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                self._execute(batch)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"❌ Ошибка записи пачки событий ({len(batch)}), запись по одному: {e}")
+                    batch = self._write_slowly(batch)
+                    break
+                with self._lock:
+                    self._stats['retries'] += 1
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(f"⚠️ Ошибка записи пачки событий ({len(batch)}), повтор через {delay:.2f} с: {e}")
+                time.sleep(delay)
+        if not batch:
+            return
+
+        finished = time.monotonic()
+        flush_time = finished - started
+        latency_max = finished - batch[0][0]
+        FLUSH_SECONDS.observe(flush_time)
+        for enqueued_at, _ in batch:
+            WRITE_LATENCY_SECONDS.observe(finished - enqueued_at)
+        with self._lock:
+            stats = self._stats
+            stats['written'] += len(batch)
+            stats['flushes'] += 1
+            stats['last_flush_size'] = len(batch)
+            stats['max_flush_size'] = max(stats['max_flush_size'], len(batch))
+            stats['flush_time_total'] += flush_time
+            stats['flush_time_max'] = max(stats['flush_time_max'], flush_time)
+            stats['latency_total'] += sum(finished - enqueued_at for enqueued_at, _ in batch)
+            stats['latency_max'] = max(stats['latency_max'], latency_max)
+
+    def flush(self, timeout=5.0):
+        """Ждет, пока очередь опустеет (для инструментов и остановки)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                stats = self._stats
+                done = stats['written'] + stats['failed'] >= stats['enqueued']
+            if done:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def close(self, timeout=5.0):
+        """Дописывает очередь и останавливает поток (вызывается при завершении)"""
+        if self._closed:
+            return
+        self._closed = True
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        # Ждем места в очереди: маркер остановки не должен потеряться при полной очереди
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error(f"❌ DB event writer queue is stuck, {self._queue.qsize()} events lost")
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"❌ DB event writer did not stop in {timeout}s, queue depth {self._queue.qsize()}")
+        else:
+            logger.info("✍️ DB event writer stopped")
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """Счетчики записи: размеры пачек, время записи и задержка событий"""
+        with self._lock:
+            stats = dict(self._stats)
+        flushes = stats['flushes']
+        written = stats['written']
+        flush_time_total = stats.pop('flush_time_total')
+        latency_total = stats.pop('latency_total')
+        stats.update({
+            'depth': self._queue.qsize(),
+            'capacity': self.maxsize,
+            'avg_flush_size': round(written / flushes, 1) if flushes else 0.0,
+            'flush_ms_avg': round(flush_time_total / flushes * 1000, 2) if flushes else 0.0,
+            'flush_ms_max': round(stats.pop('flush_time_max') * 1000, 2),
+            'latency_ms_avg': round(latency_total / written * 1000, 2) if written else 0.0,
+            'latency_ms_max': round(stats.pop('latency_max') * 1000, 2),
+        })
+        return stats
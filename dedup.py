@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+from collections import deque
+
+import database
+from config import UPDATE_DEDUP_WINDOW
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = 'last_update_id'
+# Через неделю без обновлений Telegram начинает нумерацию update_id с случайного числа
+STATE_MAX_AGE_DAYS = 7
+
+
+class UpdateDeduplicator:
+    """Отсев повторно доставленных обновлений по update_id.
+
+    Последние window идентификаторов хранятся в кольцевом буфере и множестве.
+    Наибольший update_id, обработка которого прошла или поставлена в очередь
+    (confirm), сохраняется в bot_state; после перезапуска обновления из окна
+    ниже этой отметки считаются уже обработанными. Отметка не поднимается выше
+    обновлений, которые не удалось принять (forget): Telegram доставит их снова. Окно
+    живет в памяти процесса, поэтому при нескольких воркерах gunicorn повтор,
+    попавший в другой воркер, отсеивается только после его перезапуска.
+    """
+
+    def __init__(self, window=UPDATE_DEDUP_WINDOW):
+        self.window = max(int(window), 1)
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._ring = deque()
+        self._seen = set()
+        self._floor = None
+        self._max_seen = 0
+        # Подтвержденный максимум, сохраненная отметка и id, которые Telegram доставит повторно
+        self._max_confirmed = 0
+        self._persisted = 0
+        self._failed = set()
+        self._stats = {'checked': 0, 'duplicates': 0, 'forgotten': 0}
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def _load_floor(self):
+        try:
+            return database.get_state(STATE_KEY, max_age_days=STATE_MAX_AGE_DAYS) or 0
+        except Exception as e:
+            logger.error(f"❌ Failed to load last update_id: {e}")
+            return 0
+
+    def check(self, update_id):
+        """True, если обновление новое (и запоминает его); False для повтора"""
+        if not isinstance(update_id, int):
+            return True
+        if self._floor is None:
+            floor = self._load_floor()
+            with self._lock:
+                if self._floor is None:
+                    self._floor = floor
+                    self._max_seen = max(self._max_seen, floor)
+                    self._persisted = max(self._persisted, floor)
+
+        with self._lock:
+            self._stats['checked'] += 1
+            # Повторы приходят рядом с отметкой; сильно меньший id - новая нумерация Telegram
+            if update_id in self._seen or self._floor - self.window < update_id <= self._floor:
+                self._stats['duplicates'] += 1
+                return False
+            if len(self._ring) >= self.window:
+                self._seen.discard(self._ring.popleft())
+            self._ring.append(update_id)
+            self._seen.add(update_id)
+            self._max_seen = max(self._max_seen, update_id)
+        return True
+
+    def confirm(self, update_id):
+        """Обновление обработано или поставлено в очередь: сохраняет отметку для перезапуска"""
+        if not isinstance(update_id, int):
+            return
+        with self._lock:
+            self._failed.discard(update_id)
+            self._max_confirmed = max(self._max_confirmed, update_id)
+            if self._failed:
+                # Сбойные id за пределами окна уже не защищаются, отметку они не держат
+                self._failed = {failed for failed in self._failed if failed > self._max_confirmed - self.window}
+            mark = min(self._max_confirmed, min(self._failed) - 1) if self._failed else self._max_confirmed
+            if mark <= self._persisted:
+                return
+            self._persisted = mark
+        database.save_state_max(STATE_KEY, mark)
+
+    def forget(self, update_id):
+        """Отменяет check(): обработка не удалась, и повторную доставку нужно принять"""
+        if not isinstance(update_id, int):
+            return
+        with self._lock:
+            if update_id in self._seen:
+                self._seen.discard(update_id)
+                self._ring.remove(update_id)
+                self._stats['forgotten'] += 1
+            self._failed.add(update_id)
+            rollback = update_id <= self._persisted
+            if rollback:
+                # Отметку уже подняло более позднее обновление: опускаем ниже этого
+                self._persisted = update_id - 1
+        if rollback:
+            database.save_state_min(STATE_KEY, update_id - 1)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'window': self.window,
+                'tracked': len(self._seen),
+                'last_update_id': self._max_seen,
+                'persisted': self._persisted,
+                'pending_redelivery': len(self._failed),
+                'restored_from': self._floor,
+            })
+        return stats
+
+
+updates = UpdateDeduplicator()
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+HANDLER_SECONDS = metrics.Histogram(
+    'bot_handler_seconds', 'Update handler latency by router and route key.', ('router', 'route')
+)
+
+
+class Route:
+    """Маршрут: обработчик, флаг админ-доступа и счетчик вызовов"""
+
+    __slots__ = ('key', 'handler', 'is_prefix', 'admin_only', 'denied', 'hits')
+
+    def __init__(self, key, handler, is_prefix=False, admin_only=False, denied=None):
+        self.key = key
+        self.handler = handler
+        self.is_prefix = is_prefix
+        self.admin_only = admin_only
+        self.denied = denied
+        self.hits = 0
+
+
+class Router:
+    """Таблица маршрутов callback_data/команд.
+
+    Точные ключи ищутся в dict, префиксы - в префиксном дереве, поэтому
+    поиск не зависит от количества экранов. Для префиксного маршрута
+    остаток ключа передается обработчику последним аргументом.
+    """
+
+    def __init__(self, name, is_admin=None, fallback=None, denied=None):
+        self.name = name
+        self.is_admin = is_admin
+        self.fallback = fallback
+        self.denied = denied
+        self._exact = {}
+        self._prefixes = {}
+        self._trie = None
+        self._lock = threading.Lock()
+
+    def exact(self, key, admin=False, denied=None):
+        """Декоратор: маршрут для точного значения ключа"""
+        def decorator(handler):
+            self._add(Route(key, handler, False, admin, denied), self._exact)
+            return handler
+        return decorator
+
+    def prefix(self, prefix, admin=False, denied=None):
+        """Декоратор: маршрут для всех ключей, начинающихся с prefix"""
+        def decorator(handler):
+            self._add(Route(prefix, handler, True, admin, denied), self._prefixes)
+            return handler
+        return decorator
+
+    def _add(self, route, table):
+        if route.key in table:
+            raise ValueError(f"Route {route.key!r} is already registered in {self.name}")
+        table[route.key] = route
+        self._trie = None
+
+    def compile(self):
+        """Строит префиксное дерево; вызывается при первом поиске после регистрации"""
+        trie = {}
+        for prefix, route in self._prefixes.items():
+            node = trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            # Пустая строка не бывает символом ключа, поэтому служит меткой конца префикса
+            node[''] = route
+        self._trie = trie
+        return self
+
+    def resolve(self, key):
+        """Возвращает (route, arg) или (None, None)"""
+        if not key:
+            return None, None
+        route = self._exact.get(key)
+        if route is not None:
+            return route, None
+
+        trie = self._trie
+        if trie is None:
+            trie = self.compile()._trie
+
+        node = trie
+        match = None
+        for index, char in enumerate(key):
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get('')
+            if route is not None:
+                match = (route, key[index + 1:])
+        return match or (None, None)
+
+    def dispatch(self, key, user_id, *args):
+        """Вызывает обработчик маршрута с проверкой прав администратора"""
+        route, arg = self.resolve(key)
+        label = 'unmatched' if route is None else route.key + ('*' if route.is_prefix else '')
+        started = time.perf_counter()
+        try:
+            with tracing.span(f'{self.name}.{label}'):
+                return self._call(route, arg, user_id, args)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, (self.name, label))
+
+    def _call(self, route, arg, user_id, args):
+        if route is None:
+            return self.fallback(*args) if self.fallback else None
+
+        with self._lock:
+            route.hits += 1
+
+        if route.admin_only:
+            with tracing.span('admin_check'):
+                allowed = bool(self.is_admin and self.is_admin(user_id))
+            if not allowed:
+                denied = route.denied or self.denied or self.fallback
+                return denied(*args) if denied else None
+
+        if route.is_prefix:
+            return route.handler(*args, arg)
+        return route.handler(*args)
+
+    def hot_routes(self, limit=10):
+        """Самые часто вызываемые маршруты"""
+        routes = list(self._exact.values()) + list(self._prefixes.values())
+        routes.sort(key=lambda route: route.hits, reverse=True)
+        return [
+            {'route': route.key + ('*' if route.is_prefix else ''), 'hits': route.hits}
+            for route in routes[:limit] if route.hits
+        ]
+
+
+def parse_command(text):
+    """'/start@bot arg' -> 'start'; None, если текст не команда"""
+    if not text or not text.startswith('/'):
+        return None
+    return text.split(maxsplit=1)[0][1:].split('@', 1)[0]
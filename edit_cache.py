@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import metrics
+from config import EDIT_CACHE_SIZE
+
+# Так Telegram отвечает на editMessageText, не меняющий сообщение
+NOT_MODIFIED = 'message is not modified'
+
+EDITS_TOTAL = metrics.Counter(
+    'bot_edit_cache_total',
+    'editMessageText checks: hit - identical edit skipped, miss - sent, not_modified - rejected by Telegram.',
+    ('result',)
+)
+
+
+def is_not_modified(description):
+    """Отказ Telegram из-за редактирования без изменений"""
+    return bool(description) and NOT_MODIFIED in description
+
+
+class EditCache:
+    """Что показано в сообщениях: одинаковое повторное редактирование не отправляется.
+
+    Для последних maxsize сообщений (chat_id, message_id) хранится хэш текста,
+    клавиатуры и parse_mode последнего редактирования. Повторное нажатие той же
+    кнопки дает такой же экран, и Telegram отклонил бы его ("message is not
+    modified"), поэтому вызов пропускается. Кэш живет в памяти процесса: если
+    сообщения одного чата редактируют несколько воркеров gunicorn, воркер не
+    знает об изменениях соседа, и кэш нужно выключить (EDIT_CACHE_SIZE=0).
+    """
+
+    def __init__(self, maxsize=EDIT_CACHE_SIZE):
+        self.maxsize = max(int(maxsize), 0)
+        self._lock = threading.Lock()
+        self._rendered = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(text, markup, parse_mode):
+        if markup and not isinstance(markup, str):
+            markup = json.dumps(markup, ensure_ascii=False)
+        return hash((text, markup or None, parse_mode))
+
+    def check(self, chat_id, message_id, text, markup=None, parse_mode=None):
+        """True, если в сообщении уже этот экран; иначе запоминает его и возвращает False"""
+        if not self.maxsize:
+            return False
+        key = (chat_id, message_id)
+        digest = self._digest(text, markup, parse_mode)
+        with self._lock:
+            if self._rendered.get(key) == digest:
+                self._rendered.move_to_end(key)
+                self._stats['hits'] += 1
+                hit = True
+            else:
+                self._rendered[key] = digest
+                self._rendered.move_to_end(key)
+                if len(self._rendered) > self.maxsize:
+                    self._rendered.popitem(last=False)
+                self._stats['misses'] += 1
+                hit = False
+        EDITS_TOTAL.inc(('hit' if hit else 'miss',))
+        return hit
+
+    def forget(self, chat_id, message_id):
+        """Отменяет check(): редактирование не удалось, и содержимое сообщения неизвестно"""
+        with self._lock:
+            self._rendered.pop((chat_id, message_id), None)
+
+    def not_modified(self):
+        """Учет отказа "message is not modified", который кэш не предотвратил"""
+        with self._lock:
+            self._stats['not_modified'] += 1
+        EDITS_TOTAL.inc(('not_modified',))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._rendered)
+        checked = stats['hits'] + stats['misses']
+        stats.update({
+            'capacity': self.maxsize,
+            'hit_rate': round(stats['hits'] / checked, 4) if checked else 0.0,
+            # Каждое попадание - не отправленный editMessageText
+            'saved_calls': stats['hits'],
+        })
+        return stats
+
+
+edits = EditCache()
@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import (
+    BOT_TOKEN,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_FILE,
+    LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATE,
+)
+
+# Частые события (каждое обновление, каждая отправка) пишутся выборочно:
+# logger.info(..., extra=CHATTY)
+CHATTY = {'chatty': True}
+
+# Идентификатор обновления, которое сейчас обрабатывает поток
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+_TOKEN = re.compile(r'\d{6,}:[A-Za-z0-9_-]{30,}')
+_PII_FIELDS = re.compile(
+    r'''(['"](?:first_name|last_name|username|phone_number|contact)['"]\s*:\s*)(['"])(?:\\.|(?!\2).)*\2'''
+)
+_PHONE = re.compile(
+    r'\+\d{1,3}[\s\-()]*\d{3}[\s\-()]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}'
+    r'|\b8[\s\-(]*9\d{2}[\s\-)]*\d{3}[\s\-]*\d{2}[\s\-]*\d{2}\b'
+)
+
+_lock = threading.Lock()
+_handler = None
+_listener = None
+_stats = {'dropped': 0, 'sampled_out': 0}
+
+
+def redact(text):
+    """Убирает из строки токен бота, имена, username и телефоны"""
+    if BOT_TOKEN and BOT_TOKEN in text:
+        text = text.replace(BOT_TOKEN, '<token>')
+    text = _TOKEN.sub('<token>', text)
+    text = _PII_FIELDS.sub(r'\1\2***\2', text)
+    return _PHONE.sub('<phone>', text)
+
+
+@contextmanager
+def correlation(update_id):
+    """Помечает записи лога, сделанные внутри блока, идентификатором обновления"""
+    token = correlation_id.set(f'u{update_id}' if update_id is not None else None)
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+class _SamplingQueueHandler(QueueHandler):
+    """Кладет записи в очередь без форматирования: строки собирает поток слушателя"""
+
+    def __init__(self, log_queue, sample_rate):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if getattr(record, 'chatty', False) and self.sample_rate < 1 and not _sampled(self.sample_rate):
+            _count('sampled_out')
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        record.cid = correlation_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count('dropped')
+
+    def close(self):
+        # logging.shutdown при выходе закрывает обработчики: дописываем очередь
+        _stop_listener()
+        super().close()
+
+
+def _sampled(rate):
+    # Все записи одного обновления попадают в выборку вместе
+    cid = correlation_id.get()
+    if cid is None:
+        return random.random() < rate
+    return hash(cid) % 1000 < rate * 1000
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+            'thread': record.threadName,
+        }
+        cid = getattr(record, 'cid', None)
+        if cid:
+            entry['cid'] = cid
+        if record.exc_info:
+            entry['exc'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _build_handlers():
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = RedactingFormatter('%(asctime)s %(levelname)s %(name)s [%(cid)s] %(message)s')
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if LOG_FILE:
+        handlers.append(RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def setup_logging():
+    """Настраивает корневой логгер: очередь в вызывающем потоке, форматирование и запись - в потоке слушателя"""
+    global _handler, _listener
+    with _lock:
+        if _handler is not None:
+            return
+        # Обработчики вывода создаются раньше очереди: logging.shutdown закрывает
+        # их в обратном порядке, и очередь успевает дописаться
+        handlers = _build_handlers()
+        _handler = _SamplingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), LOG_SAMPLE_RATE)
+        _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    # Строки urllib3/httpx с URL запросов содержат токен и дублируют наши логи
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+def _stop_listener():
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def _restart_after_fork():
+    global _lock, _listener
+    # Поток слушателя не переживает fork: новая очередь и новый слушатель
+    _lock = threading.Lock()
+    if _handler is None:
+        return
+    handlers = _listener.handlers if _listener else _build_handlers()
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats['depth'] = _handler.queue.qsize() if _handler else 0
+    stats['sample_rate'] = LOG_SAMPLE_RATE
+    return stats
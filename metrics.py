@@ -0,0 +1,225 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+# Реестр метрик в формате Prometheus. Каждый поток пишет в свой шард
+# (словарь в threading.local) без блокировок; /metrics суммирует шарды.
+# Замок берется только при появлении нового потока и при чтении.
+
+_local = threading.local()
+_started_at = time.time()
+_shards = []
+_shards_lock = threading.Lock()
+_metrics = {}
+
+# Границы корзин по умолчанию (секунды): от 0.5 мс до 10 с
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _new_shard():
+    shard = {}
+    _local.shard = shard
+    with _shards_lock:
+        _shards.append(shard)
+    return shard
+
+
+def _series(name):
+    try:
+        shard = _local.shard
+    except AttributeError:
+        shard = _new_shard()
+    series = shard.get(name)
+    if series is None:
+        series = shard[name] = {}
+    return series
+
+
+def _reset_after_fork():
+    global _local, _shards, _shards_lock, _started_at
+    # Счетчики родителя не относятся к дочернему процессу
+    _local = threading.local()
+    _shards = []
+    _shards_lock = threading.Lock()
+    _started_at = time.time()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _register(metric):
+    if metric.name in _metrics:
+        raise ValueError(f"Metric {metric.name} is already registered")
+    _metrics[metric.name] = metric
+    return metric
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _register(self)
+
+    def inc(self, labels=(), amount=1):
+        series = _series(self.name)
+        series[labels] = series.get(labels, 0) + amount
+
+    def _collect(self, shards):
+        totals = {}
+        for shard in shards:
+            for labels, value in list(shard.get(self.name, {}).items()):
+                totals[labels] = totals.get(labels, 0) + value
+        for labels, value in sorted(totals.items()):
+            yield self.name, self.labelnames, labels, value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        _register(self)
+
+    def observe(self, value, labels=()):
+        series = _series(self.name)
+        values = series.get(labels)
+        if values is None:
+            # Счетчики по корзинам (последняя - +Inf), затем сумма и количество
+            values = series[labels] = [0] * (len(self.buckets) + 3)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def time(self, labels=()):
+        return _Timer(self, labels)
+
+    def _collect(self, shards):
+        totals = {}
+        for shard in shards:
+            for labels, values in list(shard.get(self.name, {}).items()):
+                merged = totals.get(labels)
+                if merged is None:
+                    totals[labels] = list(values)
+                else:
+                    for index, value in enumerate(values):
+                        merged[index] += value
+        bucket_labels = self.labelnames + ('le',)
+        for labels, values in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                yield self.name + '_bucket', bucket_labels, labels + (_format_bound(bound),), cumulative
+            yield self.name + '_sum', self.labelnames, labels, values[-2]
+            yield self.name + '_count', self.labelnames, labels, values[-1]
+
+
+class Gauge:
+    """Значение, которое вычисляется при чтении /metrics: callback() -> число или {labels: число}"""
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        _register(self)
+
+    def _collect(self, shards):
+        try:
+            value = self.callback()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for labels, item in sorted(value.items()):
+                yield self.name, self.labelnames, labels if isinstance(labels, tuple) else (labels,), item
+        elif value is not None:
+            yield self.name, self.labelnames, (), value
+
+
+class _Timer:
+    __slots__ = ('metric', 'labels', 'started')
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.started, self.labels)
+
+
+def timed(histogram, label=None):
+    """Декоратор: время вызова функции в histogram с меткой label (по умолчанию имя функции)"""
+    def decorator(func):
+        labels = (label or func.__name__,)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, labels)
+        return wrapper
+    return decorator
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value) if value == value else 'NaN'
+    return str(value)
+
+
+def render():
+    """Все метрики процесса в текстовом формате Prometheus"""
+    with _shards_lock:
+        shards = list(_shards)
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labelnames, labels, value in metric._collect(shards):
+            if labelnames:
+                pairs = ','.join(f'{key}="{_escape(item)}"' for key, item in zip(labelnames, labels))
+                lines.append(f"{name}{{{pairs}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики процесса
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss - пиковое значение (в КБ на Linux), но лучше, чем ничего
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+Gauge('process_resident_memory_bytes', 'Resident memory size in bytes.', _rss_bytes)
+Gauge('process_cpu_seconds_total', 'Total user and system CPU time spent in seconds.', time.process_time, kind='counter')
+Gauge('process_start_time_seconds', 'Start time of the process since unix epoch in seconds.', lambda: _started_at)
+Gauge('process_threads', 'Number of live threads.', threading.active_count)
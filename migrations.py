@@ -0,0 +1,241 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы хранится в PRAGMA user_version. Миграции только добавляются
+# в конец списка; уже выпущенные шаги не меняются.
+
+
+def _baseline(conn):
+    """v1: исходная схема (IF NOT EXISTS - базы, созданные старым init_db, уже ее содержат)"""
+    # Таблица пользовательских сессий
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            district TEXT,
+            base TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица запросов на тренировки
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS training_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            district TEXT,
+            base TEXT,
+            child_info TEXT,
+            contact TEXT,
+            status TEXT DEFAULT 'new',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица статистики
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_statistics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action_type TEXT,
+            user_id INTEGER,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица административных действий
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            action TEXT,
+            target_user_id INTEGER,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _indexes(conn):
+    """v2: индексы под фильтры и сортировки рабочих запросов"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bot_statistics_timestamp ON bot_statistics (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bot_statistics_user_action ON bot_statistics (user_id, action_type)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_last_activity ON user_sessions (last_activity)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_training_requests_status_created ON training_requests (status, created_at)')
+
+
+def _stats_rollups(conn):
+    """v3: сводные таблицы статистики, заполняются по накопленной истории"""
+    # Район, к которому относится действие (выбор района или базы).
+    # Проверка нужна для баз, где колонку уже добавил init_db до появления миграций
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(bot_statistics)')]
+    if 'district' not in columns:
+        conn.execute('ALTER TABLE bot_statistics ADD COLUMN district TEXT')
+
+    # last_seen_users - пользователи, чья последняя активность пришлась на этот день
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            actions INTEGER NOT NULL DEFAULT 0,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            last_seen_users INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_actions (
+            action_type TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_districts (
+            district TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    rebuild_stats_rollups(conn)
+
+
+def rebuild_stats_rollups(conn):
+    """Пересчитывает сводные таблицы по всей истории в текущей транзакции conn"""
+    conn.execute('DELETE FROM stats_daily')
+    conn.execute('DELETE FROM stats_actions')
+    conn.execute('DELETE FROM stats_districts')
+    conn.execute('DELETE FROM stats_totals')
+    conn.execute('''
+        INSERT INTO stats_actions (action_type, count)
+        SELECT action_type, COUNT(*) FROM bot_statistics
+        WHERE action_type IS NOT NULL GROUP BY action_type
+    ''')
+    conn.execute('''
+        INSERT INTO stats_districts (district, count)
+        SELECT district, COUNT(*) FROM bot_statistics
+        WHERE district IS NOT NULL GROUP BY district
+    ''')
+    conn.execute('''
+        INSERT INTO stats_daily (day, actions)
+        SELECT date(timestamp), COUNT(*) FROM bot_statistics
+        WHERE timestamp IS NOT NULL GROUP BY date(timestamp)
+    ''')
+    # WHERE обязателен для upsert из SELECT (иначе ON разбирается как часть JOIN)
+    conn.execute('''
+        INSERT INTO stats_daily (day, new_users)
+        SELECT date(created_at), COUNT(*) FROM user_sessions
+        WHERE created_at IS NOT NULL GROUP BY date(created_at)
+        ON CONFLICT(day) DO UPDATE SET new_users = excluded.new_users
+    ''')
+    conn.execute('''
+        INSERT INTO stats_daily (day, last_seen_users)
+        SELECT date(last_activity), COUNT(*) FROM user_sessions
+        WHERE last_activity IS NOT NULL GROUP BY date(last_activity)
+        ON CONFLICT(day) DO UPDATE SET last_seen_users = excluded.last_seen_users
+    ''')
+    conn.execute('''
+        INSERT INTO stats_totals (name, value)
+        SELECT 'users', COUNT(*) FROM user_sessions
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM stats_daily').fetchone()[0]
+
+
+def _broadcasts(conn):
+    """v4: рассылки и прогресс доставки по каждому получателю"""
+    # status: draft -> running -> done | cancelled; owner/lease_until - процесс,
+    # который сейчас отправляет рассылку, и срок его аренды
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            segment TEXT NOT NULL,
+            text TEXT,
+            status TEXT NOT NULL DEFAULT 'draft',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            owner TEXT,
+            lease_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_admin_status ON broadcasts (admin_id, status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _bot_state(conn):
+    """v5: служебные значения бота (например, последний обработанный update_id)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline),
+    (2, 'indexes for hot queries', _indexes),
+    (3, 'statistics rollup tables', _stats_rollups),
+    (4, 'broadcasts and deliveries', _broadcasts),
+    (5, 'bot state', _bot_state),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применяет недостающие миграции; возвращает список примененных версий.
+
+    Все шаги идут в одной транзакции BEGIN IMMEDIATE: параллельно стартующие
+    процессы ждут друг друга, и каждый видит уже обновленную user_version.
+    """
+    if get_version(conn) >= LATEST_VERSION:
+        return []
+
+    started = time.perf_counter()
+    applied = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = get_version(conn)
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f"🗄 Applying migration {number}: {description}")
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            applied.append(number)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if applied:
+        elapsed = (time.perf_counter() - started) * 1000
+        logger.info(f"✅ Schema migrated to version {applied[-1]} in {elapsed:.1f} ms")
+    return applied
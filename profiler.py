@@ -0,0 +1,133 @@
+import os
+import math
+import sys
+import time
+import threading
+from collections import Counter
+
+from config import PROFILE_HZ, PROFILE_MAX_SECONDS
+
+# Выборочный профилировщик: фоновый поток, запущенный /debug/profile, PROFILE_HZ
+# раз в секунду снимает стеки всех остальных потоков процесса (sys._current_frames).
+# Запрос не ждет профиль - иначе синхронный воркер gunicorn не принимал бы вебхуки;
+# результат забирается отдельно (result). Вне профилирования ничего не работает;
+# результат - свернутые стеки для flamegraph.pl / speedscope.
+# Снимается время по часам, а не CPU: ожидание сети и замков видно так же,
+# как работа интерпретатора.
+
+_lock = threading.Lock()
+# Последний профиль, снятый в фоне: состояние, стеки, статистика, ошибка
+_last = {'status': None, 'stacks': None, 'stats': None, 'error': None, 'started': None, 'seconds': None}
+
+
+class ProfileBusy(Exception):
+    """Профилирование уже идет"""
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, labels):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        label = labels.get(code)
+        if label is None:
+            label = labels[code] = _frame_label(code)
+        stack.append(label)
+        frame = frame.f_back
+    stack.reverse()
+    return ';'.join(stack)
+
+
+def sample(seconds, hz=PROFILE_HZ, exclude=()):
+    """Снимает стеки в текущем потоке в течение seconds секунд; возвращает (Counter стеков, статистику)"""
+    if not _lock.acquire(blocking=False):
+        raise ProfileBusy("profile is already running")
+    try:
+        return _sample_locked(seconds, hz, exclude)
+    finally:
+        _lock.release()
+
+
+def _sample_locked(seconds, hz=PROFILE_HZ, exclude=()):
+    seconds = float(seconds)
+    if not math.isfinite(seconds):
+        raise ValueError(f"seconds must be finite, got {seconds}")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    hz = max(int(hz), 1)
+    interval = 1.0 / hz
+    skip = set(exclude) | {threading.get_ident()}
+    labels = {}
+    stacks = Counter()
+    samples = 0
+    busy = 0.0
+    started = time.perf_counter()
+    deadline = started + seconds
+    next_at = started
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if now < next_at:
+            time.sleep(min(next_at, deadline) - now)
+            continue
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in skip:
+                continue
+            stacks[names.get(ident, f'thread-{ident}') + ';' + _collapse(frame, labels)] += 1
+        samples += 1
+        busy += time.perf_counter() - now
+        # Пропущенные такты не догоняем: при перегрузке частота просто падает
+        next_at = max(next_at + interval, time.perf_counter())
+    elapsed = time.perf_counter() - started
+    stats = {
+        'seconds': round(elapsed, 3),
+        'hz': hz,
+        'samples': samples,
+        'overhead': round(busy / elapsed, 4) if elapsed else 0.0,
+    }
+    return stacks, stats
+
+
+def _run_in_background(seconds):
+    try:
+        stacks, stats = _sample_locked(seconds)
+    except Exception as e:
+        _last.update(status='failed', error=str(e))
+    else:
+        _last.update(status='done', stacks=stacks, stats=stats)
+    finally:
+        _lock.release()
+
+
+def start(seconds):
+    """Запускает профилирование в фоновом потоке; ProfileBusy, если оно уже идет"""
+    seconds = float(seconds)
+    if not math.isfinite(seconds):
+        raise ValueError(f"seconds must be finite, got {seconds}")
+    if not _lock.acquire(blocking=False):
+        raise ProfileBusy("profile is already running")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    _last.update(status='running', stacks=None, stats=None, error=None, started=time.time(), seconds=seconds)
+    try:
+        threading.Thread(target=_run_in_background, args=(seconds,), name='profiler', daemon=True).start()
+    except Exception:
+        _lock.release()
+        raise
+    return seconds
+
+
+def result():
+    """Состояние последнего фонового профиля: dict со status (None, running, done, failed)"""
+    last = dict(_last)
+    if last['status'] == 'running':
+        last['remaining'] = round(max(last['started'] + last['seconds'] - time.time(), 0.0), 1)
+    return last
+
+
+def collapsed(stacks):
+    """Свернутые стеки: строка "поток;функция;...;функция количество" на стек"""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
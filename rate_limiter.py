@@ -0,0 +1,219 @@
+import time
+import threading
+from collections import OrderedDict, deque
+
+# Методы, которые Telegram ограничивает по частоте: отправка и изменение сообщений.
+# Остальные (answerCallbackQuery, getWebhookInfo, setWebhook...) идут без очереди
+LIMITED_PREFIXES = ('send', 'edit', 'forward', 'copy')
+
+
+def is_limited(method):
+    return method.startswith(LIMITED_PREFIXES)
+
+
+def retry_after(response):
+    """Сколько секунд просит подождать ответ 429 (parameters.retry_after)"""
+    try:
+        return float(response.json().get('parameters', {}).get('retry_after', 1))
+    except (ValueError, AttributeError):
+        return 1.0
+
+
+def is_group(chat_id):
+    """Группы и каналы: отрицательный id или @username"""
+    if isinstance(chat_id, int):
+        return chat_id < 0
+    return isinstance(chat_id, str) and (chat_id.startswith('@') or chat_id.startswith('-'))
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас; pause() - ожидание по retry_after"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    # Методы с подчеркиванием вызываются под замком владельца (самого ведра или OutboundLimiter)
+
+    def _refill(self, now):
+        # Во время паузы токены не копятся
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, now):
+        """Сколько ждать до следующего токена; 0 - токен есть"""
+        self._refill(now)
+        if now < self._paused_until:
+            return self._paused_until - now + max(1 - self._tokens, 0) / self.rate
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _take(self):
+        self._tokens -= 1
+
+    def _pause(self, now, seconds):
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self.throttled += 1
+
+    def _level(self, now):
+        self._refill(now)
+        return self._tokens
+
+    def acquire(self):
+        """Блокирует поток до получения токена; возвращает время ожидания в секундах"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = self._wait_time(time.monotonic())
+                if wait <= 0:
+                    self._take()
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def try_acquire(self):
+        with self._lock:
+            if self._wait_time(time.monotonic()) > 0:
+                return False
+            self._take()
+            return True
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов на seconds секунд (ответ 429 с retry_after)"""
+        with self._lock:
+            self._pause(time.monotonic(), seconds)
+
+    def level(self):
+        with self._lock:
+            return round(self._level(time.monotonic()), 2)
+
+
+class OutboundLimiter:
+    """Очередь исходящих вызовов Bot API по лимитам Telegram.
+
+    Вызов ограниченного метода ждет токен в общем ведре бота и в ведре чата:
+    личного (chat_rate) или группового (group_rate). Ведра чатов хранятся
+    в LRU на max_chats записей - давно не использованное ведро уже полное,
+    и его можно создать заново.
+    """
+
+    def __init__(self, global_rate, chat_rate, chat_burst, group_rate, group_burst, max_chats=10000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_chats = max_chats
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(self.global_rate)
+        self._chats = OrderedDict()
+        self._events = deque(maxlen=20)
+        self._stats = {'acquired': 0, 'waited': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0, 'throttled': 0}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if is_group(chat_id):
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _buckets(self, chat_id):
+        if chat_id is None:
+            return (self._global,)
+        return (self._global, self._chat_bucket(chat_id))
+
+    def acquire(self, method, chat_id=None):
+        """Ждет, пока вызов method в chat_id укладывается в лимиты; возвращает ожидание в секундах"""
+        if not is_limited(method):
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                buckets = self._buckets(chat_id)
+                wait = max(bucket._wait_time(now) for bucket in buckets)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket._take()
+                    self._record_wait(waited)
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def try_acquire(self, method, chat_id=None):
+        """Как acquire, но без ожидания: False, если лимит сейчас исчерпан"""
+        if not is_limited(method):
+            return True
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._buckets(chat_id)
+            if any(bucket._wait_time(now) > 0 for bucket in buckets):
+                return False
+            for bucket in buckets:
+                bucket._take()
+            self._record_wait(0.0)
+            return True
+
+    def _record_wait(self, waited):
+        stats = self._stats
+        stats['acquired'] += 1
+        if waited > 0:
+            waited_ms = waited * 1000
+            stats['waited'] += 1
+            stats['wait_ms_total'] += waited_ms
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], waited_ms)
+
+    def throttle(self, method, chat_id, retry_after):
+        """Ответ 429: останавливает ведро группы или, для личных чатов, общее ведро бота.
+
+        Групповой лимит (20 сообщений в минуту) касается только этой группы;
+        в личных чатах 429 почти всегда означает общий лимит бота.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if chat_id is not None and is_group(chat_id):
+                self._chat_bucket(chat_id)._pause(now, retry_after)
+            else:
+                self._global._pause(now, retry_after)
+            self._stats['throttled'] += 1
+            self._events.append({
+                'at': round(time.time(), 3),
+                'method': method,
+                'chat_id': chat_id,
+                'retry_after': retry_after,
+            })
+
+    def get_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            stats = dict(self._stats)
+            stats['wait_ms_total'] = round(stats['wait_ms_total'], 1)
+            stats['wait_ms_max'] = round(stats['wait_ms_max'], 1)
+            stats['global_level'] = round(self._global._level(now), 2)
+            stats['global_capacity'] = self._global.capacity
+            stats['chats_tracked'] = len(self._chats)
+            # Самые опустошенные ведра чатов: полные ничем не отличаются от новых
+            levels = [(bucket._level(now), chat_id) for chat_id, bucket in self._chats.items()
+                      if bucket._level(now) < bucket.capacity]
+            stats['chat_levels'] = {str(chat_id): round(level, 2) for level, chat_id in sorted(levels)[:20]}
+            stats['throttle_events'] = list(self._events)
+        return stats
@@ -0,0 +1,197 @@
+import os
+import hmac
+import gzip
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import secrets
+import threading
+
+from config import WEBHOOK_RECORD_PATH, WEBHOOK_RECORD_SALT, WEBHOOK_RECORD_MAX_MB
+
+logger = logging.getLogger(__name__)
+
+# Запись входящих обновлений для нагрузочных тестов (tools/replay.py).
+# Включается WEBHOOK_RECORD_PATH; {pid} в пути заменяется номером процесса,
+# чтобы воркеры gunicorn писали в разные файлы. Строка записи:
+#   {"t": время приема (unix), "update": обезличенное обновление}
+# Пишет фоновый поток пачками; каждая пачка - отдельный gzip-член, поэтому
+# файл читается целиком даже после аварийного завершения процесса.
+
+ENABLED = bool(WEBHOOK_RECORD_PATH)
+
+# Поля с личными данными: удаляются
+_DROP = frozenset((
+    'last_name', 'username', 'phone_number', 'contact', 'location', 'venue',
+    'bio', 'email', 'vcard', 'photo', 'title', 'invite_link',
+))
+# Идентификаторы пользователей и чатов: заменяются стабильными псевдонимами
+_IDS = frozenset(('id', 'user_id', 'chat_id'))
+# Свободный текст пользователя: заменяется звездочками той же длины
+_TEXT = frozenset(('text', 'caption'))
+
+_FLUSH_INTERVAL = 1.0
+_BATCH_SIZE = 500
+
+if ENABLED and not WEBHOOK_RECORD_SALT:
+    logger.warning("⚠️ WEBHOOK_RECORD_SALT is not set: user ids are remapped differently after each restart")
+_salt = (WEBHOOK_RECORD_SALT or secrets.token_hex(16)).encode()
+
+
+def pseudonym(value):
+    """Стабильный псевдоним id: тот же знак, 12 знаков, без обратного преобразования"""
+    digest = hmac.new(_salt, str(value).encode(), hashlib.sha256).digest()
+    alias = int.from_bytes(digest[:8], 'big') % 10 ** 12
+    return -alias if value < 0 else alias
+
+
+def anonymize(value, key=None):
+    """Копия обновления без имен, телефонов и свободного текста, с псевдонимами id"""
+    if isinstance(value, dict):
+        result = {}
+        for field, item in value.items():
+            if field in _DROP:
+                continue
+            if field == 'first_name':
+                result[field] = 'User'
+            elif field in _IDS and isinstance(item, int) and not isinstance(item, bool):
+                result[field] = pseudonym(item)
+            elif field in _TEXT and isinstance(item, str):
+                # Команды сохраняем: от них зависит маршрут обработки
+                result[field] = item if item.startswith('/') else '*' * len(item)
+            else:
+                result[field] = anonymize(item, field)
+        return result
+    if isinstance(value, list):
+        return [anonymize(item, key) for item in value]
+    return value
+
+
+class Recorder:
+    """Фоновая запись обновлений в сжатый JSONL"""
+
+    def __init__(self, path_template, max_bytes, maxsize=10000):
+        self.path_template = path_template
+        self.max_bytes = max_bytes
+        self.maxsize = maxsize
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # После fork у дочернего процесса свой файл и свой поток записи
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._thread = None
+        self.path = None
+        self._stats = {'recorded': 0, 'dropped': 0, 'bytes': 0, 'stopped': False}
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.path = self.path_template.format(pid=os.getpid())
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='webhook-recorder', daemon=True)
+            self._thread.start()
+        logger.info(f"⏺ Recording webhook updates to {self.path}")
+
+    def record(self, update):
+        if self._stats['stopped']:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), update))
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + _FLUSH_INTERVAL
+            while len(batch) < _BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        # Обезличивание - здесь, а не в запросе вебхука
+        lines = ''.join(
+            json.dumps({'t': round(received, 3), 'update': anonymize(update)}, ensure_ascii=False) + '\n'
+            for received, update in batch
+        ).encode()
+        try:
+            with gzip.open(self.path, 'ab') as capture:
+                capture.write(lines)
+            size = os.path.getsize(self.path)
+        except OSError as e:
+            logger.error(f"❌ Webhook recording failed: {e}")
+            return
+        with self._lock:
+            self._stats['recorded'] += len(batch)
+            self._stats['bytes'] = size
+            if size >= self.max_bytes and not self._stats['stopped']:
+                self._stats['stopped'] = True
+                logger.warning(f"⏹ Webhook recording stopped: {self.path} reached {size} bytes")
+
+    def flush(self, timeout=5.0):
+        """Дописывает очередь (при выходе процесса)"""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self._stats, 'path': self.path, 'depth': self._queue.qsize()}
+
+
+recorder = Recorder(WEBHOOK_RECORD_PATH, WEBHOOK_RECORD_MAX_MB * 1024 * 1024)
+atexit.register(recorder.flush)
+
+
+def record(update):
+    """Ставит обновление в очередь записи; без WEBHOOK_RECORD_PATH ничего не делает"""
+    if ENABLED and update is not None:
+        recorder.record(update)
+
+
+def read(path, renumber=False):
+    """(время приема, обновление) из записи, включая файлы с оборванным последним членом gzip.
+
+    renumber=True заменяет update_id на 1, 2, 3...: при повторном проигрывании
+    записи их иначе отсеет защита от повторной доставки.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    number = 0
+    with opener(path, 'rt', encoding='utf-8') as capture:
+        try:
+            for line in capture:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                # Строка записи или просто обновление в JSON
+                received, update = (entry['t'], entry['update']) if 'update' in entry else (None, entry)
+                if renumber:
+                    number += 1
+                    update['update_id'] = number
+                yield received, update
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            # Процесс завершился посреди записи пачки
+            return
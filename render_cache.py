@@ -0,0 +1,277 @@
+import json
+import logging
+import threading
+
+import content as content_store
+
+logger = logging.getLogger(__name__)
+
+
+class Screen:
+    """Готовый экран: текст, клавиатура и заранее сериализованное тело запроса"""
+
+    __slots__ = ('text', 'reply_markup', 'markup_json', 'parse_mode', '_text_json', '_suffix')
+
+    def __init__(self, text, reply_markup=None, parse_mode='HTML'):
+        self.text = text
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+        self.markup_json = json.dumps(reply_markup, ensure_ascii=False) if reply_markup else None
+        self._text_json = _dumps_text(text)
+        suffix = f',"parse_mode":"{parse_mode}"'
+        if self.markup_json:
+            suffix += f',"reply_markup":{self.markup_json}'
+        self._suffix = (suffix + '}').encode('utf-8')
+
+    def payload(self, chat_id, message_id=None, text=None):
+        """JSON-тело sendMessage/editMessageText; подставляются только chat_id и message_id"""
+        if message_id is None:
+            head = b'{"chat_id":%d,"text":' % chat_id
+        else:
+            head = b'{"chat_id":%d,"message_id":%d,"text":' % (chat_id, message_id)
+        text_json = self._text_json if text is None else _dumps_text(text)
+        return head + text_json + self._suffix
+
+
+def _dumps_text(text):
+    return json.dumps(text, ensure_ascii=False).encode('utf-8')
+
+
+# Функции форматирования
+def format_district_info(district_info):
+    return f"""
+<b>{district_info['name']}</b>
+
+📍 <b>Адрес:</b> {district_info['address']}
+
+📅 <b>Расписание:</b>
+{district_info['schedule']}
+
+💬 <b>Чат для родителей:</b> {district_info['chat_link']}
+
+💰 <b>Стоимость:</b> {district_info['price']}
+
+👕 <b>С собой на тренировку:</b> сменные кроссовки для зала, белые носки, спортивная форма, бутылочка с водой
+
+⚠️ <b>Важно:</b> пока не нужно платить и приносить документы! Все в процессе!
+    """
+
+def format_base_info(district_info, base_info):
+    return f"""
+<b>{district_info['name']} - {base_info['name']}</b>
+
+📍 <b>Адрес:</b> {base_info['address']}
+
+📅 <b>Расписание:</b>
+{base_info['schedule']}
+
+💬 <b>Чат для родителей:</b> {district_info['chat_link']}
+
+💰 <b>Стоимость:</b> {district_info['price']}
+
+👕 <b>С собой на тренировку:</b> сменные кроссовки для зала, белые носки, спортивная форма, бутылочка с водой
+
+⚠️ <b>Важно:</b> пока не нужно платить и приносить документы! Все в процессе!
+    """
+
+def format_payment_info(org_info=None):
+    org_info = org_info or content_store.get().org
+    return f"""
+💳 <b>Реквизиты для оплаты</b>
+
+🏛 <b>Полное наименование:</b>
+{org_info['full_name']}
+
+📋 <b>Сокращенное:</b>
+{org_info['short_name']}
+
+📊 <b>Реквизиты:</b>
+ИНН: {org_info['inn']}
+КПП: {org_info['kpp']}
+ОГРН: {org_info['ogrn']}
+Расчетный счет: {org_info['account']}
+Банк: {org_info['bank']}
+БИК: {org_info['bik']}
+Корр. счет: {org_info['correspondent_account']}
+
+💸 <b>Сумма:</b> 2000 рублей в месяц
+📝 <b>Назначение платежа:</b> "Добровольное пожертвование от [ФИО ребенка]"
+
+⚠️ <b>Важно:</b>
+• Оплата производится после пробных тренировок
+• В назначении платежа укажите ФИО ребенка
+• Сохраните чек об оплате
+• Квитанцию можно показать тренеру или отправить в чат группы
+    """
+
+
+# Клавиатуры
+def button(text, callback_data):
+    return {'text': text, 'callback_data': callback_data}
+
+def keyboard(*rows):
+    return {'inline_keyboard': [list(row) for row in rows]}
+
+def main_menu_keyboard(is_admin=False):
+    rows = [
+        [button('🏃 Выбрать район', 'main_districts')],
+        [button('💳 Реквизиты оплаты', 'main_payment')],
+        [button('📋 Список документов', 'main_documents')],
+        [button('❓ Частые вопросы', 'main_faq')],
+    ]
+    if is_admin:
+        rows.append([button('🛠 Админ-панель', 'admin_back')])
+    return keyboard(*rows)
+
+def districts_keyboard(districts):
+    rows = [[button(info['name'], f'district_{key}')] for key, info in districts.items()]
+    rows.append([button('◀️ Назад', 'back_to_main')])
+    return keyboard(*rows)
+
+def back_to_main_keyboard():
+    return keyboard([button('🏠 В главное меню', 'back_to_main')])
+
+def back_to_admin_keyboard():
+    return keyboard([button('◀️ Назад в админку', 'admin_back')])
+
+def admin_menu_keyboard():
+    return keyboard(
+        [button('📊 Статистика', 'admin_stats')],
+        [button('📢 Рассылка', 'admin_broadcast')],
+        [button('👥 Поиск пользователя', 'admin_search')],
+        [button('🏠 Пользовательское меню', 'back_to_main')],
+    )
+
+def broadcast_menu_keyboard():
+    return keyboard(
+        [button('📢 Всем пользователям', 'admin_broadcast_all')],
+        [button('👥 Только пользователям (без админов)', 'admin_broadcast_users')],
+        [button('📈 Последняя рассылка', 'admin_broadcast_status')],
+        [button('◀️ Назад', 'admin_back')],
+    )
+
+def broadcast_progress_keyboard(broadcast_id, running=True):
+    rows = [[button('🔄 Обновить', f'broadcast_refresh_{broadcast_id}')]]
+    if running:
+        rows.append([button('⛔ Остановить', f'broadcast_cancel_{broadcast_id}')])
+    rows.append([button('◀️ Назад в админку', 'admin_back')])
+    return keyboard(*rows)
+
+
+DISTRICTS_TEXT = "🏃 <b>Выберите район:</b>\n\nПосле выбора района вы получите:\n• Адрес и расписание\n• Ссылку на чат родителей\n• Всю необходимую информацию"
+
+ADMIN_PANEL_TEXT = """
+🛠 <b>Панель администратора</b>
+
+👑 Администраторов: {admins_count}
+Выберите действие:
+    """
+
+BROADCAST_MENU_TEXT = "📢 <b>Рассылка сообщений</b>\n\nВыберите тип рассылки:"
+
+BROADCAST_PROMPT_TEXT = "✍️ Отправьте следующим сообщением текст рассылки.\n\nОтмена - /cancel"
+
+
+def _build_common_screens(content):
+    screens = {
+        'districts': Screen(DISTRICTS_TEXT, districts_keyboard(content.districts)),
+        'payment': Screen(format_payment_info(content.org), back_to_main_keyboard()),
+        'documents': Screen(content.documents, back_to_main_keyboard()),
+        'faq': Screen(content.faq, back_to_main_keyboard()),
+        'admin_panel': Screen(
+            ADMIN_PANEL_TEXT.format(admins_count=len(content.admins)), admin_menu_keyboard()
+        ),
+        'broadcast_menu': Screen(BROADCAST_MENU_TEXT, broadcast_menu_keyboard()),
+        'broadcast_prompt': Screen(BROADCAST_PROMPT_TEXT, back_to_admin_keyboard()),
+    }
+
+    for district_key, district_info in content.districts.items():
+        if 'bases' in district_info:
+            # Район с несколькими базами: сначала выбор базы
+            rows = [[button(base_info['name'], f'base_{base_key}')]
+                    for base_key, base_info in district_info['bases'].items()]
+            rows.append([button('◀️ Назад к районам', 'main_districts')])
+            screens[f'district_{district_key}'] = Screen(
+                f"🏢 <b>{district_info['name']}</b>\n\nВыберите удобную вам базу:", keyboard(*rows)
+            )
+            for base_key, base_info in district_info['bases'].items():
+                screens[f'base_{base_key}'] = Screen(
+                    format_base_info(district_info, base_info),
+                    keyboard(
+                        [button('💳 Реквизиты оплаты', 'main_payment')],
+                        [button('📋 Документы', 'main_documents')],
+                        [button('◀️ Выбрать другую базу', f'district_{district_key}')],
+                        [button('🏠 В главное меню', 'back_to_main')],
+                    )
+                )
+        else:
+            screens[f'district_{district_key}'] = Screen(
+                format_district_info(district_info),
+                keyboard(
+                    [button('💳 Реквизиты оплаты', 'main_payment')],
+                    [button('📋 Документы', 'main_documents')],
+                    [button('◀️ Выбрать другой район', 'main_districts')],
+                    [button('🏠 В главное меню', 'back_to_main')],
+                )
+            )
+    return screens
+
+
+_lock = threading.Lock()
+_builders = [_build_common_screens]
+_screens = {}
+_version = None
+
+
+# Источник контента: функция без аргументов, возвращающая объект с полем version
+_source = content_store.get
+
+
+def set_source(source):
+    """Меняет источник контента; кэш перестроится при смене его версии"""
+    global _source
+    _source = source
+    invalidate()
+
+
+def register(builder):
+    """Регистрирует функцию builder(content) -> {key: Screen} с дополнительными экранами"""
+    with _lock:
+        _builders.append(builder)
+    invalidate()
+    return builder
+
+
+def invalidate():
+    global _version
+    with _lock:
+        _version = None
+
+
+def build(content=None):
+    """Строит все экраны заново"""
+    global _screens, _version
+    content = content or _source()
+    screens = {}
+    with _lock:
+        builders = list(_builders)
+    for builder in builders:
+        screens.update(builder(content))
+    with _lock:
+        _screens = screens
+        _version = content.version
+    logger.info(f"🖼 Render cache built: {len(screens)} screens (content {content.version})")
+    return screens
+
+
+def get(key):
+    """Экран по ключу или None; при смене версии контента кэш перестраивается"""
+    content = _source()
+    screens = _screens
+    if content.version != _version:
+        screens = build(content)
+    return screens.get(key)
+
+
+def get_version():
+    return _version
@@ -0,0 +1,261 @@
+import os
+import re
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import (
+    BOT_TOKEN,
+    TELEGRAM_API_BASE,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_DEFAULT_TIMEOUT,
+    TELEGRAM_TIMEOUTS,
+    TELEGRAM_RATE_GLOBAL,
+    TELEGRAM_RATE_CHAT,
+    TELEGRAM_BURST_CHAT,
+    TELEGRAM_RATE_GROUP,
+    TELEGRAM_BURST_GROUP,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_RETRY_BACKOFF,
+    TELEGRAM_MAX_RETRY_AFTER,
+)
+import metrics
+import tracing
+from rate_limiter import OutboundLimiter, retry_after as _retry_after
+
+logger = logging.getLogger(__name__)
+
+API_URL = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}"
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+_stats = {
+    'requests': 0,
+    'connections_opened': 0,
+    'errors': 0,
+    'retries': 0,
+    'throttled': 0,
+}
+
+API_SECONDS = metrics.Histogram(
+    'bot_telegram_api_seconds', 'Bot API call latency by method and HTTP status (one sample per attempt).',
+    ('method', 'status')
+)
+RATE_LIMIT_WAIT_SECONDS = metrics.Histogram(
+    'bot_telegram_rate_limit_wait_seconds', 'Time outbound calls waited for rate limiter tokens.', ('method',)
+)
+
+# Все исходящие вызовы проходят через общие лимиты процесса
+limiter = OutboundLimiter(
+    global_rate=TELEGRAM_RATE_GLOBAL,
+    chat_rate=TELEGRAM_RATE_CHAT,
+    chat_burst=TELEGRAM_BURST_CHAT,
+    group_rate=TELEGRAM_RATE_GROUP,
+    group_burst=TELEGRAM_BURST_GROUP,
+)
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count('connections_opened')
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count('connections_opened')
+        return super()._new_conn()
+
+
+class _CountingAdapter(HTTPAdapter):
+    """Адаптер, который считает новые TCP-соединения в пуле"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+def _create_session():
+    session = requests.Session()
+    adapter = _CountingAdapter(pool_connections=1, pool_maxsize=TELEGRAM_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Возвращает общую keep-alive сессию, пересоздавая ее после fork"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _create_session()
+                _session_pid = pid
+                logger.info(f"🔌 Telegram HTTP session created (pid {pid}, pool {TELEGRAM_POOL_SIZE})")
+    return _session
+
+
+def _reset_after_fork():
+    global _lock, _session, _session_pid
+    # Соединения родителя нельзя использовать в дочернем процессе
+    _lock = threading.Lock()
+    _session = None
+    _session_pid = None
+    for key in _stats:
+        _stats[key] = 0
+    limiter.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_timeout(method):
+    return TELEGRAM_TIMEOUTS.get(method, TELEGRAM_DEFAULT_TIMEOUT)
+
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# chat_id в начале готового JSON-тела из render_cache
+_CHAT_ID_PREFIX = re.compile(rb'^\{"chat_id":\s*(-?\d+)')
+
+
+def _chat_id(payload):
+    """chat_id вызова (для лимитов по чатам) или None"""
+    if isinstance(payload, bytes):
+        match = _CHAT_ID_PREFIX.match(payload)
+        return int(match.group(1)) if match else None
+    if not payload:
+        return None
+    chat_id = payload.get('chat_id')
+    if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+        return int(chat_id)
+    return chat_id
+
+
+def _backoff(attempt):
+    """Задержка перед повтором: экспонента со случайным разбросом, чтобы повторы не шли волной"""
+    return min(TELEGRAM_RETRY_BACKOFF * 2 ** (attempt - 1), 10) * random.uniform(0.5, 1.5)
+
+
+def _can_retry_error(method, error):
+    # Сообщение могло уйти, если запрос отправлен, а ответ не дождались:
+    # повтор отправки дал бы дубль
+    if isinstance(error, requests.ConnectionError):
+        return True
+    return isinstance(error, requests.Timeout) and not method.startswith(('send', 'forward', 'copy'))
+
+
+def _request(method, chat_id, send, retries=TELEGRAM_MAX_RETRIES):
+    """Выполняет send(session) с учетом лимитов, 429 и повторов при временных ошибках.
+
+    Ответ 429 приостанавливает отправку на retry_after секунд и повторяет вызов;
+    сетевые ошибки и 5xx повторяются с нарастающей задержкой, не больше retries раз.
+    """
+    with tracing.span('api.' + method):
+        return _request_with_retries(method, chat_id, send, retries)
+
+
+def _request_with_retries(method, chat_id, send, retries):
+    attempt = 0
+    throttled = 0
+    while True:
+        with tracing.span('rate_limit'):
+            waited = limiter.acquire(method, chat_id)
+        if waited:
+            RATE_LIMIT_WAIT_SECONDS.observe(waited, (method,))
+        session = get_session()
+        _count('requests')
+        started = time.perf_counter()
+        try:
+            response = send(session)
+        except requests.RequestException as e:
+            API_SECONDS.observe(time.perf_counter() - started, (method, 'error'))
+            _count('errors')
+            if attempt >= retries or not _can_retry_error(method, e):
+                raise
+            attempt += 1
+            _count('retries')
+            logger.warning(f"🔁 {method} failed ({e}), retry {attempt}/{retries}")
+            time.sleep(_backoff(attempt))
+            continue
+        API_SECONDS.observe(time.perf_counter() - started, (method, str(response.status_code)))
+
+        if response.status_code == 429:
+            retry_after = _retry_after(response)
+            limiter.throttle(method, chat_id, retry_after)
+            _count('throttled')
+            if retry_after > TELEGRAM_MAX_RETRY_AFTER or throttled >= retries:
+                logger.warning(f"⏳ {method} throttled for {retry_after}s, giving up")
+                return response
+            throttled += 1
+            logger.warning(f"⏳ {method} throttled, retrying in {retry_after}s")
+            time.sleep(retry_after)
+            continue
+
+        if response.status_code >= 500 and attempt < retries:
+            attempt += 1
+            _count('retries')
+            logger.warning(f"🔁 {method} returned {response.status_code}, retry {attempt}/{retries}")
+            time.sleep(_backoff(attempt))
+            continue
+
+        return response
+
+
+def call(method, payload=None, timeout=None):
+    """POST-запрос к методу Bot API через общий пул соединений и лимиты.
+
+    payload - dict либо готовое JSON-тело в bytes (например, из render_cache).
+    """
+    url = f"{API_URL}/{method}"
+    timeout = timeout or get_timeout(method)
+    if isinstance(payload, bytes):
+        send = lambda session: session.post(url, data=payload, headers=_JSON_HEADERS, timeout=timeout)
+    else:
+        send = lambda session: session.post(url, json=payload, timeout=timeout)
+    return _request(method, _chat_id(payload), send)
+
+
+def get(method, params=None, timeout=None):
+    """GET-запрос к методу Bot API через общий пул соединений"""
+    url = f"{API_URL}/{method}"
+    timeout = timeout or get_timeout(method)
+    return _request(method, _chat_id(params), lambda session: session.get(url, params=params, timeout=timeout))
+
+
+def telebot_request_sender(http_method, url, params=None, files=None, timeout=None, proxies=None):
+    """apihelper.CUSTOM_REQUEST_SENDER для pyTelegramBotAPI: его вызовы идут через тот же пул и лимиты"""
+    method = url.rsplit('/', 1)[-1]
+    send = lambda session: session.request(
+        http_method, url, params=params, files=files, timeout=timeout, proxies=proxies
+    )
+    # Файлы вычитываются при первой попытке, повторить такую отправку нельзя
+    return _request(method, _chat_id(params), send, retries=0 if files else TELEGRAM_MAX_RETRIES)
+
+
+def get_stats():
+    """Счетчики запросов и соединений текущего процесса"""
+    with _lock:
+        stats = dict(_stats)
+    stats['connections_reused'] = max(stats['requests'] - stats['errors'] - stats['connections_opened'], 0)
+    stats['pool_size'] = TELEGRAM_POOL_SIZE
+    stats['pid'] = os.getpid()
+    stats['rate_limiter'] = limiter.get_stats()
+    return stats
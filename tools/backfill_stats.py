@@ -0,0 +1,32 @@
+"""Разовый пересчет сводных таблиц статистики по накопленной истории.
+
+Запуск из корня репозитория (путь к базе - из DB_PATH или по умолчанию):
+    python tools/backfill_stats.py
+
+Безопасно запускать на работающем боте: пересчет идет одной транзакцией,
+события, записанные после нее, учитываются инкрементально как обычно.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+def main():
+    started = time.perf_counter()
+    days = database.rebuild_stats_rollups()
+    elapsed = time.perf_counter() - started
+    stats = database.get_statistics()
+    print(f"rebuilt {days} days in {elapsed:.3f} s")
+    print(f"total users: {stats['total_users']}, active (30 days): {stats['active_users']}")
+    for action_type, count in sorted(stats['actions_count'].items(), key=lambda item: -item[1]):
+        print(f"  {action_type}: {count}")
+    for district, count in sorted(stats['districts_count'].items(), key=lambda item: -item[1]):
+        print(f"  district {district}: {count}")
+
+
+if __name__ == '__main__':
+    main()
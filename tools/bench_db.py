@@ -0,0 +1,98 @@
+"""Сравнение скорости записи в SQLite: соединение на каждый вызов против фоновой записи.
+
+Запуск из корня репозитория:
+    python tools/bench_db.py [--ops 2000] [--threads 4]
+
+Одна операция - то, что делает /start: save_user_session + log_user_action.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_operation(db_path, user_id):
+    """Старый путь: новое соединение (и fsync в режиме rollback journal) на каждый хелпер"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        INSERT OR REPLACE INTO user_sessions
+        (user_id, username, first_name, last_name, district, base, last_activity)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (user_id, 'user', 'Имя', 'Фамилия', None, None))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('INSERT INTO bot_statistics (action_type, user_id) VALUES (?, ?)', ('start_command', user_id))
+    conn.commit()
+    conn.close()
+
+
+def pooled_operation(database, user_id):
+    database.save_user_session(user_id, 'user', 'Имя', 'Фамилия')
+    database.log_user_action(user_id, 'start_command')
+
+
+def run(label, operation, ops, threads, finish=None):
+    per_thread = ops // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            operation(offset * per_thread + i)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if finish:
+        finish()
+    elapsed = time.perf_counter() - started
+    total = per_thread * threads
+    print(f"{label:<20} {total:>6} ops  {elapsed:7.3f} s  {total / elapsed:9.1f} ops/s")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        os.environ['DB_PATH'] = os.path.join(tmp, 'pooled.db')
+
+        import database
+        database.init_db()
+
+        # Та же схема в отдельном файле в режиме журнала по умолчанию, как было раньше
+        schema = database.get_db_connection().execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN ('user_sessions', 'bot_statistics')"
+        ).fetchall()
+        conn = sqlite3.connect(legacy_path)
+        for (sql,) in schema:
+            conn.execute(sql)
+        conn.commit()
+        conn.close()
+
+        legacy = run('connect-per-call', lambda i: legacy_operation(legacy_path, i), args.ops, args.threads)
+        # Время включает дозапись очереди: сравниваются полностью записанные события
+        pooled = run(
+            'write-behind + WAL', lambda i: pooled_operation(database, i), args.ops, args.threads,
+            finish=database.event_writer.flush,
+        )
+        print(f"speedup: x{pooled / legacy:.1f}")
+        print(f"writer: {database.event_writer.get_stats()}")
+        database.event_writer.close()
+        database.close_all_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""Микробенчмарки горячих путей: форматирование, клавиатуры, маршрутизация, база данных.
+
+Запуск из корня репозитория:
+    python tools/benchmarks.py [--quick] [--filter db.] [--rounds 5] [--min-time 0.1]
+                               [--save bench.json] [--baseline bench.json] [--threshold 0.25]
+                               [--json]
+
+Бот работает в этом процессе с временной базой и заменой Bot API
+(tools/fake_telegram_api.py). База заполняется перед замерами: 1 000 000
+событий bot_statistics и 100 000 пользователей (--quick: 100 000 и 10 000).
+
+Каждый бенчмарк калибруется так, чтобы раунд шел не меньше --min-time секунд,
+и выполняется --rounds раундов; результат - медиана и минимум времени одной
+операции в микросекундах. Запись в базу идет через фоновую очередь, поэтому
+раунд бенчмарков записи включает дозапись очереди (окно пачки DB_WRITE_FLUSH_MS
+здесь по умолчанию 5 мс).
+
+--save сохраняет результаты в JSON, --baseline сравнивает медианы с сохраненными
+ранее: код выхода 1, если хотя бы одна медиана выросла больше чем на --threshold
+(доля). Сравнивать имеет смысл прогоны на одной машине с одинаковым --quick.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram_api import FakeTelegramAPI  # noqa: E402
+
+_workdir = None
+
+# Первый id засеянных пользователей: не пересекается с администраторами из ADMINS
+FIRST_USER_ID = 10_000_000
+
+ACTIONS = ('start_command', 'district_select', 'base_select', 'payment_info', 'faq_info', 'documents_info')
+
+
+def setup(api):
+    """Окружение бота; вызывать до импорта модулей бота"""
+    global _workdir
+    _workdir = tempfile.TemporaryDirectory()
+    tmp = _workdir.name
+    for key, value in {
+        'BOT_TOKEN': '123456:benchmarks',
+        'TELEGRAM_API_BASE': api.url,
+        'PUBLIC_URL': api.url,
+        'DB_PATH': os.path.join(tmp, 'benchmarks.db'),
+        'BOOTSTRAP_LOCK_PATH': os.path.join(tmp, 'benchmarks.lock'),
+        'LOG_LEVEL': 'WARNING',
+        # Короткое окно пачки: иначе ожидание последней пачки раунда заслоняет саму запись
+        'DB_WRITE_FLUSH_MS': '5',
+    }.items():
+        os.environ.setdefault(key, value)
+
+
+def seed(events, users):
+    """Заполняет базу событиями и пользователями за последние 90 дней и пересчитывает сводки"""
+    import content
+    import database
+    districts = list(content.get().districts)
+    rng = random.Random(1)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def moment():
+        return (now - timedelta(seconds=rng.randrange(90 * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+    conn = database.get_db_connection()
+    with conn:
+        conn.executemany(
+            'INSERT INTO user_sessions (user_id, username, first_name, last_name, district, base, '
+            'created_at, last_activity) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((FIRST_USER_ID + n, f'user{n}', 'Имя', 'Фамилия', None, None, moment(), moment())
+             for n in range(users))
+        )
+        conn.executemany(
+            database._ACTION_INSERT_SQL,
+            ((action, FIRST_USER_ID + rng.randrange(users),
+              rng.choice(districts) if action == 'district_select' else None, moment())
+             for action in (rng.choice(ACTIONS) for _ in range(events)))
+        )
+    database.rebuild_stats_rollups()
+
+
+class NullBot:
+    """Бот без сети для маршрутов bot_handlers: вызовы Bot API ничего не делают"""
+
+    def send_message(self, *args, **kwargs):
+        pass
+
+    def edit_message_text(self, *args, **kwargs):
+        pass
+
+    def answer_callback_query(self, *args, **kwargs):
+        pass
+
+
+def _callback_update(user_id, data):
+    return {'update_id': 1, 'callback_query': {
+        'id': '1', 'chat_instance': str(user_id), 'data': data,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}},
+    }}
+
+
+def _message_update(user_id, text):
+    return {'update_id': 1, 'message': {
+        'message_id': 1, 'date': int(time.time()), 'text': text,
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}],
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': 'bench'},
+    }}
+
+
+def build_benchmarks(users):
+    """{имя: (операция, завершение раунда или None)}"""
+    from telebot import types
+    import app
+    import bot_handlers
+    import content
+    import database
+    import render_cache
+    import webhook_reply
+
+    data = content.get()
+    district_key, district_info = next(
+        (key, info) for key, info in data.districts.items() if 'bases' not in info
+    )
+    base_key, (base_district, base_info) = next(iter(data.bases.items()))
+    user_id = FIRST_USER_ID
+    flush = database.event_writer.flush
+    benchmarks = {}
+
+    # Форматирование и клавиатуры
+    benchmarks['render.format_district_info'] = (lambda: render_cache.format_district_info(district_info), None)
+    benchmarks['render.format_base_info'] = (
+        lambda: render_cache.format_base_info(data.districts[base_district], base_info), None
+    )
+    benchmarks['render.format_payment_info'] = (lambda: render_cache.format_payment_info(data.org), None)
+    benchmarks['keyboard.main_menu'] = (lambda: render_cache.main_menu_keyboard(), None)
+    benchmarks['keyboard.main_menu_admin'] = (lambda: render_cache.main_menu_keyboard(True), None)
+    benchmarks['keyboard.districts'] = (lambda: render_cache.districts_keyboard(data.districts), None)
+    district_keyboard = render_cache.districts_keyboard(data.districts)
+    benchmarks['keyboard.screen'] = (
+        lambda: render_cache.Screen(render_cache.format_district_info(district_info), district_keyboard), None
+    )
+    screen = render_cache.get(f'district_{district_key}')
+    benchmarks['keyboard.screen_payload'] = (lambda: screen.payload(user_id, 1), None)
+    benchmarks['render_cache.get'] = (lambda: render_cache.get(f'base_{base_key}'), None)
+    benchmarks['render_cache.build'] = (lambda: render_cache.build(data), None)
+
+    # Маршрутизация в app.py (вызовы Bot API перехватываются). Каждая итерация -
+    # новое сообщение очередного засеянного пользователя: иначе со второй итерации
+    # срабатывают кэш редактирований и кэш сессий, и замеряется только попадание
+    message_ids = itertools.count(2)
+    visitors = itertools.cycle(range(FIRST_USER_ID, FIRST_USER_ID + users))
+
+    def next_visit(update):
+        query = update.get('callback_query')
+        message = query['message'] if query else update['message']
+        sender = query['from'] if query else message['from']
+        message['message_id'] = next(message_ids)
+        message['chat']['id'] = sender['id'] = next(visitors)
+        return update
+
+    def app_dispatch(update, repeat=False):
+        def op():
+            with webhook_reply.capture():
+                app.dispatch_update(update if repeat else next_visit(update))
+        return op, flush
+
+    benchmarks['app.start'] = app_dispatch(_message_update(user_id, '/start'))
+    benchmarks['app.callback.main_districts'] = app_dispatch(_callback_update(user_id, 'main_districts'))
+    benchmarks['app.callback.district'] = app_dispatch(_callback_update(user_id, f'district_{district_key}'))
+    benchmarks['app.callback.base'] = app_dispatch(_callback_update(user_id, f'base_{base_key}'))
+    benchmarks['app.callback.main_payment'] = app_dispatch(_callback_update(user_id, 'main_payment'))
+    # Повторное нажатие той же кнопки: попадание в кэш редактирований
+    benchmarks['app.callback.district.repeat'] = app_dispatch(
+        _callback_update(user_id, f'district_{district_key}'), repeat=True
+    )
+
+    # Маршрутизация callback-запросов в bot_handlers.py, тоже по новому сообщению на итерацию
+    bot = NullBot()
+
+    def bot_dispatch(callback_data):
+        call = types.CallbackQuery.de_json(_callback_update(user_id, callback_data)['callback_query'])
+
+        def op():
+            visitor = next(visitors)
+            call.message.message_id = next(message_ids)
+            call.message.chat.id = call.from_user.id = visitor
+            bot_handlers.callback_routes.dispatch(call.data, visitor, bot, call)
+        return op, flush
+
+    benchmarks['bot.callback.main_districts'] = bot_dispatch('main_districts')
+    benchmarks['bot.callback.district'] = bot_dispatch(f'district_{district_key}')
+    benchmarks['bot.callback.base'] = bot_dispatch(f'base_{base_key}')
+    benchmarks['bot.callback.main_payment'] = bot_dispatch('main_payment')
+
+    # База данных: запись (включая дозапись очереди) и чтение на засеянной базе
+    new_users = iter(range(FIRST_USER_ID + users, FIRST_USER_ID + 10 * users + 10 ** 7))
+    benchmarks['db.save_user_session.new'] = (
+        lambda: database.save_user_session(next(new_users), 'bench', 'Имя', 'Фамилия'), flush
+    )
+    benchmarks['db.save_user_session.existing'] = (
+        lambda: database.save_user_session(user_id, 'bench', 'Имя', 'Фамилия'), flush
+    )
+    benchmarks['db.log_user_action'] = (lambda: database.log_user_action(user_id, 'payment_info'), flush)
+    benchmarks['db.log_user_action.district'] = (
+        lambda: database.log_user_action(user_id, 'district_select', district=district_key), flush
+    )
+    benchmarks['db.get_statistics'] = (database.get_statistics, None)
+    benchmarks['db.get_user_info'] = (lambda: database.get_user_info(user_id), None)
+    benchmarks['db.get_user_count'] = (database.get_user_count, None)
+    benchmarks['db.get_recent_users'] = (database.get_recent_users, None)
+
+    def drain_recipients():
+        # Поток получателей читается до конца, как при рассылке
+        for _ in database.broadcast_message('benchmark', exclude_admins=True):
+            pass
+
+    benchmarks['db.broadcast_message'] = (drain_recipients, None)
+    return benchmarks
+
+
+def _round(op, finish, loops):
+    started = time.perf_counter()
+    for _ in range(loops):
+        op()
+    if finish is not None:
+        finish()
+    return time.perf_counter() - started
+
+
+def measure(op, finish, rounds, min_time):
+    """Медиана и минимум времени одной операции (мкс) и число операций в раунде"""
+    loops = 1
+    # Калибровка: увеличиваем число операций (не больше чем в 10 раз за шаг),
+    # пока раунд не станет достаточно долгим
+    while True:
+        elapsed = _round(op, finish, loops)
+        if elapsed >= min_time:
+            break
+        loops = min(loops * 10, max(loops * 2, int(loops * 1.2 * min_time / max(elapsed, 1e-9))))
+    timings = [_round(op, finish, loops) / loops * 1e6 for _ in range(rounds)]
+    return {
+        'median_us': round(statistics.median(timings), 3),
+        'min_us': round(min(timings), 3),
+        'loops': loops,
+        'rounds': rounds,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Строки сравнения с базовыми результатами и признак регрессии"""
+    rows = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            rows.append((name, None, result['median_us'], None, False))
+            continue
+        change = result['median_us'] / before['median_us'] - 1 if before['median_us'] else 0.0
+        rows.append((name, before['median_us'], result['median_us'], change, change > threshold))
+    return rows, any(row[-1] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='smaller seeded database (100k events, 10k users)')
+    parser.add_argument('--events', type=int, help='seeded bot_statistics rows (default 1M, quick 100k)')
+    parser.add_argument('--users', type=int, help='seeded users (default 100k, quick 10k)')
+    parser.add_argument('--filter', default='', help='run only benchmarks whose name contains this substring')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.1, help='minimal round duration, seconds')
+    parser.add_argument('--save', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='compare medians with results saved by --save')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative growth of a median')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    events = args.events if args.events is not None else (100_000 if args.quick else 1_000_000)
+    users = args.users if args.users is not None else (10_000 if args.quick else 100_000)
+
+    api = FakeTelegramAPI().start()
+    setup(api)
+    started = time.perf_counter()
+    seed(events, users)
+    if not args.json:
+        print(f"seeded {events} events and {users} users in {time.perf_counter() - started:.1f} s")
+
+    results = {}
+    for name, (op, finish) in build_benchmarks(users).items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(op, finish, args.rounds, args.min_time)
+        if not args.json:
+            result = results[name]
+            print(f"{name:<34} {result['median_us']:>12.2f} us  (min {result['min_us']:.2f}, {result['loops']} loops)")
+
+    report = {
+        'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'events': events,
+        'users': users,
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as out:
+            json.dump(report, out, ensure_ascii=False, indent=2)
+        if not args.json:
+            print(f"results saved to {args.save}")
+
+    import database
+    database.event_writer.close()
+    api.stop()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as saved:
+            baseline = json.load(saved)
+        if (baseline.get('events'), baseline.get('users')) != (events, users):
+            print(f"warning: baseline seeded {baseline.get('events')} events and {baseline.get('users')} users",
+                  file=sys.stderr)
+        rows, regressed = compare(results, baseline, args.threshold)
+        out = sys.stderr if args.json else sys.stdout
+        print(f"\n{'benchmark':<34} {'base us':>12} {'new us':>12} {'change':>8}", file=out)
+        for name, before, after, change, flag in rows:
+            if before is None:
+                print(f"{name:<34} {'-':>12} {after:>12.2f} {'new':>8}", file=out)
+            else:
+                print(f"{name:<34} {before:>12.2f} {after:>12.2f} {change:>+8.1%}{'  REGRESSION' if flag else ''}",
+                      file=out)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
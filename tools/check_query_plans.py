@@ -0,0 +1,56 @@
+"""Проверка планов горячих запросов: ни один не должен читать таблицу целиком.
+
+Запуск из корня репозитория:
+    python tools/check_query_plans.py [--db path/to/bot_data.db]
+
+Без --db схема создается миграциями во временной базе. Код выхода 1,
+если в плане есть полный просмотр таблицы или сортировка во временном B-дереве.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# "SCAN bot_statistics" - полный просмотр; "SCAN t USING INDEX ..." - обход индекса,
+# "SCAN CONSTANT ROW" - SELECT без таблицы
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(?!CONSTANT ROW)\w+$')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY')
+
+
+def check(conn, queries):
+    failures = []
+    for name, (sql, params) in queries.items():
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        problems = [step for step in plan if FULL_SCAN.search(step) or TEMP_SORT.search(step)]
+        status = 'FAIL' if problems else 'ok'
+        print(f"[{status:>4}] {name}: {' | '.join(plan) or '(no table access)'}")
+        if problems:
+            failures.append(name)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='existing database to check (default: fresh migrated database)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = args.db or os.path.join(tmp, 'plans.db')
+
+        import database
+        import broadcast
+        queries = {**database.HOT_QUERIES, **broadcast.HOT_QUERIES}
+        failures = check(database.get_db_connection(), queries)
+        database.close_all_connections()
+
+    if failures:
+        print(f"full table scans in: {', '.join(failures)}")
+        sys.exit(1)
+    print(f"all {len(queries)} hot queries use indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Проверка времени запуска: импорт app.py должен укладываться в бюджет.
+
+Запуск из корня репозитория:
+    python tools/check_startup.py [--budget-ms 1500] [--runs 3]
+
+Импорт выполняется в отдельном процессе с фиктивным токеном и недоступным
+Bot API, так что сеть не влияет на результат; берется лучший из --runs
+запусков. Код выхода 1, если импорт дольше бюджета; тогда печатаются
+самые медленные модули по данным python -X importtime.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = (
+    "import time; started = time.perf_counter(); import app; "
+    "print(round((time.perf_counter() - started) * 1000, 1))"
+)
+
+
+def _env(tmp):
+    env = dict(os.environ)
+    env.update({
+        'BOT_TOKEN': '123456:startup-check',
+        # Порт 9 (discard) закрыт: фоновые запросы к API сразу получают отказ
+        'TELEGRAM_API_BASE': 'http://127.0.0.1:9',
+        'PUBLIC_URL': 'http://127.0.0.1:9',
+        'DB_PATH': os.path.join(tmp, 'startup.db'),
+        'BOOTSTRAP_LOCK_PATH': os.path.join(tmp, 'startup.lock'),
+        'LOG_LEVEL': 'ERROR',
+    })
+    return env
+
+
+def measure(env):
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(f"import app failed with code {result.returncode}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env, limit=15):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+        capture_output=True, text=True, timeout=120
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        self_us, cumulative_us, name = fields
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', 1500)))
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _env(tmp)
+        timings = [measure(env) for _ in range(max(args.runs, 1))]
+        best = min(timings)
+        print(f"import app: {best} ms (runs: {', '.join(map(str, timings))}; budget {args.budget_ms} ms)")
+        if best <= args.budget_ms:
+            return
+
+        print("slowest imports (cumulative ms, self ms):")
+        for cumulative_us, self_us, name in slowest_imports(env):
+            print(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
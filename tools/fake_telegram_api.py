@@ -0,0 +1,197 @@
+"""Локальная замена Bot API для нагрузочных тестов.
+
+Запуск отдельным процессом:
+    python tools/fake_telegram_api.py [--port 8081] [--latency-ms 40] [--jitter-ms 20]
+                                      [--rate-limit 0.01] [--fail 0.005]
+
+Бот направляется на нее переменной TELEGRAM_API_BASE=http://127.0.0.1:8081.
+Поддерживаются sendMessage, editMessageText, answerCallbackQuery, setWebhook,
+getWebhookInfo (и deleteWebhook, getMe); остальные методы отвечают 404.
+Задержка, доля ответов 429 (с retry_after) и доля ответов 500 настраиваются.
+GET /stats отдает счетчики вызовов по методам и статусам.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+_PATH = re.compile(r'^/bot[^/]+/(\w+)$')
+
+_STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error'}
+
+
+class FakeTelegramAPI:
+    """HTTP-сервер в фоновом потоке, отвечающий как Bot API"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0,
+                 rate_limit=0.0, retry_after=1, fail=0.0, seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.fail = fail
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_ids = Counter()
+        self._webhook_url = ''
+        self.calls = Counter()
+        self.statuses = Counter()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-telegram-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'statuses': {str(k): v for k, v in self.statuses.items()}}
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random(), self._random.uniform(-1, 1)
+
+    def respond(self, method, params):
+        """(HTTP-статус, тело ответа) для вызова method"""
+        chance, spread = self._draw()
+        delay = self.latency + self.jitter * spread
+        if delay > 0:
+            time.sleep(delay)
+
+        if chance < self.rate_limit:
+            status, body = 429, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+        elif chance < self.rate_limit + self.fail:
+            status, body = 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        else:
+            status, body = self._result(method, params)
+
+        with self._lock:
+            self.calls[method] += 1
+            self.statuses[status] += 1
+        return status, body
+
+    def _result(self, method, params):
+        if method in ('sendMessage', 'editMessageText'):
+            try:
+                chat_id = int(params.get('chat_id'))
+            except (TypeError, ValueError):
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'}
+            if method == 'sendMessage':
+                with self._lock:
+                    self._message_ids[chat_id] += 1
+                    message_id = self._message_ids[chat_id]
+            else:
+                message_id = params.get('message_id', 1)
+            return 200, {'ok': True, 'result': {
+                'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+                'text': params.get('text', ''),
+            }}
+        if method in ('answerCallbackQuery', 'deleteWebhook'):
+            return 200, {'ok': True, 'result': True}
+        if method == 'setWebhook':
+            with self._lock:
+                self._webhook_url = params.get('url', '')
+            return 200, {'ok': True, 'result': True, 'description': 'Webhook was set'}
+        if method == 'getWebhookInfo':
+            with self._lock:
+                url = self._webhook_url
+            return 200, {'ok': True, 'result': {'url': url, 'has_custom_certificate': False, 'pending_update_count': 0}}
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}}
+        return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # TCP_NODELAY: ответ уходит одним сегментом без задержки Нейгла
+            disable_nagle_algorithm = True
+
+            def _params(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    content_type = self.headers.get('Content-Type', '')
+                    if content_type.startswith('application/json'):
+                        params.update(json.loads(body))
+                    elif content_type.startswith('application/x-www-form-urlencoded'):
+                        params.update(parse_qsl(body.decode()))
+                return url.path, params
+
+            def _send(self, status, body):
+                payload = json.dumps(body, ensure_ascii=False).encode()
+                # Заголовки и тело - одной записью в сокет
+                head = (
+                    f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n"
+                ).encode()
+                self.wfile.write(head + payload)
+
+            def _handle(self):
+                path, params = self._params()
+                if path == '/stats':
+                    return self._send(200, api.stats())
+                match = _PATH.match(path)
+                if match is None:
+                    return self._send(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                self._send(*api.respond(match.group(1), params))
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added delay per call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform +/- spread of the delay')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='share of calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--fail', type=float, default=0.0, help='share of calls answered with 500')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI(args.host, args.port, args.latency_ms, args.jitter_ms,
+                          args.rate_limit, args.retry_after, args.fail, args.seed).start()
+    print(f"fake Bot API on {api.url} (TELEGRAM_API_BASE={api.url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(api.stats(), indent=2))
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Нагрузочный тест: поток обновлений в /webhook app.py или в обработчики bot_handlers.py.
+
+Запуск из корня репозитория:
+    python tools/loadtest.py [--target app|bot] [--updates 2000] [--concurrency 16] [--chats 500]
+                             [--rate 0] [--capture updates.jsonl.gz] [--url http://host:port/webhook]
+                             [--latency-ms 40] [--rate-limit 0.01] [--fail 0.005]
+                             [--telegram-limits] [--json]
+
+По умолчанию бот и замена Bot API (tools/fake_telegram_api.py) запускаются в этом
+процессе с временной базой. --url отправляет обновления на уже запущенный сервер
+(его TELEGRAM_API_BASE должен указывать на fake_telegram_api.py). Обновления -
+синтетические (меню, районы, базы, оплата, FAQ от --chats разных пользователей)
+либо из записи вебхука --capture (WEBHOOK_RECORD_PATH, см. tools/replay.py).
+
+Лимиты отправки Telegram (30 сообщений/с на бота, 1/с на чат) по умолчанию
+сняты, иначе тест измеряет их, а не бота; --telegram-limits оставляет их.
+
+Отчет: пропускная способность приема и полной обработки, p50/p95/p99 времени
+ответа, доля ошибок, ошибки блокировки SQLite и вызовы Bot API.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram_api import FakeTelegramAPI  # noqa: E402
+
+_workdir = None
+
+# Первый синтетический chat_id: не пересекается с администраторами из ADMINS
+FIRST_CHAT_ID = 10_000_000
+
+# Доли действий в синтетическом трафике
+MIX = (
+    ('start', 15),
+    ('main_districts', 10),
+    ('district', 20),
+    ('base', 15),
+    ('main_payment', 10),
+    ('main_faq', 10),
+    ('main_documents', 5),
+    ('back_to_main', 10),
+    ('text', 5),
+)
+
+
+def _message(update_id, chat_id, text):
+    entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': text, 'entities': entities,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{chat_id}'},
+    }}
+
+
+def _callback(update_id, chat_id, data):
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'chat_instance': str(chat_id), 'data': data,
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+        'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}},
+    }}
+
+
+def synthetic_updates(count, chats, seed=1):
+    import content
+    districts = list(content.get().districts)
+    bases = list(content.get().bases)
+    rng = random.Random(seed)
+    actions, weights = zip(*MIX)
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = FIRST_CHAT_ID + rng.randrange(chats)
+        action = rng.choices(actions, weights)[0]
+        if action == 'start':
+            updates.append(_message(update_id, chat_id, '/start'))
+        elif action == 'text':
+            updates.append(_message(update_id, chat_id, 'Здравствуйте! Когда тренировки?'))
+        elif action == 'district':
+            updates.append(_callback(update_id, chat_id, f'district_{rng.choice(districts)}'))
+        elif action == 'base':
+            updates.append(_callback(update_id, chat_id, f'base_{rng.choice(bases)}'))
+        else:
+            updates.append(_callback(update_id, chat_id, action))
+    return updates
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(fraction):
+        return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 2)
+
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': round(ordered[-1] * 1000, 2)}
+
+
+class _LockErrors(logging.Handler):
+    """Считает записи лога об ошибках блокировки SQLite"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        text = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            text += str(record.exc_info[1])
+        if 'database is locked' in text or 'database table is locked' in text:
+            self.count += 1
+
+
+def _http_sender(url):
+    import requests
+    local = threading.local()
+
+    def send(update):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        response = session.post(url, json=update, timeout=30)
+        return response.status_code
+    return send
+
+
+def _bot_sender(api_url):
+    import telebot
+    from telebot import apihelper, types
+    import bot_handlers
+    apihelper.API_URL = api_url + '/bot{0}/{1}'
+    bot = telebot.TeleBot(os.environ['BOT_TOKEN'], threaded=False)
+    bot_handlers.setup_bot_handlers(bot)
+
+    def send(update):
+        bot.process_new_updates([types.Update.de_json(update)])
+        return 200
+    return send
+
+
+def drive(send, updates, concurrency, offsets=None):
+    """Отправляет обновления из concurrency потоков; offsets - секунды от начала для каждого обновления"""
+    jobs = queue.Queue()
+    for index, update in enumerate(updates):
+        jobs.put((index, update))
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker():
+        while True:
+            try:
+                index, update = jobs.get_nowait()
+            except queue.Empty:
+                return
+            if offsets:
+                delay = started + offsets[index] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                status = str(send(update))
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - sent
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker, name=f'load-{n}') for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, statuses
+
+
+def add_arguments(parser):
+    """Общие параметры нагрузочного теста и воспроизведения записи"""
+    parser.add_argument('--target', choices=('app', 'bot'), default='app')
+    parser.add_argument('--url', help='webhook URL of a running app (default: app in this process)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='fake Bot API delay per call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='share of Bot API calls answered 429')
+    parser.add_argument('--fail', type=float, default=0.0, help='share of Bot API calls answered 500')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--telegram-limits', action='store_true', help='keep Bot API rate limits of the bot')
+
+
+def setup(args, count):
+    """Запускает замену Bot API и настраивает окружение бота; вызывать до импорта модулей бота"""
+    api = FakeTelegramAPI(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          rate_limit=args.rate_limit, fail=args.fail, seed=args.seed).start()
+    # Временная база и блокировка живут до конца процесса
+    global _workdir
+    _workdir = tempfile.TemporaryDirectory()
+    tmp = _workdir.name
+    for key, value in {
+        'BOT_TOKEN': '123456:loadtest',
+        'TELEGRAM_API_BASE': api.url,
+        'PUBLIC_URL': api.url,
+        'DB_PATH': os.path.join(tmp, 'loadtest.db'),
+        'BOOTSTRAP_LOCK_PATH': os.path.join(tmp, 'loadtest.lock'),
+        'LOG_LEVEL': 'WARNING',
+        'TRACE_STAGE_SAMPLES': str(max(count, 1000)),
+    }.items():
+        os.environ.setdefault(key, value)
+    if not args.telegram_limits:
+        for key in ('TELEGRAM_RATE_GLOBAL', 'TELEGRAM_RATE_CHAT', 'TELEGRAM_RATE_GROUP_PER_MINUTE'):
+            os.environ.setdefault(key, '1000000')
+    return api
+
+
+def run(args, api, updates, offsets=None):
+    """Отправляет updates боту, работающему с заменой Bot API api, и возвращает отчет"""
+    lock_errors = _LockErrors()
+    app = None
+    if args.url:
+        send = _http_sender(args.url)
+    elif args.target == 'bot':
+        send = _bot_sender(api.url)
+    else:
+        from werkzeug.serving import make_server
+        import app
+        server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+        # Строка access-лога на каждый запрос заметно тормозит сам тест
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        send = _http_sender(f"http://127.0.0.1:{server.server_port}/webhook")
+    logging.getLogger().addHandler(lock_errors)
+
+    started = time.perf_counter()
+    send_elapsed, latencies, statuses = drive(send, updates, args.concurrency, offsets)
+    drained = True
+    if app is not None:
+        # Прием в очередь закончен; ждем, пока воркеры разберут обновления
+        drained = app.update_queue.join(timeout=120)
+    if not args.url:
+        import database
+        database.event_writer.flush()
+    total_elapsed = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if status != '200')
+    report = {
+        'target': args.url or args.target,
+        'updates': len(updates),
+        'concurrency': args.concurrency,
+        'accept_per_sec': round(len(updates) / send_elapsed, 1),
+        'processed_per_sec': round(len(updates) / total_elapsed, 1),
+        'drained': drained,
+        'latency_ms': percentiles(latencies),
+        'error_rate': round(errors / len(updates), 4) if updates else 0.0,
+        'statuses': statuses,
+        'db_lock_errors': lock_errors.count,
+        'telegram_api': api.stats(),
+        'latencies': latencies,
+    }
+    if not args.url:
+        import tracing
+        stages = tracing.get_stats()['stages']
+        # Полное время обновления: от приема до завершения обработчика
+        if 'total' in stages:
+            report['end_to_end_ms'] = stages['total']
+    api.stop()
+    return report
+
+
+def print_report(report):
+    print(f"target           {report['target']} ({report['updates']} updates, concurrency {report['concurrency']})")
+    print(f"accepted         {report['accept_per_sec']} updates/s")
+    print(f"processed        {report['processed_per_sec']} updates/s{'' if report['drained'] else ' (queue not drained!)'}")
+    print(f"latency ms       {report['latency_ms']}")
+    if 'end_to_end_ms' in report:
+        print(f"end-to-end ms    {report['end_to_end_ms']}")
+    print(f"error rate       {report['error_rate']} {report['statuses']}")
+    print(f"db lock errors   {report['db_lock_errors']}")
+    print(f"Bot API calls    {report['telegram_api']['calls']} statuses {report['telegram_api']['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=0, help='updates per second (0 - as fast as possible)')
+    parser.add_argument('--capture', help='recorded updates (JSONL or JSONL.gz) instead of synthetic ones')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    api = setup(args, args.updates)
+    if args.capture:
+        import recorder
+        updates = [update for _, update in recorder.read(args.capture, renumber=True)][:args.updates]
+    else:
+        updates = synthetic_updates(args.updates, args.chats, args.seed)
+    offsets = [index / args.rate for index in range(len(updates))] if args.rate else None
+
+    report = run(args, api, updates, offsets)
+    report.pop('latencies')
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Воспроизведение записи вебхука и сравнение задержек двух прогонов.
+
+Запуск из корня репозитория:
+    python tools/replay.py play capture.jsonl.gz [--speed 1] [--out run.json] [--target app|bot] ...
+    python tools/replay.py compare base.json new.json [--threshold 0.15] [--min-ms 1]
+
+play проигрывает запись (WEBHOOK_RECORD_PATH) через стенд tools/loadtest.py
+с заменой Bot API: с исходными паузами между обновлениями, в --speed раз
+быстрее или, при --speed 0, без пауз. Отчет с задержками сохраняется в --out.
+
+compare сравнивает p50/p90/p95/p99 времени ответа и полной обработки двух
+отчетов. Код выхода 1, если перцентиль вырос больше чем на --threshold
+(доля) и одновременно больше чем на --min-ms миллисекунд.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import loadtest  # noqa: E402
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def _percentiles(values_ms):
+    ordered = sorted(values_ms)
+    if not ordered:
+        return {}
+    return {
+        f'p{round(fraction * 100)}': ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+        for fraction in PERCENTILES
+    }
+
+
+def play(args):
+    # Длина записи станет известна после импорта модулей бота: выборки этапов с запасом
+    api = loadtest.setup(args, 100_000)
+    import recorder
+    entries = list(recorder.read(args.capture, renumber=True))
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        sys.exit(f"no updates in {args.capture}")
+
+    offsets = None
+    times = [received for received, _ in entries]
+    if args.speed > 0 and None not in times:
+        first = times[0]
+        offsets = [(received - first) / args.speed for received in times]
+        print(f"replaying {len(entries)} updates over {offsets[-1]:.1f} s (speed x{args.speed})")
+    else:
+        print(f"replaying {len(entries)} updates without pauses")
+
+    report = loadtest.run(args, api, [update for _, update in entries], offsets)
+    latencies = report.pop('latencies')
+    loadtest.print_report(report)
+
+    report.update({
+        'capture': args.capture,
+        'speed': args.speed,
+        'latencies_ms': [round(value * 1000, 3) for value in latencies],
+    })
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as out:
+            json.dump(report, out, ensure_ascii=False)
+        print(f"report saved to {args.out}")
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as report:
+        return json.load(report)
+
+
+def compare(args):
+    base, new = _load(args.base), _load(args.new)
+    rows = []
+    for metric, base_values, new_values in (
+        ('latency', _percentiles(base['latencies_ms']), _percentiles(new['latencies_ms'])),
+        ('end_to_end', base.get('end_to_end_ms') or {}, new.get('end_to_end_ms') or {}),
+    ):
+        for name in ('p50', 'p90', 'p95', 'p99'):
+            if name not in base_values or name not in new_values:
+                continue
+            before, after = base_values[name], new_values[name]
+            change = (after - before) / before if before else 0.0
+            regressed = change > args.threshold and after - before > args.min_ms
+            rows.append((metric, name, before, after, change, regressed))
+
+    print(f"{'metric':<12} {'pct':<4} {'base ms':>10} {'new ms':>10} {'change':>8}")
+    for metric, name, before, after, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{metric:<12} {name:<4} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{flag}")
+    for key in ('error_rate', 'db_lock_errors', 'processed_per_sec'):
+        print(f"{key:<17} {base.get(key)} -> {new.get(key)}")
+
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    play_parser = commands.add_parser('play', help='replay a capture against the bot')
+    play_parser.add_argument('capture')
+    play_parser.add_argument('--speed', type=float, default=1.0, help='pacing multiplier (0 - no pauses)')
+    play_parser.add_argument('--limit', type=int, help='replay only the first N updates')
+    play_parser.add_argument('--out', help='save the report with raw latencies to this JSON file')
+    loadtest.add_arguments(play_parser)
+
+    compare_parser = commands.add_parser('compare', help='compare latency distributions of two reports')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.15, help='allowed relative growth')
+    compare_parser.add_argument('--min-ms', type=float, default=1.0, help='ignore smaller absolute growth')
+
+    args = parser.parse_args()
+    if args.command == 'play':
+        play(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+
+from config import TRACE_ENABLED, TRACE_SLOW_MS, TRACE_SLOW_BUFFER, TRACE_STAGE_SAMPLES
+
+# Трассировка обновлений: каждое обновление - Trace со списком этапов (span).
+# Этапы пишут webhook(), маршрутизатор, обращения к базе и вызовы Bot API.
+# Медленные обновления целиком попадают в кольцевой буфер, длительности
+# этапов - в выборки для перцентилей на /debug.
+#
+# Выключенная трассировка не создает Trace: span() возвращает общий
+# пустой контекст, traced() оставляет функцию без обертки.
+
+_current = contextvars.ContextVar('trace', default=None)
+_NOOP = nullcontext()
+
+_lock = threading.Lock()
+_slow = deque(maxlen=TRACE_SLOW_BUFFER)
+_stages = {}
+_stats = {'traced': 0, 'slow': 0}
+
+
+class Trace:
+    """Этапы обработки одного обновления: (имя, начало, длительность, вложенность)"""
+
+    __slots__ = ('name', 'update_id', 'started', 'wall', 'spans', 'depth', 'duration', '_handoff')
+
+    def __init__(self, name, update_id=None):
+        self.name = name
+        self.update_id = update_id
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.spans = []
+        self.depth = 0
+        self.duration = None
+        self._handoff = None
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def handoff(self):
+        """Отмечает передачу обновления в очередь; время до resume() - этап queue_wait"""
+        self._handoff = time.perf_counter()
+
+    def resume(self):
+        if self._handoff is not None:
+            now = time.perf_counter()
+            self.spans.append(('queue_wait', self._handoff - self.started, now - self._handoff, 0))
+            self._handoff = None
+
+    def finish(self):
+        duration = self.duration = time.perf_counter() - self.started
+        totals = {'total': duration}
+        for name, _, spent, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + spent
+        slow = duration * 1000 >= TRACE_SLOW_MS
+        with _lock:
+            _stats['traced'] += 1
+            for name, spent in totals.items():
+                samples = _stages.get(name)
+                if samples is None:
+                    samples = _stages[name] = deque(maxlen=TRACE_STAGE_SAMPLES)
+                samples.append(spent)
+            if slow:
+                _stats['slow'] += 1
+                _slow.append(self)
+        return duration
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'update_id': self.update_id,
+            'at': round(self.wall, 3),
+            'ms': round(self.duration * 1000, 2),
+            'spans': [
+                {'name': name, 'start_ms': round(offset * 1000, 2), 'ms': round(spent * 1000, 2), 'depth': depth}
+                for name, offset, spent, depth in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.trace.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        trace = self.trace
+        trace.depth -= 1
+        trace.spans.append((self.name, self.started - trace.started, time.perf_counter() - self.started, trace.depth))
+
+
+def start(name, update_id=None):
+    """Новая трасса или None, если трассировка выключена"""
+    return Trace(name, update_id) if TRACE_ENABLED else None
+
+
+def activate(trace):
+    """Делает trace текущей в этом потоке: span() внутри блока пишут в нее"""
+    if trace is None:
+        return _NOOP
+    return _Activation(trace)
+
+
+class _Activation:
+    __slots__ = ('trace', 'token')
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+
+
+def span(name):
+    """Этап текущей трассы; без трассы - пустой контекст"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+
+def spanned(name):
+    """Декоратор: вызов функции - этап name текущей трассы (новую трассу не начинает)"""
+    def decorator(func):
+        if not TRACE_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _Span(trace, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced(name):
+    """Декоратор обработчика: этап name текущей трассы либо отдельная трасса, если ее нет"""
+    def decorator(func):
+        if not TRACE_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is not None:
+                with _Span(trace, name):
+                    return func(*args, **kwargs)
+            # Обработчики pyTelegramBotAPI выполняются в его пуле потоков:
+            # трасса начинается в самом обработчике
+            trace = Trace(name)
+            token = _current.set(trace)
+            try:
+                with _Span(trace, name):
+                    return func(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                trace.finish()
+        return wrapper
+    return decorator
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def get_stats(limit=10):
+    """Перцентили этапов (мс) и самые медленные из недавних обновлений"""
+    with _lock:
+        stats = dict(_stats)
+        stages = {name: sorted(samples) for name, samples in _stages.items()}
+        slow = list(_slow)
+    stats.update({
+        'enabled': TRACE_ENABLED,
+        'slow_ms': TRACE_SLOW_MS,
+        'stages': {
+            name: {
+                'count': len(ordered),
+                'p50': round(_percentile(ordered, 0.5) * 1000, 2),
+                'p95': round(_percentile(ordered, 0.95) * 1000, 2),
+                'p99': round(_percentile(ordered, 0.99) * 1000, 2),
+                'max': round(ordered[-1] * 1000, 2),
+            }
+            for name, ordered in sorted(stages.items()) if ordered
+        },
+        'slowest': [trace.to_dict() for trace in sorted(slow, key=lambda trace: trace.duration, reverse=True)[:limit]],
+    })
+    return stats
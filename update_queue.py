@@ -0,0 +1,134 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Очередь обновлений переполнена"""
+
+
+class UpdateQueue:
+    """Ограниченная очередь обновлений с пулом воркеров.
+
+    Обновления одного чата всегда попадают к одному воркеру и выполняются
+    по порядку, разные чаты обрабатываются параллельно.
+    """
+
+    def __init__(self, workers=4, maxsize=1000, put_timeout=2.0):
+        self.workers = max(int(workers), 1)
+        self.maxsize = max(int(maxsize), 1)
+        self.put_timeout = put_timeout
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Потоки родителя не переживают fork, начинаем с чистой очереди
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._threads = []
+        shard_size = max(self.maxsize // self.workers, 1)
+        self._shards = [queue.Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self._pending = {}
+        self._stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'rejected': 0,
+            'failed': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for index, shard in enumerate(self._shards):
+                thread = threading.Thread(
+                    target=self._worker_loop, args=(shard,),
+                    name=f"update-worker-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"🧵 Update workers started: {self.workers} (pid {os.getpid()})")
+
+    def _shard_for(self, chat_id):
+        return self._shards[hash(chat_id) % self.workers]
+
+    def submit(self, chat_id, func, *args):
+        """Ставит задачу чата в очередь; при переполнении ждет put_timeout и бросает QueueFull"""
+        self._ensure_started()
+        with self._lock:
+            self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+        try:
+            self._shard_for(chat_id).put((time.monotonic(), chat_id, func, args), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._release(chat_id)
+                self._stats['rejected'] += 1
+            raise QueueFull(f"update queue is full ({self.maxsize})")
+        with self._lock:
+            self._stats['enqueued'] += 1
+
+    def _release(self, chat_id):
+        left = self._pending.get(chat_id, 0) - 1
+        if left > 0:
+            self._pending[chat_id] = left
+        else:
+            self._pending.pop(chat_id, None)
+
+    def is_idle(self, chat_id):
+        """Нет ли у чата необработанных обновлений в очереди"""
+        return chat_id not in self._pending
+
+    def _worker_loop(self, shard):
+        while True:
+            enqueued_at, chat_id, func, args = shard.get()
+            wait = time.monotonic() - enqueued_at
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"❌ Update handler error: {e}", exc_info=True)
+                with self._lock:
+                    self._stats['failed'] += 1
+            finally:
+                with self._lock:
+                    self._release(chat_id)
+                    self._stats['processed'] += 1
+                    self._stats['wait_total'] += wait
+                    self._stats['wait_max'] = max(self._stats['wait_max'], wait)
+                shard.task_done()
+
+    def depth(self):
+        return sum(shard.qsize() for shard in self._shards)
+
+    def join(self, timeout=None):
+        """Ждет, пока все поставленные задачи выполнятся; False, если не дождались за timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def get_stats(self):
+        """Глубина очереди и время ожидания обновлений"""
+        with self._lock:
+            stats = dict(self._stats)
+        processed = stats.pop('processed')
+        wait_total = stats.pop('wait_total')
+        stats.update({
+            'processed': processed,
+            'depth': self.depth(),
+            'shard_depths': [shard.qsize() for shard in self._shards],
+            'capacity': self.maxsize,
+            'workers': self.workers,
+            'wait_avg_ms': round(wait_total / processed * 1000, 2) if processed else 0.0,
+            'wait_max_ms': round(stats.pop('wait_max') * 1000, 2),
+        })
+        return stats
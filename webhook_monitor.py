@@ -0,0 +1,128 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+import metrics
+import telegram_client
+from config import WEBHOOK_MONITOR_INTERVAL, WEBHOOK_MONITOR_HISTORY, WEBHOOK_BACKLOG_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookMonitor:
+    """Фоновый опрос getWebhookInfo: /debug читает последний ответ из памяти.
+
+    Хранит короткий ряд замеров pending_update_count и последней ошибки
+    вебхука. Если очередь Telegram растет backlog_samples замеров подряд,
+    мы не успеваем разбирать обновления - это флаг backlog_growing.
+    """
+
+    def __init__(self, interval, history, backlog_samples):
+        self.interval = interval
+        self.backlog_samples = max(int(backlog_samples), 2)
+        self.history = max(int(history), self.backlog_samples)
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Поток опроса не переживает fork
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._samples = deque(maxlen=self.history)
+        self._info = None
+        self._checked_at = None
+        self._error = None
+        self._growing = False
+        self._stats = {'polls': 0, 'failures': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='webhook-monitor', daemon=True)
+            self._thread.start()
+        logger.info(f"🩺 Webhook monitor started (every {self.interval}s)")
+
+    def _loop(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        """Один запрос getWebhookInfo; ошибки запроса сохраняются для /debug"""
+        try:
+            data = telegram_client.get('getWebhookInfo').json()
+            if not data.get('ok'):
+                raise ValueError(data.get('description', 'getWebhookInfo failed'))
+        except Exception as e:
+            with self._lock:
+                self._stats['polls'] += 1
+                self._stats['failures'] += 1
+                self._error = str(e)
+            logger.warning(f"⚠️ getWebhookInfo failed: {e}")
+            return
+
+        info = data.get('result') or {}
+        sample = {
+            'at': int(time.time()),
+            'pending_update_count': info.get('pending_update_count', 0),
+            'last_error_date': info.get('last_error_date'),
+            'last_error_message': info.get('last_error_message'),
+        }
+        with self._lock:
+            previous = self._samples[-1] if self._samples else None
+            self._samples.append(sample)
+            self._info = info
+            self._checked_at = time.time()
+            self._error = None
+            self._stats['polls'] += 1
+            was_growing = self._growing
+            self._growing = self._is_growing()
+            growing = self._growing
+
+        if sample['last_error_date'] and (previous is None or previous['last_error_date'] != sample['last_error_date']):
+            logger.warning(f"⚠️ Telegram reports webhook error: {sample['last_error_message']}")
+        if growing and not was_growing:
+            logger.warning(f"📈 Webhook backlog is growing: {sample['pending_update_count']} pending updates")
+        elif was_growing and not growing:
+            logger.info(f"📉 Webhook backlog stopped growing: {sample['pending_update_count']} pending updates")
+
+    def _is_growing(self):
+        if len(self._samples) < self.backlog_samples:
+            return False
+        counts = [sample['pending_update_count'] for sample in list(self._samples)[-self.backlog_samples:]]
+        return all(later > earlier for earlier, later in zip(counts, counts[1:]))
+
+    def latest(self):
+        with self._lock:
+            return self._samples[-1] if self._samples else None
+
+    def backlog_growing(self):
+        return self._growing
+
+    def get_info(self):
+        """Последний ответ getWebhookInfo, его возраст и ряд замеров"""
+        with self._lock:
+            checked_at = self._checked_at
+            return {
+                'webhook_info': self._info,
+                'checked_at': round(checked_at, 3) if checked_at else None,
+                'age_seconds': round(time.time() - checked_at, 1) if checked_at else None,
+                'error': self._error,
+                'backlog_growing': self._growing,
+                'history': list(self._samples),
+                **self._stats,
+            }
+
+
+monitor = WebhookMonitor(WEBHOOK_MONITOR_INTERVAL, WEBHOOK_MONITOR_HISTORY, WEBHOOK_BACKLOG_SAMPLES)
+
+metrics.Gauge('bot_webhook_pending_updates', 'Updates Telegram is holding for the webhook (last getWebhookInfo).',
+              lambda: (monitor.latest() or {}).get('pending_update_count'))
+metrics.Gauge('bot_webhook_backlog_growing', '1 if pending_update_count grew over the last several polls.',
+              lambda: int(monitor.backlog_growing()))
+metrics.Gauge('bot_webhook_last_error_timestamp_seconds', 'Date of the last webhook delivery error reported by Telegram.',
+              lambda: (monitor.latest() or {}).get('last_error_date'))
@@ -0,0 +1,38 @@
+import json
+import threading
+from contextlib import contextmanager
+
+# Telegram позволяет вернуть один вызов Bot API прямо в ответе на вебхук:
+# https://core.telegram.org/bots/api#making-requests-when-getting-updates
+
+_local = threading.local()
+
+
+@contextmanager
+def capture():
+    """Собирает вызовы Bot API текущего потока вместо их отправки"""
+    calls = []
+    _local.calls = calls
+    try:
+        yield calls
+    finally:
+        _local.calls = None
+
+
+def defer(method, payload):
+    """Откладывает вызов, если включен перехват; иначе возвращает False"""
+    calls = getattr(_local, 'calls', None)
+    if calls is None:
+        return False
+    calls.append((method, payload))
+    return True
+
+
+def build_response(method, payload):
+    """Тело ответа на вебхук (bytes) с вызовом метода Bot API"""
+    if isinstance(payload, bytes):
+        # Готовое тело из кэша экранов: дописываем method в начало объекта
+        return b'{"method":"%s",' % method.encode('ascii') + payload[1:]
+    response = dict(payload)
+    response['method'] = method
+    return json.dumps(response, ensure_ascii=False).encode('utf-8')